@@ -12,7 +12,7 @@ class Zeus:
         self.url = "https://wenxin.baidu.com/younger/portal/api/rest/1.0/ernie/3.0/zeus"
         self.access_token = os.environ.get('baidu_access_token')
 
-    def get_response(self, text):
+    def get_response(self, text, stop_token='”', timeout=60):
         payload = {
             'text': text,
             'seq_len': 256,
@@ -20,11 +20,11 @@ class Zeus:
             'dataset_prompt': '',
             'access_token': self.access_token,
             'topk': 10,
-            'stop_token': '”',
+            'stop_token': stop_token,
             'is_unidirectional': 1
         }
 
-        response = requests.request("POST", self.url, data=payload)
+        response = requests.request("POST", self.url, data=payload, timeout=timeout)
         response_text = json.loads(response.text)
         if response_text['code'] == 4001:
             print("请求参数格式错误，不是标准的JSON格式")
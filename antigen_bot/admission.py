@@ -0,0 +1,59 @@
+"""backlog aware admission control for the expensive message features"""
+from __future__ import annotations
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+# the features are shed in this order when the backlog grows, the sensitive
+# word filter and the explicit commands are never shed
+SHED_ORDER: Tuple[str, ...] = ('quanjia', 'docfaq', 'intent')
+DEFAULT_THRESHOLDS: Tuple[int, ...] = (20, 50, 100)
+
+
+def thresholds_from_env(name: str = 'CA_SHED_THRESHOLDS') -> Optional[List[int]]:
+    """parse the thresholds like `20,50,100` from the environment"""
+    value = os.environ.get(name)
+    if not value:
+        return None
+    return [int(item) for item in value.split(',')]
+
+
+class LoadShedder:
+    """skip the expensive features in tiers when the message backlog grows
+
+    tier 0: everything runs
+    tier 1: skip the generative `quanjia` reply
+    tier 2: also skip the DocFAQ (Baidu UNIT) search
+    tier 3: also skip the intent detection of the non-@ messages
+    """
+    def __init__(self, load: Callable[[], int], thresholds: Optional[List[int]] = None) -> None:
+        thresholds = list(thresholds or DEFAULT_THRESHOLDS)
+        if len(thresholds) != len(SHED_ORDER):
+            raise ValueError(f'thresholds should have {len(SHED_ORDER)} values for {SHED_ORDER}')
+        if thresholds != sorted(thresholds):
+            raise ValueError('thresholds should be ascending')
+
+        self.load = load
+        self.thresholds = thresholds
+        self.counters: Dict[str, Dict[str, int]] = {feature: {'admitted': 0, 'shed': 0} for feature in SHED_ORDER}
+
+    def tier(self) -> int:
+        """the number of the features being shed under the current load"""
+        load = self.load()
+        return sum(1 for threshold in self.thresholds if load >= threshold)
+
+    def admit(self, feature: str) -> bool:
+        """check if the feature may run now, and count the decision"""
+        if feature not in self.counters:
+            raise ValueError(f'unknown feature: {feature}, should be one of {SHED_ORDER}')
+
+        admitted = SHED_ORDER.index(feature) >= self.tier()
+        self.counters[feature]['admitted' if admitted else 'shed'] += 1
+        return admitted
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'load': self.load(),
+            'tier': self.tier(),
+            'thresholds': self.thresholds,
+            'features': self.counters,
+        }
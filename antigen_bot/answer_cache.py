@@ -0,0 +1,132 @@
+"""per-owner cache of the resolved FAQ answers and per-room cache of the misses"""
+from __future__ import annotations
+import time
+from typing import Any, Callable, Dict, FrozenSet, List, Optional
+
+from antigen_bot.cache import TTLCache
+from antigen_bot.utils import normalize_text
+
+
+class AnswerCache:
+    """resolved answers keyed by the normalized question, one LRU/TTL cache per owner
+
+    the value is whatever the FAQ pipeline resolved, e.g. the matched text and
+    media questions or the DocFAQ reply. The whole cache of an owner is
+    dropped when the owner records or changes a Q/A.
+    """
+    def __init__(self, max_size: int = 1000, ttl: Optional[float] = 3600) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._owners: Dict[str, TTLCache[str, Dict[str, Any]]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, owner: str, text: str) -> Optional[Dict[str, Any]]:
+        key = normalize_text(text)
+        cache = self._owners.get(owner)
+        answer = cache.get(key) if key and cache is not None else None
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer
+
+    def set(self, owner: str, text: str, answer: Dict[str, Any]) -> None:
+        key = normalize_text(text)
+        if not key or not answer:
+            return
+        cache = self._owners.get(owner)
+        if cache is None:
+            cache = self._owners[owner] = TTLCache(self.max_size, self.ttl)
+        cache.set(key, answer)
+
+    def invalidate(self, owner: str) -> None:
+        """drop the cached answers of the owner"""
+        if self._owners.pop(owner, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'owners': len(self._owners),
+            'size': sum(len(cache) for cache in self._owners.values()),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'invalidations': self.invalidations,
+        }
+
+
+class NegativeCache:
+    """recently unanswerable questions of each room, with near-duplicate folding
+
+    a question whose character bigrams overlap an entry by at least
+    `similarity` (jaccard) is folded into that entry's counter instead of
+    being searched again. Entries expire after `ttl` seconds and are dropped
+    when the room owner records an answer.
+    """
+    def __init__(self, ttl: float = 6 * 3600, max_size: int = 200, similarity: float = 0.8, clock: Callable[[], float] = time.monotonic) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self.similarity = similarity
+        self._clock = clock
+        self._rooms: Dict[str, List[Dict[str, Any]]] = {}
+        self._owners: Dict[str, str] = {}
+
+        self.misses = 0
+        self.folded = 0
+
+    @staticmethod
+    def _grams(text: str) -> FrozenSet[str]:
+        text = normalize_text(text)
+        if len(text) < 2:
+            return frozenset([text])
+        return frozenset(text[i:i + 2] for i in range(len(text) - 1))
+
+    def _entries(self, room_id: str) -> List[Dict[str, Any]]:
+        now = self._clock()
+        entries = [entry for entry in self._rooms.get(room_id, []) if now - entry['time'] < self.ttl]
+        if entries:
+            self._rooms[room_id] = entries
+        else:
+            self._rooms.pop(room_id, None)
+            self._owners.pop(room_id, None)
+        return entries
+
+    def fold(self, room_id: str, text: str) -> Optional[Dict[str, Any]]:
+        """count the question into its near-duplicate entry, None if there is none"""
+        grams = self._grams(text)
+        for entry in self._entries(room_id):
+            union = len(grams | entry['grams'])
+            if union and len(grams & entry['grams']) / union >= self.similarity:
+                entry['count'] += 1
+                self.folded += 1
+                return entry
+        return None
+
+    def add(self, room_id: str, text: str, owner: str) -> Dict[str, Any]:
+        """record the unanswerable question"""
+        entry = {'text': text, 'grams': self._grams(text), 'count': 1, 'time': self._clock()}
+        entries = self._entries(room_id)
+        entries.append(entry)
+        del entries[:-self.max_size]
+        self._rooms[room_id] = entries
+        self._owners[room_id] = owner
+        self.misses += 1
+        return entry
+
+    def invalidate(self, owner: str) -> None:
+        """drop the entries of the rooms of the owner, once an answer is recorded"""
+        for room_id in [room_id for room_id, room_owner in self._owners.items() if room_owner == owner]:
+            del self._owners[room_id]
+            self._rooms.pop(room_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'rooms': len(self._rooms),
+            'size': sum(len(entries) for entries in self._rooms.values()),
+            'misses': self.misses,
+            'folded': self.folded,
+        }
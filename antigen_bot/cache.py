@@ -0,0 +1,182 @@
+"""bounded in-memory containers shared by the bot
+
+All containers here are bounded both by size and by time, so that long-running
+bots keep a flat memory footprint no matter how many messages they have seen.
+"""
+from __future__ import annotations
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Generic, Hashable, Iterator, List, Optional, Set, Tuple, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+_MISSING = object()
+
+
+class TTLCache(Generic[K, V]):
+    """LRU cache whose entries also expire after `ttl` seconds"""
+    def __init__(self, max_size: int = 10000, ttl: Optional[float] = 3600, clock: Callable[[], float] = time.monotonic) -> None:
+        if max_size <= 0:
+            raise ValueError('max_size should greater than 0')
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._data: OrderedDict[K, Tuple[float, V]] = OrderedDict()
+        # the keys in the order of their last write, which is also the order of expiry
+        self._written: OrderedDict[K, None] = OrderedDict()
+
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __iter__(self) -> Iterator[K]:
+        self.purge()
+        return iter(list(self._data.keys()))
+
+    def _expired(self, expire_at: float, now: float) -> bool:
+        return self.ttl is not None and expire_at <= now
+
+    def get(self, key: K, default: Any = None) -> Any:
+        """get the value and refresh its LRU position"""
+        item = self._data.get(key)
+        if item is None:
+            return default
+        if self._expired(item[0], self._clock()):
+            del self._data[key]
+            del self._written[key]
+            self.expirations += 1
+            return default
+        self._data.move_to_end(key)
+        return item[1]
+
+    def set(self, key: K, value: V) -> None:
+        """set the value, evicting the least recently used entries if full"""
+        now = self._clock()
+        expire_at = now + self.ttl if self.ttl is not None else 0.0
+        self._data[key] = (expire_at, value)
+        self._data.move_to_end(key)
+        self._written[key] = None
+        self._written.move_to_end(key)
+        self.purge(now)
+        while len(self._data) > self.max_size:
+            evicted, _ = self._data.popitem(last=False)
+            del self._written[evicted]
+            self.evictions += 1
+
+    def pop(self, key: K, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        if item is None:
+            return default
+        del self._written[key]
+        return item[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._written.clear()
+
+    def purge(self, now: Optional[float] = None) -> int:
+        """drop the expired entries, the oldest writes first
+
+        a hit only moves the entry in the LRU order, the entries are purged in
+        the order they were written, so a fresh entry never hides an expired one.
+        """
+        if self.ttl is None:
+            return 0
+        now = self._clock() if now is None else now
+        purged = 0
+        while self._written:
+            key = next(iter(self._written))
+            if not self._expired(self._data[key][0], now):
+                break
+            del self._written[key]
+            del self._data[key]
+            purged += 1
+        self.expirations += purged
+        return purged
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class TimeBucketedSet(Generic[K]):
+    """membership set which forgets its members after `window` seconds
+
+    members are stored in `buckets` rotating sets, each one covering
+    `window / buckets` seconds, so expiring a whole slice is O(1) per member.
+    """
+    def __init__(self, window: float = 600, buckets: int = 6, max_size: int = 100000, clock: Callable[[], float] = time.monotonic) -> None:
+        if buckets <= 0:
+            raise ValueError('buckets should greater than 0')
+        self.window = window
+        self.max_size = max_size
+        self._span = window / buckets
+        self._clock = clock
+        self._buckets: List[Tuple[int, Set[K]]] = []
+        self._size = 0
+
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _rotate(self, now: float) -> int:
+        slot = int(now // self._span)
+        oldest = slot - int(round(self.window / self._span)) + 1
+        while self._buckets and self._buckets[0][0] < oldest:
+            _, members = self._buckets.pop(0)
+            self._size -= len(members)
+            self.expirations += len(members)
+        return slot
+
+    def __contains__(self, key: K) -> bool:
+        self._rotate(self._clock())
+        return any(key in members for _, members in self._buckets)
+
+    def add(self, key: K) -> bool:
+        """add the key into the set
+
+        Returns:
+            bool: if the key has already been in the set
+        """
+        slot = self._rotate(self._clock())
+        if any(key in members for _, members in self._buckets):
+            return True
+
+        if not self._buckets or self._buckets[-1][0] != slot:
+            self._buckets.append((slot, set()))
+        self._buckets[-1][1].add(key)
+        self._size += 1
+
+        # under extreme bursts drop the oldest slices before the window ends
+        while self._size > self.max_size and len(self._buckets) > 1:
+            _, members = self._buckets.pop(0)
+            self._size -= len(members)
+            self.evictions += len(members)
+        members = self._buckets[-1][1]
+        while self._size > self.max_size and members:
+            members.pop()
+            self._size -= 1
+            self.evictions += 1
+        return False
+
+    def stats(self) -> Dict[str, int]:
+        self._rotate(self._clock())
+        return {
+            'size': self._size,
+            'max_size': self.max_size,
+            'buckets': len(self._buckets),
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
@@ -0,0 +1,156 @@
+"""per-conversation actor queues for the message handlers"""
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+
+def percentile(values, q: float) -> float:
+    """the q-th percentile (0-100) of values, 0 if there is no value"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class ConversationDispatcher:
+    """run the messages of one conversation in order, different conversations concurrently
+
+    each conversation (room or contact) owns an asyncio queue drained by its own
+    worker task, which exits after `idle_timeout` seconds without message. The
+    number of handlers running at the same time is capped by `max_concurrency`.
+    """
+    def __init__(
+        self,
+        max_concurrency: int = 32,
+        max_queue_size: int = 200,
+        idle_timeout: float = 60,
+        logger: Optional[logging.Logger] = None
+    ) -> None:
+        if max_concurrency <= 0:
+            raise ValueError('max_concurrency should greater than 0')
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.idle_timeout = idle_timeout
+        self.logger = logger or logging.getLogger('ConversationDispatcher')
+
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self.running = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self._waits: Deque[float] = deque(maxlen=1000)
+        self.max_wait = 0.0
+
+    @property
+    def backlog(self) -> int:
+        """the number of the queued messages in all conversations"""
+        return sum(queue.qsize() for queue in self._queues.values())
+
+    def depth(self, key: str) -> int:
+        queue = self._queues.get(key)
+        return queue.qsize() if queue else 0
+
+    async def submit(self, key: str, handler: Callable[[], Awaitable[Any]], wait: bool = False) -> bool:
+        """enqueue the handler into the conversation queue
+
+        Args:
+            wait: return only after the handler is done (or cancelled by `close`)
+
+        Returns:
+            bool: False if the conversation queue is full and the handler is dropped
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._queues[key] = queue
+        done = asyncio.get_running_loop().create_future() if wait else None
+        try:
+            queue.put_nowait((time.monotonic(), handler, done))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self.logger.warning(f'conversation<{key}> queue is full, drop the message')
+            return False
+
+        if key not in self._workers:
+            self._workers[key] = asyncio.ensure_future(self._work(key, queue))
+        if done is not None:
+            await asyncio.shield(done)
+        return True
+
+    async def _work(self, key: str, queue: asyncio.Queue) -> None:
+        try:
+            while True:
+                try:
+                    enqueued_at, handler, done = await asyncio.wait_for(queue.get(), timeout=self.idle_timeout)
+                except asyncio.TimeoutError:
+                    if queue.empty():
+                        return
+                    continue
+
+                async with self._semaphore:
+                    wait = time.monotonic() - enqueued_at
+                    self._waits.append(wait)
+                    self.max_wait = max(self.max_wait, wait)
+
+                    self.running += 1
+                    try:
+                        await handler()
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        self.failed += 1
+                        self.logger.exception(f'handler failed in conversation<{key}>: {e}')
+                    finally:
+                        self.running -= 1
+                        self.processed += 1
+                        queue.task_done()
+                        if done is not None and not done.done():
+                            done.set_result(None)
+        finally:
+            self._workers.pop(key, None)
+            if queue.empty() and self._queues.get(key) is queue:
+                del self._queues[key]
+
+    async def join(self) -> None:
+        """wait until all of the queued handlers are done"""
+        for queue in list(self._queues.values()):
+            await queue.join()
+
+    async def close(self) -> None:
+        """cancel all of the workers"""
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        # release the submitters waiting for the handlers which never ran
+        for queue in list(self._queues.values()):
+            while not queue.empty():
+                _, _, done = queue.get_nowait()
+                if done is not None and not done.done():
+                    done.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        depths = [queue.qsize() for queue in self._queues.values()]
+        return {
+            'conversations': len(self._queues),
+            'backlog': sum(depths),
+            'max_depth': max(depths, default=0),
+            'running': self.running,
+            'max_concurrency': self.max_concurrency,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'wait_p50': round(percentile(self._waits, 50), 4),
+            'wait_p99': round(percentile(self._waits, 99), 4),
+            'wait_max': round(self.max_wait, 4),
+        }
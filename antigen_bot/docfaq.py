@@ -1,5 +1,18 @@
 import requests
 import os
+import json
+import time
+import asyncio
+import logging
+from typing import Optional
+import aiohttp
+
+from antigen_bot.cache import TTLCache
+from antigen_bot.resilience import resilience
+from antigen_bot.utils import normalize_text
+
+TOKEN_URL = 'https://aip.baidubce.com/oauth/2.0/token'
+CHAT_URL = 'https://aip.baidubce.com/rpc/2.0/unit/service/v3/chat'
 
 
 class DocFAQ:
@@ -35,6 +48,136 @@ class DocFAQ:
             return {}
 
 
+class AsyncDocFAQ:
+    """Baidu UNIT DocFAQ client which never blocks the event loop
+
+    1. the access token is cached and refreshed in background before it expires
+    2. the requests share one keep-alive connection pool and have timeouts
+    3. the answers of the session-less queries are cached by (skill_id, normalized query)
+    """
+    def __init__(
+        self,
+        skill_id: str,
+        terminal: str,
+        timeout: float = 5,
+        cache_size: int = 2048,
+        cache_ttl: float = 3600,
+        refresh_margin: float = 86400,
+    ):
+        self.skill_id = skill_id
+        self.terminal = terminal
+        self.timeout = timeout
+        self.refresh_margin = refresh_margin
+        self.AK, self.SK = os.environ.get("accesstoken").split('||')
+        self.logger = logging.getLogger('DocFAQ')
+
+        self.cache: TTLCache[tuple, dict] = TTLCache(max_size=cache_size, ttl=cache_ttl)
+        self.hits = 0
+        self.misses = 0
+
+        self._token: Optional[str] = None
+        self._token_expire_at = 0.0
+        self._token_lock: Optional[asyncio.Lock] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def _fetch_token(self) -> str:
+        params = {'grant_type': 'client_credentials', 'client_id': self.AK, 'client_secret': self.SK}
+        async with self._get_session().get(TOKEN_URL, params=params) as response:
+            access_token = await response.json(content_type=None)
+        if "error" in access_token or "access_token" not in access_token:
+            raise Exception('request failed--access token error: %s' % access_token)
+
+        self._token = access_token["access_token"]
+        self._token_expire_at = time.time() + float(access_token.get("expires_in", 2592000))
+        return self._token
+
+    async def get_token(self) -> str:
+        """the cached access token, fetched again only if it is expiring"""
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.ensure_future(self._refresh_loop())
+
+        if self._token and time.time() < self._token_expire_at - self.refresh_margin / 2:
+            return self._token
+        async with self._token_lock:
+            if self._token and time.time() < self._token_expire_at - self.refresh_margin / 2:
+                return self._token
+            return await self._fetch_token()
+
+    async def _refresh_loop(self) -> None:
+        """refresh the token `refresh_margin` seconds before it expires"""
+        while True:
+            delay = max(self._token_expire_at - self.refresh_margin - time.time(), 60)
+            await asyncio.sleep(delay)
+            try:
+                async with self._token_lock:
+                    await self._fetch_token()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f'refresh access token failed: {e}')
+
+    async def predict(self, text: str, session_id: str = '') -> dict:
+        key = (self.skill_id, normalize_text(text))
+        if not session_id:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        post_data = {
+            "version": "3.0",
+            "skill_ids": [self.skill_id],
+            "session_id": session_id,
+            "log_id": "7758521",
+            "request": {"terminal_id": self.terminal, "query": text},
+        }
+        result = await resilience.service('docfaq').call(self._chat, post_data)
+        if not result:
+            return {}
+
+        # only cache the direct answers, the guide answers open a session in UNIT
+        if not session_id and result.get('error_code') == 0:
+            action_id = result['result']['responses'][0]['actions'][0]['action_id']
+            if action_id not in ('Innovation_Bot_failure', 'Innovation_Bot_guide'):
+                self.cache.set(key, result)
+        return result
+
+    async def _chat(self, post_data: dict) -> dict:
+        token = await self.get_token()
+        async with self._get_session().post(CHAT_URL, params={'access_token': token}, json=post_data) as response:
+            if response.status != 200:
+                raise RuntimeError(f'UNIT DocFAQ http status: {response.status}')
+            return await response.json(content_type=None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'cache': self.cache.stats(),
+            'token_expire_at': self._token_expire_at,
+        }
+
+    async def close(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
 if __name__ == "__main__":
     import time
     from pprint import pprint
@@ -0,0 +1,343 @@
+"""per-owner indexes of the group FAQ questions and the two-stage retriever"""
+from __future__ import annotations
+import heapq
+import logging
+import math
+import time
+import zlib
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from antigen_bot.dispatcher import percentile
+from antigen_bot.utils import normalize_text
+
+Embedder = Callable[[Sequence[str]], np.ndarray]
+
+
+def char_ngrams(text: str, ngrams: Tuple[int, ...] = (1, 2)) -> List[str]:
+    """the character n-grams of the normalized text"""
+    text = normalize_text(text) or text
+    return [text[i:i + n] for n in ngrams for i in range(len(text) - n + 1)]
+
+
+class NgramEmbedder:
+    """hashed character n-gram vectors, l2 normalized
+
+    a lexical bag of characters, not a semantic embedding: two texts
+    sharing most characters score high whatever they mean, so its cosine
+    only recalls candidates and never decides a match alone. Cheap enough
+    to embed every query on the event loop, and stable across restarts
+    (crc32 instead of the salted builtin hash).
+    """
+    def __init__(self, dim: int = 512, ngrams: Tuple[int, ...] = (1, 2)) -> None:
+        self.dim = dim
+        self.ngrams = ngrams
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for gram in char_ngrams(text, self.ngrams):
+                vectors[row, zlib.crc32(gram.encode('utf-8')) % self.dim] += 1.0
+        # sublinear tf keeps the repeated characters from dominating
+        np.log1p(vectors, out=vectors)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class _OwnerIndex:
+    """the embedding matrix of one owner, rows are reused after removal"""
+    def __init__(self, dim: int) -> None:
+        self.matrix = np.zeros((16, dim), dtype=np.float32)
+        self.keys: List[Optional[Hashable]] = []
+        self.rows: Dict[Hashable, int] = {}
+
+    def add(self, key: Hashable, vector: np.ndarray) -> None:
+        row = self.rows.get(key)
+        if row is None:
+            row = len(self.keys)
+            if row == len(self.matrix):
+                self.matrix = np.concatenate([self.matrix, np.zeros_like(self.matrix)])
+            self.keys.append(key)
+            self.rows[key] = row
+        self.matrix[row] = vector
+
+    def remove(self, key: Hashable) -> bool:
+        row = self.rows.pop(key, None)
+        if row is None:
+            return False
+        # move the last row into the hole, so the live rows stay contiguous
+        last = len(self.keys) - 1
+        if row != last:
+            moved = self.keys[last]
+            self.matrix[row] = self.matrix[last]
+            self.keys[row] = moved
+            self.rows[moved] = row
+        self.keys.pop()
+        self.matrix[last] = 0
+        return True
+
+
+class FAQIndex:
+    """top-k cosine search over the FAQ questions of each owner
+
+    the text and media FAQs share one index, every entry is keyed by
+    (kind, question). Questions are embedded once when they are recorded and
+    the query once per search, the search itself is one matrix product.
+    """
+    def __init__(self, embedder: Optional[Embedder] = None) -> None:
+        self.embedder = embedder or NgramEmbedder()
+        self._owners: Dict[str, _OwnerIndex] = {}
+        self.searches = 0
+
+    def __len__(self) -> int:
+        return sum(len(index.keys) for index in self._owners.values())
+
+    def __contains__(self, item: Tuple[str, str, str]) -> bool:
+        owner, kind, question = item
+        index = self._owners.get(owner)
+        return bool(index) and (kind, question) in index.rows
+
+    def add(self, owner: str, questions: Sequence[str], kind: str = 'text') -> None:
+        """embed and index the questions, the known ones are skipped"""
+        index = self._owners.get(owner)
+        new = [question for question in dict.fromkeys(questions) if index is None or (kind, question) not in index.rows]
+        if not new:
+            return
+        vectors = self.embedder(new)
+        if index is None:
+            index = self._owners[owner] = _OwnerIndex(vectors.shape[1])
+        for question, vector in zip(new, vectors):
+            index.add((kind, question), vector)
+
+    def remove(self, owner: str, question: str, kind: str = 'text') -> bool:
+        index = self._owners.get(owner)
+        return bool(index) and index.remove((kind, question))
+
+    def questions(self, owner: str) -> List[Tuple[str, str]]:
+        """all of the (kind, question) of the owner"""
+        index = self._owners.get(owner)
+        return list(index.keys) if index else []
+
+    def search(self, owner: str, text: str, k: int = 5, threshold: float = 0.0, kind: Optional[str] = None) -> List[Tuple[str, str, float]]:
+        """the best k (kind, question, score) above the threshold, best first"""
+        index = self._owners.get(owner)
+        if not index or not index.keys:
+            return []
+        self.searches += 1
+
+        size = len(index.keys)
+        scores = index.matrix[:size] @ self.embedder([text])[0]
+        if kind is not None:
+            mask = np.fromiter((key[0] == kind for key in index.keys), dtype=bool, count=size)
+            scores = np.where(mask, scores, -1.0)
+
+        k = min(k, size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(*index.keys[row], float(scores[row])) for row in top if scores[row] >= threshold]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'owners': len(self._owners),
+            'questions': len(self),
+            'searches': self.searches,
+        }
+
+
+class BM25Index:
+    """character n-gram inverted index with BM25 scoring, per owner
+
+    the postings are updated in place when a question is added or removed,
+    a search only touches the postings of the query n-grams.
+    """
+    def __init__(self, ngrams: Tuple[int, ...] = (1, 2), k1: float = 1.2, b: float = 0.75) -> None:
+        self.ngrams = ngrams
+        self.k1 = k1
+        self.b = b
+        # owner -> gram -> {(kind, question): tf}
+        self._postings: Dict[str, Dict[str, Dict[Tuple[str, str], int]]] = {}
+        self._lengths: Dict[str, Dict[Tuple[str, str], int]] = {}
+        self._total_length: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return sum(len(lengths) for lengths in self._lengths.values())
+
+    def add(self, owner: str, questions: Sequence[str], kind: str = 'text') -> None:
+        postings = self._postings.setdefault(owner, {})
+        lengths = self._lengths.setdefault(owner, {})
+        for question in questions:
+            key = (kind, question)
+            if key in lengths:
+                continue
+            grams = char_ngrams(question, self.ngrams)
+            lengths[key] = len(grams)
+            self._total_length[owner] = self._total_length.get(owner, 0) + len(grams)
+            for gram in grams:
+                docs = postings.setdefault(gram, {})
+                docs[key] = docs.get(key, 0) + 1
+
+    def remove(self, owner: str, question: str, kind: str = 'text') -> bool:
+        key = (kind, question)
+        lengths = self._lengths.get(owner, {})
+        if key not in lengths:
+            return False
+        self._total_length[owner] -= lengths.pop(key)
+        postings = self._postings[owner]
+        for gram in set(char_ngrams(question, self.ngrams)):
+            docs = postings.get(gram)
+            if docs is not None:
+                docs.pop(key, None)
+                if not docs:
+                    del postings[gram]
+        return True
+
+    def search(self, owner: str, text: str, k: int = 20) -> List[Tuple[str, str, float]]:
+        """the best k (kind, question, score), best first"""
+        lengths = self._lengths.get(owner)
+        if not lengths:
+            return []
+        postings = self._postings[owner]
+        total = len(lengths)
+        average = self._total_length[owner] / total or 1.0
+
+        scores: Dict[Tuple[str, str], float] = {}
+        for gram in set(char_ngrams(text, self.ngrams)):
+            docs = postings.get(gram)
+            if not docs:
+                continue
+            idf = math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+            for key, tf in docs.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * lengths[key] / average)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / norm
+
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(kind, question, score) for (kind, question), score in best]
+
+
+class FAQRetriever:
+    """two-stage FAQ matching: cheap candidates, then the similarity model
+
+    the candidates are the union of the BM25 and the n-gram vector index
+    top `candidates`, only they are reranked by the similarity service (the
+    Taskflow model), which alone decides with `threshold`. If the service is
+    busy or failed, only a question equal to the query (after
+    normalization) is answered; the vector scores decide as well only when
+    `fallback_threshold` is set, to a value evaluated on the owner's data.
+
+    With `audit` on, every query is also matched by a full scan of the
+    owner's questions, to report the recall of the candidate set.
+    """
+    def __init__(
+        self,
+        similarity: Any,
+        candidates: int = 20,
+        threshold: float = 0.88,
+        fallback_threshold: Optional[float] = None,
+        audit: bool = False,
+        logger: Optional[logging.Logger] = None
+    ) -> None:
+        self.similarity = similarity
+        self.candidates = candidates
+        self.threshold = threshold
+        self.fallback_threshold = fallback_threshold
+        self.audit = audit
+        self.logger = logger or logging.getLogger('FAQRetriever')
+
+        self.vectors = FAQIndex()
+        self.lexical = BM25Index()
+
+        self.queries = 0
+        self.reranked = 0
+        self.fallbacks = 0
+        self.audited = 0
+        self.audit_hits = 0
+        self._prefilter_latencies: Deque[float] = deque(maxlen=1000)
+
+    def add(self, owner: str, questions: Sequence[str], kind: str = 'text') -> None:
+        self.vectors.add(owner, questions, kind)
+        self.lexical.add(owner, questions, kind)
+
+    def remove(self, owner: str, question: str, kind: str = 'text') -> bool:
+        removed = self.vectors.remove(owner, question, kind)
+        return self.lexical.remove(owner, question, kind) or removed
+
+    def candidate_set(self, owner: str, text: str) -> Dict[Tuple[str, str], float]:
+        """the candidate (kind, question) with their vector scores"""
+        start = time.perf_counter()
+        vector_hits = self.vectors.search(owner, text, k=self.candidates)
+        scores = {(kind, question): score for kind, question, score in vector_hits}
+        for kind, question, _ in self.lexical.search(owner, text, k=self.candidates):
+            scores.setdefault((kind, question), 0.0)
+        self._prefilter_latencies.append(time.perf_counter() - start)
+        return scores
+
+    async def _rerank(self, text: str, keys: List[Tuple[str, str]]) -> Dict[str, Tuple[str, float]]:
+        """the best question per kind above the threshold, scored by the similarity model"""
+        result = await self.similarity.similarity([[text, question] for _, question in keys])
+        self.reranked += len(keys)
+        best: Dict[str, Tuple[str, float]] = {}
+        for (kind, question), item in zip(keys, result):
+            score = float(item['similarity'])
+            if score >= self.threshold and score > best.get(kind, ('', -1.0))[1]:
+                best[kind] = (question, score)
+        return best
+
+    async def match(self, owner: str, text: str) -> Dict[str, Tuple[str, float]]:
+        """the best matched (question, score) of each kind ('text', 'media')"""
+        candidates = self.candidate_set(owner, text)
+        if not candidates:
+            return {}
+        self.queries += 1
+
+        try:
+            best = await self._rerank(text, list(candidates))
+        except Exception as e:
+            self.fallbacks += 1
+            self.logger.warning(f'FAQ rerank failed, only the exact questions are matched: {e!r}')
+            return self._fallback(text, candidates)
+
+        if self.audit:
+            await self._audit(owner, text, candidates)
+        return best
+
+    def _fallback(self, text: str, candidates: Dict[Tuple[str, str], float]) -> Dict[str, Tuple[str, float]]:
+        """the match without the model: the exact question, or a vector score above `fallback_threshold`"""
+        key = normalize_text(text)
+        best: Dict[str, Tuple[str, float]] = {}
+        for (kind, question), score in sorted(candidates.items(), key=lambda item: item[1], reverse=True):
+            if normalize_text(question) == key:
+                best[kind] = (question, 1.0)
+            elif self.fallback_threshold is not None and score >= self.fallback_threshold:
+                best.setdefault(kind, (question, score))
+        return best
+
+    async def _audit(self, owner: str, text: str, candidates: Dict[Tuple[str, str], float]) -> None:
+        """check whether the full scan finds the answer outside of the candidates"""
+        try:
+            full = await self._rerank(text, self.vectors.questions(owner))
+        except Exception as e:
+            self.logger.warning(f'FAQ recall audit skipped: {e!r}')
+            return
+        for kind, (question, _) in full.items():
+            self.audited += 1
+            if (kind, question) in candidates:
+                self.audit_hits += 1
+            else:
+                self.logger.info(f'FAQ candidates missed: {question} for {text}')
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'questions': len(self.vectors),
+            'candidates': self.candidates,
+            'queries': self.queries,
+            'reranked_pairs': self.reranked,
+            'fallbacks': self.fallbacks,
+            'prefilter_p50': round(percentile(self._prefilter_latencies, 50), 6),
+            'prefilter_p99': round(percentile(self._prefilter_latencies, 99), 6),
+            'audit': self.audit,
+            'audited': self.audited,
+            'recall': round(self.audit_hits / self.audited, 4) if self.audited else None,
+        }
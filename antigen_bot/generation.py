@@ -0,0 +1,324 @@
+"""one generation gateway in front of Yuan, PanGu and Zeus"""
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple, Union
+
+from antigen_bot.dispatcher import percentile
+from antigen_bot.hedging import usable
+from antigen_bot.resilience import OPEN, ServiceUnavailable, resilience
+from antigen_bot.utils import del_special_chars
+
+# requests per second and burst of each provider, CA_GENERATION_RATE_<NAME> overrides them
+DEFAULT_RATES: Dict[str, Tuple[float, int]] = {
+    'yuan': (2.0, 4),
+    'pangu': (1.0, 4),
+    'zeus': (1.0, 2),
+    'stub': (100.0, 100),
+}
+
+
+def normalize_output(text: Optional[str], stop: Optional[str] = None) -> str:
+    """the same clean up for every provider: special chars, the text after the stop token"""
+    if not text:
+        return ''
+    text = del_special_chars(text)
+    if stop and stop in text:
+        text = text[:text.index(stop)]
+    return text.strip()
+
+
+class TokenBucket:
+    """`rate` tokens per second, at most `burst` of them saved up"""
+    def __init__(self, rate: float, burst: int = 1, clock: Callable[[], float] = time.monotonic) -> None:
+        if rate <= 0 or burst <= 0:
+            raise ValueError('rate and burst should greater than 0')
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+
+    def _refill(self) -> float:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return self._tokens
+
+    def try_acquire(self) -> bool:
+        if self._refill() >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """seconds until the next token"""
+        return max((1 - self._refill()) / self.rate, 0.0)
+
+    async def acquire(self) -> None:
+        while not self.try_acquire():
+            await asyncio.sleep(self.wait_time())
+
+    @property
+    def tokens(self) -> float:
+        return self._refill()
+
+
+class Provider:
+    """a generation backend, `generate` returns the raw text of the prompt"""
+    name = 'provider'
+
+    async def generate(self, prompt: str, stop: Optional[str] = None, **options: Any) -> str:
+        raise NotImplementedError
+
+    def available(self) -> bool:
+        """False when the circuit of the upstream service is open"""
+        breaker = resilience.service(self.name).breaker
+        return breaker.state != OPEN or breaker.retry_after() <= 0
+
+
+class YuanProvider(Provider):
+    """Inspur Yuan dialog engine, the options override the sampling settings, e.g. topK"""
+    name = 'yuan'
+
+    def __init__(self, **kwargs: Any) -> None:
+        from antigen_bot.inspurai import AsyncYuan
+        settings = dict(engine='dialog', temperature=1, max_tokens=150, input_prefix='', input_suffix='',
+                        output_prefix='', output_suffix='', append_output_prefix_to_query=False,
+                        topK=3, topP=0.9, frequencyPenalty=1.2)
+        settings.update(kwargs)
+        self.yuan = AsyncYuan(**settings)
+
+    async def generate(self, prompt: str, stop: Optional[str] = None, **options: Any) -> str:
+        yuan = self.yuan
+        params = dict(engine=yuan.engine, max_tokens=yuan.max_tokens, temperature=yuan.temperature, topP=yuan.topP,
+                      topK=yuan.topK, frequencyPenalty=yuan.frequencyPenalty, responsePenalty=yuan.responsePenalty,
+                      noRepeatNgramSize=yuan.noRepeatNgramSize)
+        params.update(options)
+        res = await yuan.response(yuan.craft_query(prompt), **params)
+        return yuan.postprocess(res, stop)
+
+
+class PanGuProvider(Provider):
+    """PCL PanGu-alpha online inference, a blocking client run in the executor, the options are ignored"""
+    name = 'pangu'
+
+    def __init__(self, key: str, model: str = 'pangu-alpha-13B-md') -> None:
+        self.key = key
+        self.model = model
+
+    async def generate(self, prompt: str, stop: Optional[str] = None, **options: Any) -> str:
+        from pcl_pangu.online import Infer
+        return await resilience.service(self.name).call_blocking(Infer.generate, self.model, prompt, self.key)
+
+
+class ZeusProvider(Provider):
+    """Baidu ERNIE 3.0 Zeus, a blocking client run in the executor, the options are ignored"""
+    name = 'zeus'
+
+    def __init__(self) -> None:
+        from antigen_bot.Ernie.Zeus import Zeus
+        self.zeus = Zeus()
+
+    async def generate(self, prompt: str, stop: Optional[str] = None, **options: Any) -> str:
+        reply = await resilience.service(self.name).call_blocking(self.zeus.get_response, prompt, stop or '')
+        if reply is None:
+            raise RuntimeError('zeus returned an error code')
+        return reply
+
+
+class StubProvider(Provider):
+    """a local provider for tests and dry runs
+
+    the reply is a fixed text or made by a callable of the prompt, after
+    `latency` seconds. A reply which is an exception is raised.
+    """
+    def __init__(self, name: str = 'stub', reply: Union[str, Exception, Callable[[str], Any]] = '你好”',
+                 latency: float = 0.0) -> None:
+        self.name = name
+        self.reply = reply
+        self.latency = latency
+        self.up = True
+        self.prompts: List[str] = []
+
+    async def generate(self, prompt: str, stop: Optional[str] = None, **options: Any) -> str:
+        self.prompts.append(prompt)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        reply = self.reply(prompt) if callable(self.reply) else self.reply
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def available(self) -> bool:
+        return self.up
+
+
+class _Route:
+    """the bucket and the live latency and errors of one provider"""
+    def __init__(self, provider: Provider, bucket: TokenBucket) -> None:
+        self.provider = provider
+        self.bucket = bucket
+        self.latency: Optional[float] = None
+        self.calls = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.down_until = 0.0
+        self.last_error = ''
+        self.latencies: Deque[float] = deque(maxlen=1000)
+
+
+class GenerationGateway:
+    """route every generation to the fastest healthy provider
+
+    the providers are ordered by the moving average of their latency, one
+    never measured goes first. A provider is skipped while its circuit is
+    open, or for `cooldown` seconds after `failures` consecutive errors (an
+    unusable reply counts as an error). A provider without a token in its
+    bucket is only waited for when no other provider can take the call.
+    The reply is normalized the same way for every provider.
+
+    the sampling options (e.g. topK) are only applied by Yuan, PanGu and
+    Zeus have no such settings in their clients and ignore them.
+    """
+    def __init__(self, providers: Sequence[Provider], rates: Optional[Dict[str, Tuple[float, int]]] = None,
+                 failures: int = 3, cooldown: float = 60, smoothing: float = 0.3,
+                 clock: Callable[[], float] = time.monotonic, logger: Optional[logging.Logger] = None) -> None:
+        rates = dict(DEFAULT_RATES, **(rates or {}))
+        self.failures = failures
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        self._clock = clock
+        self.logger = logger or logging.getLogger('GenerationGateway')
+        self.routes: Dict[str, _Route] = {}
+        for provider in providers:
+            rate, burst = rates.get(provider.name, (1.0, 1))
+            self.routes[provider.name] = _Route(provider, TokenBucket(rate, burst, clock))
+
+        self.requests = 0
+        self.failovers = 0
+        self.throttled = 0
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'GenerationGateway':
+        """the providers of CA_GENERATION_PROVIDERS which have their credentials
+
+        yuan needs YUAN_ACCOUNT, pangu PANGU_KEY and zeus baidu_access_token,
+        CA_GENERATION_RATE_<NAME> is `<requests per second>[,<burst>]`.
+        """
+        names = [name.strip() for name in os.environ.get('CA_GENERATION_PROVIDERS', 'yuan,pangu,zeus').split(',') if name.strip()]
+        providers: List[Provider] = []
+        for name in names:
+            if name == 'yuan' and os.environ.get('YUAN_ACCOUNT'):
+                providers.append(YuanProvider())
+            elif name == 'pangu' and os.environ.get('PANGU_KEY'):
+                providers.append(PanGuProvider(os.environ['PANGU_KEY']))
+            elif name == 'zeus' and os.environ.get('baidu_access_token'):
+                providers.append(ZeusProvider())
+            elif name == 'stub':
+                providers.append(StubProvider())
+        rates = {}
+        for name in names:
+            value = os.environ.get(f'CA_GENERATION_RATE_{name.upper()}')
+            if value:
+                rate, _, burst = value.partition(',')
+                rates[name] = (float(rate), int(burst or 1))
+        kwargs.setdefault('rates', rates)
+        return cls(providers, **kwargs)
+
+    def healthy(self, name: str) -> bool:
+        route = self.routes[name]
+        if route.consecutive_errors >= self.failures and self._clock() < route.down_until:
+            return False
+        return route.provider.available()
+
+    def ranking(self, names: Optional[Sequence[str]] = None) -> List[str]:
+        """the healthy providers, fastest first"""
+        names = [name for name in (names or self.routes) if name in self.routes and self.healthy(name)]
+        return sorted(names, key=lambda name: self.routes[name].latency or 0.0)
+
+    async def generate(self, prompt: str, stop: Optional[str] = '”', providers: Optional[Sequence[str]] = None,
+                       **options: Any) -> str:
+        """the normalized reply of the fastest healthy provider which answers
+
+        Args:
+            prompt: the whole prompt
+            stop: the reply is cut at the stop token
+            providers: only these providers, all of them by default
+            options: passed to the provider, e.g. the sampling settings of yuan,
+                ignored by pangu and zeus
+        """
+        self.requests += 1
+        ranking = self.ranking(providers)
+        if not ranking:
+            raise ServiceUnavailable('no healthy generation provider')
+
+        error: Exception = ServiceUnavailable('no generation provider answered')
+        attempts = 0
+        waiting = []
+        for name in ranking:
+            if not self.routes[name].bucket.try_acquire():
+                waiting.append(name)
+                continue
+            attempts += 1
+            reply, error = await self._call(name, prompt, stop, options, error, attempts)
+            if reply:
+                return reply
+        # the others are throttled or failed, wait for the bucket which refills first
+        for name in sorted(waiting, key=lambda name: self.routes[name].bucket.wait_time()):
+            self.throttled += 1
+            await self.routes[name].bucket.acquire()
+            attempts += 1
+            reply, error = await self._call(name, prompt, stop, options, error, attempts)
+            if reply:
+                return reply
+        raise error
+
+    async def _call(self, name: str, prompt: str, stop: Optional[str], options: Dict[str, Any],
+                    error: Exception, attempt: int) -> Tuple[str, Exception]:
+        route = self.routes[name]
+        route.calls += 1
+        if attempt > 1:
+            self.failovers += 1
+        start = self._clock()
+        try:
+            reply = normalize_output(await route.provider.generate(prompt, stop, **options), stop)
+            if not usable(reply):
+                raise RuntimeError(f'{name} returned an unusable reply: {reply!r}')
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            route.errors += 1
+            route.consecutive_errors += 1
+            route.last_error = repr(e)
+            if route.consecutive_errors >= self.failures:
+                route.down_until = self._clock() + self.cooldown
+            self.logger.warning(f'generation by {name} failed: {e!r}')
+            return '', e
+        elapsed = self._clock() - start
+        route.latency = elapsed if route.latency is None else route.latency + self.smoothing * (elapsed - route.latency)
+        route.latencies.append(elapsed)
+        route.consecutive_errors = 0
+        return reply, error
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'failovers': self.failovers,
+            'throttled': self.throttled,
+            'ranking': self.ranking(),
+            'providers': {
+                name: {
+                    'healthy': self.healthy(name),
+                    'calls': route.calls,
+                    'errors': route.errors,
+                    'latency_avg': round(route.latency, 3) if route.latency is not None else None,
+                    'latency_p99': round(percentile(route.latencies, 99), 3),
+                    'tokens': round(route.bucket.tokens, 2),
+                    'last_error': route.last_error,
+                } for name, route in self.routes.items()
+            },
+        }
@@ -0,0 +1,159 @@
+"""hedged generation: K concurrent candidates, the first acceptable one wins"""
+from __future__ import annotations
+import asyncio
+import inspect
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set, Union
+
+from antigen_bot.dispatcher import percentile
+
+# the replies of the generation services which are errors in disguise
+ERROR_REPLIES = ('somethingwentwrongwithyuanservice', '请求异常，请重试', 'something went wrong with yuan service')
+
+Validator = Callable[[str], Union[bool, Awaitable[bool]]]
+Collector = Callable[[str], None]
+
+
+def usable(reply: Optional[str]) -> bool:
+    """not empty and not an error sentinel"""
+    return bool(reply and reply.strip()) and reply not in ERROR_REPLIES
+
+
+class HedgedGenerator:
+    """fire `candidates` generations at once under one deadline
+
+    each candidate is validated as soon as it arrives (usable, then the
+    caller's validator, e.g. not repeating the dialog), the first accepted
+    one is returned and the others are cancelled. The worst case is about
+    one round trip instead of one per retry.
+
+    with a `collect` callback the others are not cancelled, they finish in
+    the background until the deadline and the accepted ones are collected,
+    e.g. as alternative replies for a cache.
+    """
+    def __init__(self, candidates: int = 3, deadline: float = 30, logger: Optional[logging.Logger] = None) -> None:
+        if candidates <= 0:
+            raise ValueError('candidates should greater than 0')
+        self.candidates = candidates
+        self.deadline = deadline
+        self.logger = logger or logging.getLogger('HedgedGenerator')
+
+        self.calls = 0
+        self.accepted = 0
+        self.exhausted = 0
+        self.deadline_exceeded = 0
+        self.rejected = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.collected = 0
+        self._background: Set[asyncio.Future] = set()
+        self._latencies: Deque[float] = deque(maxlen=1000)
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'HedgedGenerator':
+        """configured by CA_HEDGE_CANDIDATES and CA_HEDGE_DEADLINE"""
+        kwargs.setdefault('candidates', int(os.environ.get('CA_HEDGE_CANDIDATES', 3)))
+        kwargs.setdefault('deadline', float(os.environ.get('CA_HEDGE_DEADLINE', 30)))
+        return cls(**kwargs)
+
+    async def _accept(self, reply: str, validate: Optional[Validator]) -> bool:
+        if not usable(reply):
+            return False
+        if validate is None:
+            return True
+        result = validate(reply)
+        if inspect.isawaitable(result):
+            result = await result
+        return bool(result)
+
+    async def generate(self, factory: Callable[[int], Awaitable[str]], validate: Optional[Validator] = None,
+                       collect: Optional[Collector] = None) -> str:
+        """the first acceptable candidate, '' if none arrives before the deadline
+
+        Args:
+            factory: makes the i-th candidate request, e.g. `lambda i: yuan.submit_API(prompt)`
+            validate: the extra check of a usable candidate, sync or async
+            collect: called with each acceptable candidate arriving after the first one
+        """
+        self.calls += 1
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        deadline = start + self.deadline
+        pending = {asyncio.ensure_future(factory(i)) for i in range(self.candidates)}
+        try:
+            while pending:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    self.deadline_exceeded += 1
+                    self.logger.warning(f'no acceptable candidate in {self.deadline}s')
+                    return ''
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is not None:
+                        self.errors += 1
+                        self.logger.warning(f'candidate failed: {task.exception()!r}')
+                        continue
+                    reply = task.result()
+                    if await self._accept(reply, validate):
+                        self.accepted += 1
+                        self._latencies.append(loop.time() - start)
+                        if collect is not None and pending:
+                            task = asyncio.ensure_future(self._drain(pending, deadline, validate, collect))
+                            self._background.add(task)
+                            task.add_done_callback(self._background.discard)
+                            pending = set()
+                        return reply
+                    self.rejected += 1
+                    self.logger.info(f'candidate rejected: {reply}')
+            self.exhausted += 1
+            return ''
+        finally:
+            for task in pending:
+                task.cancel()
+            self.cancelled += len(pending)
+
+    async def _drain(self, pending: Set[asyncio.Future], deadline: float, validate: Optional[Validator],
+                     collect: Collector) -> None:
+        """collect the acceptable ones of the remaining candidates until the deadline"""
+        loop = asyncio.get_event_loop()
+        try:
+            while pending:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is not None:
+                        self.errors += 1
+                        continue
+                    reply = task.result()
+                    if await self._accept(reply, validate):
+                        self.collected += 1
+                        collect(reply)
+        finally:
+            for task in pending:
+                task.cancel()
+            self.cancelled += len(pending)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'candidates': self.candidates,
+            'deadline': self.deadline,
+            'calls': self.calls,
+            'accepted': self.accepted,
+            'exhausted': self.exhausted,
+            'deadline_exceeded': self.deadline_exceeded,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'cancelled': self.cancelled,
+            'collected': self.collected,
+            'latency_p50': round(percentile(self._latencies, 50), 3),
+            'latency_p99': round(percentile(self._latencies, 99), 3),
+        }
@@ -1,10 +1,11 @@
 import sys
 import os
-from .inspurai import Example, Yuan
+from .inspurai import Example, Yuan, AsyncYuan
 
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 
 __all__ = [
     Example,
     Yuan,
+    AsyncYuan,
 ]
@@ -4,7 +4,11 @@
 # import json
 import os
 import uuid
-from antigen_bot.inspurai.url_config import submit_request, reply_request
+from typing import Optional
+import aiohttp
+from antigen_bot.inspurai.url_config import submit_request, reply_request, async_submit_request, async_reply_request
+from antigen_bot.resilience import resilience
+from antigen_bot.utils import del_special_chars
 
 
 def set_yuan_account(user, phone):
@@ -151,10 +155,7 @@ class Yuan:
         return response_text
 
     def del_special_chars(self, msg):
-        special_chars = ['<unk>', '<eod>', '#', '▃', '▁', '▂', '　']
-        for char in special_chars:
-            msg = msg.replace(char, '')
-        return msg
+        return del_special_chars(msg)
 
     def submit_API(self, prompt, trun='▃'):
         """Submit prompt to yuan API interface and obtain an pure text reply.
@@ -169,6 +170,10 @@ class Yuan:
                             frequencyPenalty = self.frequencyPenalty,
                             responsePenalty = self.responsePenalty,
                             noRepeatNgramSize = self.noRepeatNgramSize)
+        return self.postprocess(res, trun)
+
+    def postprocess(self, res, trun='▃'):
+        """Clean the raw API result into pure text reply."""
         if 'resData' in res and res['resData']:
             txt = res['resData']
         else:
@@ -186,3 +191,77 @@ class Yuan:
             except:
                 return txt
         return txt
+
+
+class AsyncYuan(Yuan):
+    """Non-blocking Yuan client with the same prompt crafting API.
+    HTTP connections are pooled and kept alive, the result is polled by asyncio.sleep
+    with exponential backoff, and the pending call can be cancelled by its caller.
+    """
+
+    def __init__(self,
+                 *args,
+                 timeout=30,
+                 poll_interval=1.0,
+                 max_poll_interval=8.0,
+                 poll_timeout=30.0,
+                 pool_size=20,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.poll_timeout = poll_timeout
+        self.pool_size = pool_size
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def response(self,
+                       query,
+                       engine='base_10B',
+                       max_tokens=20,
+                       temperature=0.9,
+                       topP=0.1,
+                       topK=1,
+                       frequencyPenalty=1.0,
+                       responsePenalty=1.0,
+                       noRepeatNgramSize=0):
+        """Obtains the original result returned by the API.
+        The submit and the polling run under the deadline, circuit breaker and bulkhead of the yuan service."""
+        async def _response():
+            session = self._get_session()
+            requestId = await async_submit_request(session, query, temperature, topP, topK, max_tokens, engine,
+                                                   frequencyPenalty, responsePenalty, noRepeatNgramSize)
+            return await async_reply_request(session, requestId,
+                                             poll_interval=self.poll_interval,
+                                             max_poll_interval=self.max_poll_interval,
+                                             poll_timeout=self.poll_timeout)
+        return await resilience.service('yuan').call(_response)
+
+    async def submit_API(self, prompt, trun='▃'):
+        """Submit prompt to yuan API interface and obtain an pure text reply.
+        Cancel the awaiting task to abort the request and the polling.
+        :prompt: Question or any content a user may input.
+        :return: pure text response."""
+        query = self.craft_query(prompt)
+        res = await self.response(query, engine=self.engine,
+                                  max_tokens=self.max_tokens,
+                                  temperature=self.temperature,
+                                  topP=self.topP,
+                                  topK=self.topK,
+                                  frequencyPenalty=self.frequencyPenalty,
+                                  responsePenalty=self.responsePenalty,
+                                  noRepeatNgramSize=self.noRepeatNgramSize)
+        return self.postprocess(res, trun)
+
+    async def close(self):
+        """Close the pooled connections."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
@@ -3,6 +3,8 @@ import hashlib
 import time
 import json
 import os
+import asyncio
+import aiohttp
 
 ACCOUNT = ''
 PHONE = ''
@@ -20,24 +22,30 @@ def code_md5(str):
 
 
 def rest_get(url, header, timeout, show_error=False):
-    #Call rest get method
+    #Call rest get method, the request errors are raised instead of returning None
     try:
         response = requests.get(url, headers=header, timeout=timeout, verify=False)
+        response.raise_for_status()
         return response
     except Exception as exception:
         if show_error:
             print(exception)
-        return None
+        raise
+
+
+_HEADER_CACHE = {}
 
 
 def header_generation():
-    """Generate header for API request."""
+    """Generate header for API request, the token only changes once a day."""
     t = time.strftime("%Y-%m-%d", time.localtime())
-    global ACCOUNT, PHONE
-    ACCOUNT, PHONE = os.environ.get('YUAN_ACCOUNT').split('||')
-    token = code_md5(ACCOUNT+PHONE+t)
-    headers = {'token': token}
-    return headers
+    account = os.environ.get('YUAN_ACCOUNT')
+    if _HEADER_CACHE.get('key') != (t, account):
+        global ACCOUNT, PHONE
+        ACCOUNT, PHONE = account.split('||')
+        _HEADER_CACHE['key'] = (t, account)
+        _HEADER_CACHE['headers'] = {'token': code_md5(ACCOUNT+PHONE+t)}
+    return dict(_HEADER_CACHE['headers'])
 
 
 def submit_request(query, temperature, topP, topK, max_tokens, engine, frequencyPenalty, responsePenalty, noRepeatNgramSize):
@@ -69,3 +77,42 @@ def reply_request(requestId, cycle_count=5):
             raise RuntimeWarning(response_text)
         time.sleep(3)
     return response_text
+
+
+async def async_rest_get(session: aiohttp.ClientSession, url, params, header):
+    """Call rest get method on the pooled session and decode the json body"""
+    async with session.get(url, params=params, headers=header, ssl=False) as response:
+        return json.loads(await response.text())
+
+
+async def async_submit_request(session, query, temperature, topP, topK, max_tokens, engine, frequencyPenalty, responsePenalty, noRepeatNgramSize):
+    """Submit query to the backend server and get requestID without blocking the event loop."""
+    headers = header_generation()
+    params = {
+        "engine": engine, "account": ACCOUNT, "data": query, "temperature": temperature, "topP": topP, "topK": topK,
+        "tokensToGenerate": max_tokens, "type": "api", "frequencyPenalty": frequencyPenalty,
+        "responsePenalty": responsePenalty, "noRepeatNgramSize": noRepeatNgramSize,
+    }
+    response_text = await async_rest_get(session, SUBMIT_URL, {k: str(v) for k, v in params.items()}, headers)
+    if response_text["flag"]:
+        return response_text["resData"]
+    raise RuntimeWarning(response_text)
+
+
+async def async_reply_request(session, requestId, poll_interval=1.0, max_poll_interval=8.0, poll_timeout=30.0):
+    """Poll reply API with exponential backoff until the inference response is ready."""
+    headers = header_generation()
+    params = {"account": ACCOUNT, "requestId": requestId}
+    deadline = time.monotonic() + poll_timeout
+    response_text = {"flag": True, "resData": None}
+    while True:
+        response_text = await async_rest_get(session, REPLY_URL, params, headers)
+        if response_text["resData"]:
+            return response_text
+        wait = min(poll_interval, deadline - time.monotonic())
+        if wait <= 0:
+            if response_text["flag"] is False:
+                raise RuntimeWarning(response_text)
+            return response_text
+        await asyncio.sleep(wait)
+        poll_interval = min(poll_interval * 2, max_poll_interval)
@@ -0,0 +1,123 @@
+"""content-addressed on-disk store of the media messages"""
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from dataclasses import asdict
+from typing import Any, Dict, Optional, Union
+
+from wechaty import FileBox, Message, MessageType, MiniProgram, UrlLink
+from wechaty_puppet import UrlLinkPayload
+
+FILE_TYPES = {
+    MessageType.MESSAGE_TYPE_IMAGE: 'image',
+    MessageType.MESSAGE_TYPE_VIDEO: 'video',
+    MessageType.MESSAGE_TYPE_EMOTICON: 'emoticon',
+    MessageType.MESSAGE_TYPE_AUDIO: 'audio',
+}
+TEXT_TYPES = (MessageType.MESSAGE_TYPE_TEXT,)
+
+
+class MediaStore:
+    """files named by their sha256 under `root/objects`, with a json manifest
+
+    a message is turned into a small json ref when it is recorded: the file
+    types are downloaded once and stored by content (the same file is stored
+    only once), texts, url links and mini programs keep their payload. The
+    ref is all it takes to send the message again, even after a restart.
+    """
+    def __init__(self, root: str, logger: Optional[logging.Logger] = None) -> None:
+        self.root = root
+        self.objects = os.path.join(root, 'objects')
+        self.manifest_path = os.path.join(root, 'manifest.json')
+        self.logger = logger or logging.getLogger('MediaStore')
+        os.makedirs(self.objects, exist_ok=True)
+
+        self.manifest: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        self.dedup_hits = 0
+        self._lock = threading.Lock()
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.objects, digest[:2], digest)
+
+    def _save_manifest(self) -> None:
+        tmp_path = f'{self.manifest_path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.manifest_path)
+
+    def put_file(self, path: str, name: str) -> str:
+        """move the file into the store, return its digest"""
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+
+        target = self.path(digest)
+        with self._lock:
+            if os.path.exists(target):
+                self.dedup_hits += 1
+                os.remove(path)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(path, target)
+            if digest not in self.manifest:
+                self.manifest[digest] = {'name': name, 'size': os.path.getsize(target)}
+                self._save_manifest()
+        return digest
+
+    async def put_file_box(self, file_box: FileBox) -> str:
+        tmp_path = os.path.join(self.root, f'{uuid.uuid4().hex}.tmp')
+        await file_box.to_file(tmp_path, overwrite=True)
+        # hashing a video takes a while, keep it off the event loop
+        return await asyncio.get_event_loop().run_in_executor(None, self.put_file, tmp_path, file_box.name)
+
+    async def to_ref(self, msg: Message) -> Optional[Dict[str, Any]]:
+        """store the message, return the json ref, None for the unsupported types"""
+        if msg.type() in FILE_TYPES:
+            file_box = await msg.to_file_box()
+            digest = await self.put_file_box(file_box)
+            return {'type': FILE_TYPES[msg.type()], 'digest': digest, 'name': file_box.name}
+        if msg.type() in TEXT_TYPES:
+            return {'type': 'text', 'text': msg.text()}
+        if msg.type() == MessageType.MESSAGE_TYPE_URL:
+            url_link = await msg.to_url_link()
+            return {'type': 'url', 'payload': asdict(url_link.payload)}
+        if msg.type() == MessageType.MESSAGE_TYPE_MINI_PROGRAM:
+            mini_program = await msg.to_mini_program()
+            return {'type': 'mini_program', 'payload': mini_program.to_json()}
+        return None
+
+    def load(self, ref: Dict[str, Any]) -> Optional[Union[str, FileBox, UrlLink, MiniProgram]]:
+        """the sayable content of the ref, None if the file is missing"""
+        if ref['type'] == 'text':
+            return ref['text']
+        if ref['type'] == 'url':
+            return UrlLink(UrlLinkPayload(**ref['payload']))
+        if ref['type'] == 'mini_program':
+            return MiniProgram.create_from_json(ref['payload'])
+
+        path = self.path(ref['digest'])
+        if not os.path.exists(path):
+            self.logger.warning(f"media {ref['name']}<{ref['digest']}> is missing in the store")
+            return None
+        file_box = FileBox.from_file(path, name=ref['name'])
+        if ref['type'] == 'audio':
+            file_box.metadata = {'voiceLength': 2000}
+        return file_box
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'objects': len(self.manifest),
+            'bytes': sum(item['size'] for item in self.manifest.values()),
+            'dedup_hits': self.dedup_hits,
+        }
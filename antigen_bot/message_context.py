@@ -0,0 +1,128 @@
+"""per-message context shared by all of the plugins"""
+from __future__ import annotations
+import asyncio
+import inspect
+import re
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from wechaty import Contact, Message, Room
+
+from antigen_bot.utils import remove_at_info
+
+# 引用消息：「张三：原文」\n- - - - - - -\n回复内容
+QUOTE_PATTERN = re.compile(r"^「.+」\s-+\s.+", re.S)
+
+
+def parse_quote(text: str) -> Optional[Tuple[str, str]]:
+    """split the quote message into (quote, reply), return None for normal message"""
+    if not QUOTE_PATTERN.match(text):
+        return None
+    quote = re.search(r"：.+」", text, re.S)
+    reply = re.search(r"-\n.+", text, re.S)
+    if not quote or not reply:
+        return None
+    return quote.group()[1:-1], reply.group()[2:]
+
+
+class MessageContext:
+    """lazily computed and memoized properties of one message
+
+    every expensive property (puppet RPC, regex, intent detection) is computed at
+    most once per message, no matter how many plugins read it.
+    """
+    def __init__(self, msg: Message) -> None:
+        self.msg = msg
+        self._tasks: Dict[Any, asyncio.Future] = {}
+        self._values: Dict[str, Any] = {}
+
+    async def _memo(self, key: Any, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+        try:
+            # shield the shared task, so one cancelled plugin does not cancel the others
+            return await asyncio.shield(task)
+        except Exception:
+            if task.done() and self._tasks.get(key) is task:
+                # do not memoize the failures, the next plugin may retry
+                del self._tasks[key]
+            raise
+
+    @property
+    def talker(self) -> Contact:
+        return self.msg.talker()
+
+    @property
+    def room(self) -> Optional[Room]:
+        return self.msg.room()
+
+    @property
+    def text(self) -> str:
+        if 'text' not in self._values:
+            self._values['text'] = self.msg.text()
+        return self._values['text']
+
+    @property
+    def clean_text(self) -> str:
+        """the text without the @ info"""
+        if 'clean_text' not in self._values:
+            self._values['clean_text'] = remove_at_info(self.text)
+        return self._values['clean_text']
+
+    async def mention_self(self) -> bool:
+        return bool(await self._memo('mention_self', self.msg.mention_self))
+
+    async def mention_text(self) -> str:
+        """the text without mention in room, the raw text in DM"""
+        if not self.room:
+            return self.text
+        return await self._memo('mention_text', self.msg.mention_text)
+
+    async def mention_list(self) -> list:
+        return await self._memo('mention_list', self.msg.mention_list)
+
+    async def room_ready(self) -> None:
+        if self.room:
+            await self._memo('room_ready', self.room.ready)
+
+    async def topic(self) -> str:
+        if not self.room:
+            return ''
+
+        async def _topic() -> str:
+            await self.room_ready()
+            return await self.room.topic()
+        return await self._memo('topic', _topic)
+
+    async def owner(self) -> Optional[Contact]:
+        if not self.room:
+            return None
+
+        async def _owner() -> Optional[Contact]:
+            await self.room_ready()
+            return await self.room.owner()
+        return await self._memo('owner', _owner)
+
+    async def quote(self) -> Optional[Tuple[str, str]]:
+        """(quote, reply) of the quote message, None for normal message"""
+        async def _quote() -> Optional[Tuple[str, str]]:
+            return parse_quote(await self.mention_text())
+        return await self._memo('quote', _quote)
+
+    async def intent(self, predictor: Any, text: Optional[str] = None) -> Tuple[str, float]:
+        """the intent of the text (mention text by default), shared by the plugins using the same predictor
+
+        Args:
+            predictor: the intent client, `predict` may be sync or async
+            text (str): the text to predict
+        """
+        if text is None:
+            text = await self.mention_text()
+
+        async def _intent() -> Tuple[str, float]:
+            result = predictor.predict(text)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        return await self._memo(('intent', id(predictor), text), _intent)
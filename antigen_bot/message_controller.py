@@ -1,24 +1,106 @@
 from __future__ import annotations
 import os
-from typing import Dict, List, Optional, Union
+from typing import Any, Callable, Container, Dict, List, Optional, Union
 import functools
-from copy import deepcopy
-from wechaty import Message, Wechaty, WechatyPlugin
+from dataclasses import dataclass, field
+from wechaty import Message, MessageType, Wechaty, WechatyPlugin
+from wechaty.plugin import PluginStatus
 from wechaty_puppet import get_logger
 
+from antigen_bot.cache import TTLCache, TimeBucketedSet
+from antigen_bot.message_context import MessageContext
+from antigen_bot.dispatcher import ConversationDispatcher
+from antigen_bot.admission import LoadShedder, thresholds_from_env
+from antigen_bot.utils import remove_at_info
+
+# bitmask with every plugin bit set, python ints are two's complement
+ALL_PLUGINS = -1
+
+
+@dataclass
+class Route:
+    """the cheap claim predicates of a plugin's on_message handler
+
+    all the predicates must pass before the handler is called, they should
+    only read the message payload and the plugin memory, never call the puppet.
+    """
+    priority: int = 0
+    types: Optional[List[MessageType]] = None
+    in_room: Optional[bool] = None                  # True: room only, False: DM only
+    prefixes: Optional[List[str]] = None            # text without @ must start with one of them
+    rooms: Optional[Callable[[WechatyPlugin], Container[str]]] = None   # active rooms of the plugin
+    accept: Optional[Callable[[WechatyPlugin, Message], bool]] = None
+    ignore_self: bool = False
+    always: bool = False                            # also receive the messages claimed by other plugins
+
+    handler: Optional[Callable] = field(default=None, repr=False)
+
+    def match(self, plugin: WechatyPlugin, msg: Message) -> bool:
+        """check if the message should be sent to the plugin"""
+        if self.ignore_self and (msg.is_self() or msg.talker().contact_id == 'weixin'):
+            return False
+        if self.types is not None and msg.type() not in self.types:
+            return False
+
+        room = msg.room()
+        if self.in_room is not None and bool(room) != self.in_room:
+            return False
+        if room and self.rooms is not None and room.room_id not in self.rooms(plugin):
+            return False
+        if self.prefixes is not None:
+            text = remove_at_info(msg.text()).strip()
+            if not any(text.startswith(prefix) for prefix in self.prefixes):
+                return False
+        if self.accept is not None and not self.accept(plugin, msg):
+            return False
+        return True
+
 
 class MessageController:
     """Store the Message Id Container"""
     _instance: Optional[MessageController] = None
 
-    def __init__(self) -> None:
-        self.ids = set()
+    def __init__(self, message_ttl: float = 600, max_messages: int = 50000) -> None:
+        # message ids are only needed while wechaty may re-emit them, so both
+        # containers forget a message after `message_ttl` seconds
+        self.ids: TimeBucketedSet[str] = TimeBucketedSet(window=message_ttl, max_size=max_messages)
         self.plugin_names: List[str] = []
-        self.disabled_plugins: Dict[str, List[str]] = {}
+        self.plugin_bits: Dict[str, int] = {}
+        # message_id -> bitmask of the disabled plugins, bit index is `plugin_bits[name]`
+        self.disabled_plugins: TTLCache[str, int] = TTLCache(max_size=max_messages, ttl=message_ttl)
+
+        # (plugin, route) sorted by the priority, higher priority goes first
+        self.routes: List[tuple] = []
+        self.plugin_manager: Any = None
+        self.dispatched: TimeBucketedSet[str] = TimeBucketedSet(window=message_ttl, max_size=max_messages)
+        self.route_stats: Dict[str, Dict[str, int]] = {}
+        # contexts only live while the plugins handle the message
+        self.contexts: TTLCache[str, MessageContext] = TTLCache(max_size=2000, ttl=message_ttl)
+        self.dispatcher: Optional[ConversationDispatcher] = None
+        self.inflight = 0
+        self.shedder = LoadShedder(load=self.load, thresholds=thresholds_from_env())
         self.cache_dir = '.CA'
         os.makedirs(self.cache_dir, exist_ok=True)
         log_file = os.path.join(self.cache_dir, 'log.log')
         self.logger = get_logger("MessageController", file=log_file)
+
+        if os.environ.get('CA_DISPATCH_MODE', 'sequential') == 'actor':
+            self.set_dispatch_mode('actor', max_concurrency=int(os.environ.get('CA_MAX_CONCURRENCY', 32)))
+
+    def set_dispatch_mode(self, mode: str, **kwargs: Any) -> None:
+        """switch the dispatch mode of the routed plugins
+
+        Args:
+            mode (str): `sequential`: handle the message inside the wechaty event,
+                `actor`: handle the messages of each conversation in order on its own queue,
+                different conversations run concurrently. kwargs go to ConversationDispatcher.
+        """
+        if mode == 'sequential':
+            self.dispatcher = None
+        elif mode == 'actor':
+            self.dispatcher = ConversationDispatcher(logger=self.logger, **kwargs)
+        else:
+            raise ValueError(f'unknown dispatch mode: {mode}')
     
     def exist(self, message_id: str) -> bool:
         """exist if the message has been emitted
@@ -29,10 +111,7 @@ class MessageController:
         Returns:
             bool: if the message is the first message
         """
-        if message_id in self.ids:
-            return True
-        self.ids.add(message_id)
-        return False
+        return self.ids.add(message_id)
     
     @classmethod
     def instance(cls) -> MessageController:
@@ -45,8 +124,63 @@ class MessageController:
         """init the plugins and control the message receiving"""
         if self.plugin_names:
             return
-        plugin_map: Dict[str, WechatyPlugin] = wechaty._plugin_manager._plugins
+        self.plugin_manager = wechaty._plugin_manager
+        plugin_map: Dict[str, WechatyPlugin] = self.plugin_manager._plugins
         self.plugin_names = list(plugin_map.keys())
+        self.plugin_bits = {name: index for index, name in enumerate(self.plugin_names)}
+
+        routes = []
+        for plugin in plugin_map.values():
+            route: Optional[Route] = getattr(type(plugin).on_message, '__route__', None)
+            if route is not None:
+                routes.append((plugin, route))
+                self.route_stats[plugin.name] = {'matched': 0, 'skipped': 0, 'claimed': 0}
+        # sorted is stable, so plugins with the same priority keep the `bot.use` order
+        self.routes = sorted(routes, key=lambda item: -item[1].priority)
+
+    def is_disabled(self, plugin_name: str, message_id: str) -> bool:
+        """check if the plugin has been disabled for the message"""
+        mask = self.disabled_plugins.get(message_id, 0)
+        if not mask:
+            return False
+        index = self.plugin_bits.get(plugin_name)
+        if index is None:
+            # plugins unknown to the controller are disabled with all the others
+            return mask == ALL_PLUGINS
+        return bool(mask & (1 << index))
+
+    def is_running(self, plugin: WechatyPlugin) -> bool:
+        """check the plugin status like `PluginManager.emit`, a stopped plugin gets no message"""
+        plugin_status = getattr(self.plugin_manager, 'plugin_status', None)
+        return plugin_status is None or plugin_status(plugin.name) == PluginStatus.Running
+
+    def load(self) -> int:
+        """the messages being handled or waiting in the queues"""
+        backlog = self.dispatcher.backlog if self.dispatcher else 0
+        return self.inflight + backlog
+
+    def admit(self, feature: str) -> bool:
+        """admission control of the expensive features, see LoadShedder"""
+        return self.shedder.admit(feature)
+
+    def stats(self) -> Dict[str, Any]:
+        """size and eviction counters of the message state"""
+        return {
+            'ids': self.ids.stats(),
+            'disabled_plugins': self.disabled_plugins.stats(),
+            'routes': self.route_stats,
+            'contexts': self.contexts.stats(),
+            'dispatcher': self.dispatcher.stats() if self.dispatcher else None,
+            'shedder': self.shedder.stats(),
+        }
+
+    def context(self, msg: Message) -> MessageContext:
+        """the shared context of the message, created on the first access"""
+        ctx = self.contexts.get(msg.message_id)
+        if ctx is None:
+            ctx = MessageContext(msg)
+            self.contexts.set(msg.message_id, ctx)
+        return ctx
 
     @staticmethod
     def disable_all_plugins(msg: Union[Message, str]) -> None:
@@ -56,17 +190,95 @@ class MessageController:
         if isinstance(msg, Message):
             msg = msg.message_id
     
-        instance.disabled_plugins[msg] = deepcopy(instance.plugin_names)
+        instance.disabled_plugins.set(msg, ALL_PLUGINS)
     
     def may_disable_message(self, func):
         """decorator for disable the message"""
         @functools.wraps(func)
         async def wrapper(plugin: WechatyPlugin, msg: Message):
-            if msg.message_id in self.disabled_plugins and plugin.name in self.disabled_plugins[msg.message_id]:
+            if self.is_disabled(plugin.name, msg.message_id):
                 self.logger.info(f'disable plugin: {plugin}')
                 self.logger.info(f'disable under message<{msg.message_id}>: {msg}\n')
                 return
             await func(plugin, msg)
         return wrapper
 
+    def route(self, **predicates: Any):
+        """decorator which registers the on_message handler into the router
+
+        the first routed plugin receiving a message dispatches it to every
+        running routed plugin whose predicates match, ordered by priority.
+        Once one of them claims the message by `disable_all_plugins`, only the
+        plugins routed with `always=True` still receive it.
+
+        Examples:
+            >>> @message_controller.route(priority=10, types=[MessageType.MESSAGE_TYPE_TEXT], in_room=False)
+            >>> async def on_message(self, msg: Message) -> None:
+        """
+        def decorator(func):
+            route = Route(**predicates, handler=func)
+
+            @functools.wraps(func)
+            async def wrapper(plugin: WechatyPlugin, msg: Message):
+                if not self.plugin_names:
+                    self.init_plugins(plugin.bot)
+                await self.handle(msg)
+
+            wrapper.__route__ = route
+            return wrapper
+        return decorator
+
+    async def handle(self, msg: Message) -> None:
+        """dispatch the message only once, on the conversation queue in actor mode
+
+        in actor mode the wechaty event still waits until the queued dispatch
+        is done: the puppet runs every message event as its own task, so the
+        conversations stay concurrent, and the plugins which are not routed
+        (called by wechaty after the routed ones) see the claims of the
+        routed plugins. The queues are keyed by room, or by talker for DMs, so
+        the DM and the room messages of one talker are not ordered between
+        each other (e.g. the media FAQ recording of QunAssistant, which reads
+        both, follows the order of each conversation only).
+        """
+        if self.dispatched.add(msg.message_id):
+            return
+        self.context(msg)
+
+        if self.dispatcher is None:
+            await self.dispatch(msg)
+            return
+
+        room = msg.room()
+        key = room.room_id if room else msg.talker().contact_id
+        await self.dispatcher.submit(key, functools.partial(self.dispatch, msg), wait=True)
+
+    async def dispatch(self, msg: Message) -> None:
+        """dispatch the message to the routed plugins by priority"""
+        self.inflight += 1
+        try:
+            await self._dispatch(msg)
+        finally:
+            self.inflight -= 1
+
+    async def _dispatch(self, msg: Message) -> None:
+        for plugin, route in self.routes:
+            disabled = self.is_disabled(plugin.name, msg.message_id)
+            if disabled and not route.always:
+                continue
+            if not self.is_running(plugin):
+                continue
+            stats = self.route_stats[plugin.name]
+            if not route.match(plugin, msg):
+                stats['skipped'] += 1
+                continue
+
+            stats['matched'] += 1
+            try:
+                await route.handler(plugin, msg)
+            except Exception as e:
+                self.logger.exception(f'plugin<{plugin.name}> failed on message<{msg.message_id}>: {e}')
+
+            if not disabled and self.is_disabled(plugin.name, msg.message_id):
+                stats['claimed'] += 1
+
 message_controller = MessageController.instance()
\ No newline at end of file
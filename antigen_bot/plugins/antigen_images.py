@@ -12,6 +12,7 @@ import requests
 from dataclasses import dataclass, field
 
 from antigen_bot.message_controller import message_controller
+from antigen_bot.resilience import resilience
 
 
 @dataclass
@@ -32,7 +33,24 @@ class AntigenImagesPlugin(WechatyPlugin):
         self.admin_status = {}
         self.endpoint = endpoint or os.environ.get('antigen_image_endpoint', None)
 
-    @message_controller.may_disable_message
+    def _recognize(self, target_file: str) -> dict:
+        """post the image to the recognition endpoint"""
+        with open(target_file, 'rb') as f:
+            # the thread stops waiting at the deadline of the service too
+            response = requests.post(self.endpoint, files={'antigen': f}, timeout=resilience.service('antigen_image').policy.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def _accept(self, msg: Message) -> bool:
+        """cheap claim predicate: the test command or images from the testers"""
+        if not self.endpoint:
+            return False
+        if self.command in msg.text():
+            return True
+        return msg.type() in [MessageType.MESSAGE_TYPE_IMAGE, MessageType.MESSAGE_TYPE_ATTACHMENT] \
+            and msg.talker().contact_id in self.admin_status
+
+    @message_controller.route(priority=10, accept=_accept)
     async def on_message(self, msg: Message) -> None:
         """listen message event"""
         talker = msg.talker()
@@ -58,7 +76,11 @@ class AntigenImagesPlugin(WechatyPlugin):
             target_file = os.path.join(self.cache_dir, file_box.name)
             
             await file_box.to_file(target_file, overwrite=True)
-            result = requests.post(self.endpoint, files={'antigen': open(target_file, 'rb')}).json()
+            try:
+                result = await resilience.service('antigen_image').call_blocking(self._recognize, target_file)
+            except Exception as e:
+                self.logger.error(f'antigen image recognition failed: {e!r}')
+                return
             
             antigen_response: AntigenResponse = AntigenResponse(**result['data'])
 
@@ -30,7 +30,7 @@ class DingDongPlugin(WechatyPlugin):
             return
         self.event.set()
 
-    @message_controller.may_disable_message
+    @message_controller.route()
     async def on_message(self, msg: Message) -> None:
         """listen message event"""
         talker = msg.talker()
@@ -1,10 +1,8 @@
 """Dynamic Authorization Plugin"""
 from __future__ import annotations
 import os
-import json
 from datetime import datetime, timedelta
 from typing import (
-    Dict,
     Optional,
     List
 )
@@ -18,8 +16,10 @@ from wechaty import (
 from wechaty_puppet import get_logger
 
 from antigen_bot.forward_config import Conv2ConvsConfig, load_from_excel
-from antigen_bot.utils import remove_at_info
 from antigen_bot.message_controller import message_controller
+from antigen_bot.state_store import StateStore
+
+STATE_NAMESPACE = 'dynamic_authorize'
 
 class ConfigFactory:
     """Config Factory"""
@@ -71,46 +71,20 @@ class DynamicAuthorizationPlugin(WechatyPlugin):
 
         os.makedirs(os.path.dirname(self.config_file), exist_ok=True)
         self.config_factory = ConfigFactory(conv_config_file)
-    
-    def _load_config(self) -> Dict[str, List[str]]:
-        """load the data from config file"""
-        if not os.path.exists(self.config_file):
-            self.logger.error('configuration file not found: %s', self.config_file)
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump({}, f, ensure_ascii=False)
-
-        with open(self.config_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return data
-
-    def _save_config(self, config):
-        """save the data to config file"""
-        with open(self.config_file, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False)
-    
-    def authorize(self, date: str, contact_ids: List[str]):
-        """authorize the talkers"""
-
-        config = self._load_config()
 
-        if date not in config:
-            config[date] = []
+        # every (date, id) is one record of the state store, the old json file is imported once
+        self.state = StateStore.shared(os.path.splitext(self.config_file)[0] + '.db')
+        self.state.import_json(STATE_NAMESPACE, self.config_file, depth=2)
 
+    def authorize(self, date: str, contact_ids: List[str]):
+        """authorize the talkers"""
         for contact_id in contact_ids:
-            if contact_id not in config[date]:
-                config[date].append(contact_id)
-        self._save_config(config)
+            self.state.set(STATE_NAMESPACE, (date, contact_id), True)
 
     def unauthorize(self, date: str, contact_ids: List[str]):
         """authorize the talkers"""
-
-        config = self._load_config()
-
-        if date not in config:
-            return
-
-        config[date] = list(set(config[date]) - set(contact_ids))
-        self._save_config(config)
+        for contact_id in contact_ids:
+            self.state.delete(STATE_NAMESPACE, (date, contact_id))
 
     def is_valid(self, contact_id: str) -> bool:
         """check if the talker is valid
@@ -122,23 +96,23 @@ class DynamicAuthorizationPlugin(WechatyPlugin):
             bool: the result of the code
         """
         date = datetime.today().strftime('%Y-%m-%d')
-        config = self._load_config()
-        return contact_id in config.get(date, [])
+        return bool(self.state.get(STATE_NAMESPACE, (date, contact_id), False))
 
-    @message_controller.may_disable_message
+    @message_controller.route(ignore_self=True, in_room=True)
     async def on_message(self, msg: Message) -> None:
         """handle the authorize"""
         room = msg.room()
         if msg.is_self() or not room:
             return
-        if not await msg.mention_self():
+        ctx = message_controller.context(msg)
+        if not await ctx.mention_self():
             return
 
-        mention_list = await msg.mention_list()
+        mention_list = await ctx.mention_list()
         if len(mention_list) <= 1:
             return
 
-        clear_text = remove_at_info(msg.text()).strip()
+        clear_text = ctx.clean_text.strip()
         if not clear_text:
             await msg.say('如果您想授权此群友，请添加文字内容：今日授权、明日授权等关键字')
             return
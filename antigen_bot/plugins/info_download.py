@@ -81,7 +81,7 @@ class InfoDownloaderPlugin(WechatyPlugin):
         
         return infos
 
-    @message_controller.may_disable_message    
+    @message_controller.route(priority=40, in_room=False, prefixes=['#log-all-'])
     async def on_message(self, msg: Message) -> None:
         if msg.room():
             return
@@ -92,12 +92,12 @@ class InfoDownloaderPlugin(WechatyPlugin):
             for contact in contacts:
                 self.logger.info(contact)
             self.logger.info('===========================all contacts===========================')
-            message_controller.disable_all_plugins()
+            message_controller.disable_all_plugins(msg)
         elif msg.text() == '#log-all-rooms':
             self.logger.info('===========================all rooms===========================')
             rooms = await self.get_room_infos()
             for room in rooms:
                 self.logger.info(room)
             self.logger.info('===========================all rooms===========================')
-            message_controller.disable_all_plugins()
+            message_controller.disable_all_plugins(msg)
 
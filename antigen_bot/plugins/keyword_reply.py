@@ -23,7 +23,6 @@ from wechaty_puppet import get_logger
 from tap import Tap
 
 from antigen_bot.plugins.config import Conversation
-from antigen_bot.utils import remove_at_info
 from antigen_bot.message_controller import message_controller
 
 
@@ -315,6 +314,8 @@ class KeyWordReplyPlugin(WechatyPlugin):
         elif parser.command_type == 'remove':
             await self.handle_remove_command(msg, parser)
     
+    # 与路由之前一样，其他插件认领消息后仍然处理
+    @message_controller.route(ignore_self=True, always=True)
     async def on_message(self, msg: Message) -> None:
         talker: Contact = msg.talker()
         room: Optional[Room] = msg.room()
@@ -324,11 +325,12 @@ class KeyWordReplyPlugin(WechatyPlugin):
             return
 
         # 2. 如果是群聊，可是并没有艾特机器人
-        if room and not await msg.mention_self():
+        ctx = message_controller.context(msg)
+        if room and not await ctx.mention_self():
             return
         
         # 3. 查找匹配上的Rule
-        text = remove_at_info(msg.text())
+        text = ctx.clean_text
         args = await self.match_command(text)
         if args:
             await self.handle_command_message(msg, args=args)
@@ -6,7 +6,8 @@ from wechaty import (
     WechatyPluginOptions
 )
 # from utils.DFAFilter import DFAFilter
-from utils.rasaintent import RasaIntent
+from antigen_bot.message_controller import message_controller
+from antigen_bot.resources import registry
 
 
 class Lurker(WechatyPlugin):
@@ -16,8 +17,10 @@ class Lurker(WechatyPlugin):
     def __init__(self, options: Optional[WechatyPluginOptions] = None):
         super().__init__(options)
 
-        self.intent = RasaIntent()
+        self.intent = registry.get('intent')
 
+    # 与路由之前一样，其他插件认领消息后仍然处理
+    @message_controller.route(ignore_self=True, types=[MessageType.MESSAGE_TYPE_TEXT], always=True)
     async def on_message(self, msg: Message) -> None:
         # 1. 判断是否是自己发送的消息\weixin service\room message
         talker = msg.talker()
@@ -27,15 +30,12 @@ class Lurker(WechatyPlugin):
         if msg.type() != MessageType.MESSAGE_TYPE_TEXT:
             return
 
-        if msg.room():
-            if not await msg.mention_self():
-                return
-            else:
-                text = await msg.mention_text()
-        else:
-            text = msg.text()
+        ctx = message_controller.context(msg)
+        if msg.room() and not await ctx.mention_self():
+            return
+        text = await ctx.mention_text()
         if not text:
             return
 
-        intent, cofidence = self.intent.predict(text)
+        intent, cofidence = await ctx.intent(self.intent, text)
         await msg.say(f"text:{text}, intent: {intent}, cofidence: {cofidence}")
@@ -1,10 +1,9 @@
 import json
 import os
 import re
-import time
 import xlrd
 import random
-from typing import Optional
+from typing import List, Optional
 from wechaty import (
     Wechaty,
     FileBox,
@@ -15,6 +14,10 @@ from wechaty import (
 )
 from datetime import datetime
 from antigen_bot.message_controller import message_controller
+from antigen_bot.scheduler import DelayedJobScheduler, Job
+from antigen_bot.state_store import StateStore
+
+CANCEL_PATTERN = re.compile(r"^取消\s*([0-9a-f]{8})$")
 
 
 class OnCallNoticePlugin(WechatyPlugin):
@@ -46,18 +49,24 @@ class OnCallNoticePlugin(WechatyPlugin):
         if not self.data:
             raise RuntimeError('CA on_call_notice.xlsx not valid, pls refer to above info and try again')
 
-        if "authorize.json" in self.config_files:
-            with open(os.path.join(self.config_url, 'authorize.json'), 'r', encoding='utf-8') as f:
-                self.auth = json.load(f)
-        else:
+        # 授权记录保存在 state.db 中，旧版的 authorize.json 在第一次启动时导入
+        self.state = StateStore.shared(os.path.join(self.config_url, 'state.db'))
+        self.state.import_json('authorize', os.path.join(self.config_url, 'authorize.json'), depth=2)
+        self.auth = self.state.nested('authorize')
+        if not self.auth:
             date = datetime.today().strftime('%Y-%m-%d')
             self.auth = {key: {date: []} for key in self.data.keys()}
 
         self.listen_to_forward = {}   #记录转发状态
         self.last_loop = {}    #记录上一轮发送群名
 
+        # 延迟发送的通知，重启后继续有效
+        self.scheduler = DelayedJobScheduler(os.path.join(self.config_url, 'scheduled_notices.jsonl'), logger=self.logger)
+        self.scheduler.register('on_call_notice', self._send_scheduled_notice)
+
     async def init_plugin(self, wechaty: Wechaty) -> None:
         message_controller.init_plugins(wechaty)
+        self.scheduler.start()
         return await super().init_plugin(wechaty)
 
     def _file_check(self) -> bool:
@@ -117,7 +126,8 @@ class OnCallNoticePlugin(WechatyPlugin):
         if msg.text() == 'help':
             await msg.say("OnCallNoticePlugin Director Code: \n"
                           "ding -- check heartbeat \n"
-                          "reload configs --- reload on_call_notice.xlsx \n")
+                          "reload configs --- reload on_call_notice.xlsx \n"
+                          "scheduled --- list the scheduled notices \n")
             return
         # 3.functions
         if msg.text() == 'reload configs':
@@ -129,8 +139,61 @@ class OnCallNoticePlugin(WechatyPlugin):
                 await msg.say("on_call_notice configs has been updated")
             return
 
+        if msg.text() == 'scheduled':
+            jobs = self.scheduler.jobs()
+            if not jobs:
+                await msg.say("no scheduled notice")
+                return
+            await msg.say("\n".join(self._describe_job(job) for job in jobs))
+            return
+
         await msg.say("send help to me to check what you can do")
 
+    async def broadcast(self, regex, reply: str, file_box: Optional[FileBox] = None) -> List[str]:
+        """send the reply (and the media) to all of the rooms matching the regex
+
+        Returns:
+            List[str]: the topics of the notified rooms
+        """
+        rooms = await self.bot.Room.find_all()
+        random.shuffle(rooms)
+
+        topics = []
+        for room in rooms:
+            await room.ready()
+            topic = room.payload.topic
+            if regex.search(topic):
+                await room.say(reply)
+                if file_box:
+                    await room.say(file_box)
+                topics.append(topic)
+
+        self.logger.info('=================finish to On_call_Notice=================\n')
+        return topics
+
+    @staticmethod
+    def _describe_job(job: Job) -> str:
+        run_at = datetime.fromtimestamp(job.run_at).strftime('%m-%d %H:%M:%S')
+        return "{0}：{1} 发送预设【{2}】".format(job.job_id, run_at, job.payload.get('word', ''))
+
+    async def _send_scheduled_notice(self, job: Job) -> None:
+        """send the hold-delayed notice, then report to the sender"""
+        payload = job.payload
+        file_box = None
+        if payload.get('media'):
+            file_box = FileBox.from_file(self.config_url + "/media/" + payload['media'])
+
+        self.last_loop[job.owner] = await self.broadcast(re.compile(payload['regex']), payload['reply'], file_box)
+
+        if self.last_loop[job.owner]:
+            report = "预设【{}】已转发，@我并发送查询，查看转发群记录".format(payload['word'])
+        else:
+            report = "预设【{}】未找到可通知的群，请重试".format(payload['word'])
+        if payload.get('room_id'):
+            await self.bot.Room.load(payload['room_id']).say(report, [job.owner])
+        else:
+            await self.bot.Contact.load(job.owner).say(report)
+
     async def forward_message(self, _id, msg: Message, regex):
         """forward the message to the target conversations
 
@@ -182,13 +245,29 @@ class OnCallNoticePlugin(WechatyPlugin):
 
         self.logger.info('=================finish to On_call_Notice=================\n\n')
 
-    @message_controller.may_disable_message
+    def _accept(self, msg: Message) -> bool:
+        """cheap claim predicate: known senders or authorized conversations"""
+        talker_id = msg.talker().contact_id
+        if talker_id in self.directors or talker_id in self.auth or talker_id in self.data \
+                or talker_id in self.listen_to_forward or talker_id in self.last_loop:
+            return True
+        if not msg.room():
+            return False
+
+        room_id = msg.room().room_id
+        if room_id in self.data:
+            return True
+        date = datetime.today().strftime('%Y-%m-%d')
+        return any(room_id in value.get(date, []) for value in self.auth.values())
+
+    @message_controller.route(priority=30, ignore_self=True, accept=_accept)
     async def on_message(self, msg: Message) -> None:
         if msg.is_self() or msg.talker().contact_id == "weixin":
             return
 
         talker = msg.talker()
         date = datetime.today().strftime('%Y-%m-%d')
+        ctx = message_controller.context(msg)
 
         # 2. check if is director
         if talker.contact_id in self.directors:
@@ -198,23 +277,21 @@ class OnCallNoticePlugin(WechatyPlugin):
         if msg.room() and '@所有人' in msg.text():
             return
 
-        if (talker.contact_id in self.auth.keys()) and ("撤销" in msg.text()) and (await msg.mention_self()):
+        if (talker.contact_id in self.auth.keys()) and ("撤销" in msg.text()) and (await ctx.mention_self()):
             if msg.room().room_id in self.auth[talker.contact_id].get(date, []):
                 self.auth[talker.contact_id][date].remove(msg.room().room_id)
-                with open(os.path.join(self.config_url, 'authorize.json'), 'w', encoding='utf-8') as f:
-                    json.dump(self.auth, f)
+                self.state.set('authorize', (talker.contact_id, date), self.auth[talker.contact_id][date])
                 await msg.say("本群转发授权已经撤销，如需转发，请管理人员再次授权")
             else:
                 await msg.room().say("本群未开启授权，如需授权，请在被授权群中@我并发送 授权", [talker.contact_id])
             return
 
-        if (talker.contact_id in self.auth.keys()) and ("授权" in msg.text()) and (await msg.mention_self()):
+        if (talker.contact_id in self.auth.keys()) and ("授权" in msg.text()) and (await ctx.mention_self()):
             if date in self.auth[talker.contact_id].keys():
                 self.auth[talker.contact_id][date].append(msg.room().room_id)
             else:
                 self.auth[talker.contact_id][date] = [msg.room().room_id]
-            with open(os.path.join(self.config_url, 'authorize.json'), 'w', encoding='utf-8') as f:
-                json.dump(self.auth, f)
+            self.state.set('authorize', (talker.contact_id, date), self.auth[talker.contact_id][date])
             await msg.room().say("本群授权已开启，如需撤销，请在本群中@我并发送 撤销", [talker.contact_id])
             await msg.say("本群已授权开启转发，授权期仅限今日（至凌晨12点）。转发请按如下格式： @我 楼号 预设关键词or转发（均用空格隔开）")
             return
@@ -258,9 +335,9 @@ class OnCallNoticePlugin(WechatyPlugin):
 
         # 3. 判断是否来自工作群或者指定联系人的消息（优先判定群）
         if msg.room():
-            if not await msg.mention_self():
+            if not await ctx.mention_self():
                 return
-            text = await msg.mention_text()
+            text = await ctx.mention_text()
             id = msg.room().room_id
         else:
             text = msg.text()
@@ -274,6 +351,23 @@ class OnCallNoticePlugin(WechatyPlugin):
                 await msg.say("未查到对应您的上一轮通知记录")
             return
 
+        if text == "定时任务":
+            jobs = self.scheduler.jobs(talker.contact_id)
+            if jobs:
+                await msg.say("\n".join(self._describe_job(job) for job in jobs) + "\n发送“取消 编号”可撤销")
+            else:
+                await msg.say("您当前没有待发送的定时通知")
+            return
+
+        cancel = CANCEL_PATTERN.match(text)
+        if cancel:
+            job = self.scheduler.cancel(cancel.group(1), owner=talker.contact_id)
+            if job:
+                await msg.say("已撤销定时通知 {}".format(self._describe_job(job)))
+            else:
+                await msg.say("未找到该定时通知，发送 定时任务 查看待发送的通知")
+            return
+
         token = None
         if id in self.data.keys():
             token = id
@@ -294,6 +388,7 @@ class OnCallNoticePlugin(WechatyPlugin):
         # 4. 检查msg.text()是否包含关键词
         reply = ""
         file_box = None
+        hold, media, keyword = 0, None, None
         for word in words:
             if word in spec.keys():
                 self.logger.info('=================start to On_call_Notice=================')
@@ -304,16 +399,16 @@ class OnCallNoticePlugin(WechatyPlugin):
                     await msg.say("kewords【{}】未设定转发文本".format(word))
                     return
 
-                if spec[word]["hold"] != 0:
-                    await msg.say("收到，等待{0}秒后，按预设【{1}】进行发送".format(spec[word]["hold"], word))
-                    time.sleep(spec[word]["hold"])
-                else:
+                # 延迟发送的通知在匹配到群后交给 scheduler，不阻塞事件循环
+                hold, keyword = spec[word]["hold"], word
+                if hold == 0:
                     await msg.say("收到，现在开始按预设【{}】进行发送".format(word))
 
                 reply = spec[word].get("reply")
 
-                if spec[word]["media"]:
-                    file_box = FileBox.from_file(self.config_url + "/media/" + spec[word]["media"])
+                media = spec[word]["media"]
+                if media:
+                    file_box = FileBox.from_file(self.config_url + "/media/" + media)
                 words.remove(word)
 
         if (not reply) and ("转发" not in words):
@@ -354,24 +449,25 @@ class OnCallNoticePlugin(WechatyPlugin):
 
         if "转发" in words:
             self.listen_to_forward[talker.contact_id] = [regex, token, id]
+            if hold:
+                # 转发的内容是下一条消息，不能预先排入定时任务，延迟发送不适用
+                await msg.say("收到，预设【{}】的延迟发送不适用于转发，转发内容收到后将立即发送".format(keyword))
             await msg.say("请将需要转发的内容直接发到这里")
             #这一步分别存储 转发规则、授权来源和对话号，后二者用于后续鉴权
             return
 
-        rooms = await self.bot.Room.find_all()
-        random.shuffle(rooms)
-
-        self.last_loop[talker.contact_id] = []
-        for room in rooms:
-            await room.ready()
-            topic = room.payload.topic
-            if regex.search(topic):
-                await room.say(reply)
-                if file_box:
-                    await room.say(file_box)
-                self.last_loop[talker.contact_id].append(topic)
+        if hold:
+            job = self.scheduler.schedule('on_call_notice', hold, owner=talker.contact_id, payload={
+                'regex': regex.pattern,
+                'reply': reply,
+                'media': media,
+                'word': keyword,
+                'room_id': msg.room().room_id if msg.room() else None,
+            })
+            await msg.say("收到，等待{0}秒后，按预设【{1}】进行发送（编号{2}，发送“取消 {2}”可撤销）".format(hold, keyword, job.job_id))
+            return
 
-        self.logger.info('=================finish to On_call_Notice=================\n')
+        self.last_loop[talker.contact_id] = await self.broadcast(regex, reply, file_box)
 
         if msg.room():
             if self.last_loop.get(talker.contact_id, []):
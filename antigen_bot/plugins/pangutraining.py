@@ -1,5 +1,4 @@
 import os
-import re
 from typing import Optional
 from wechaty import (
     Wechaty,
@@ -9,14 +8,12 @@ from wechaty import (
     Contact,
     WechatyPluginOptions
 )
-from paddlenlp import Taskflow
 from antigen_bot.message_controller import message_controller
-from utils.simpleFilter import SimpleFilter
-from utils.rasaintent import RasaIntent
+from antigen_bot.hedging import HedgedGenerator
+from antigen_bot.resources import registry
 import json
 import xlrd
 from datetime import datetime
-from pcl_pangu.online import Infer
 
 
 class PanGuTrainingPlugin(WechatyPlugin):
@@ -43,17 +40,24 @@ class PanGuTrainingPlugin(WechatyPlugin):
             self.logger.warning('there must be at least one director, pls retry')
             raise RuntimeError('Training director.json not valid, pls refer to above info and try again')
 
-        self.gfw = SimpleFilter()
-        self.intent = RasaIntent()
-        self.sim = Taskflow("text_similarity")
+        self.gfw = registry.get('keyword_filter')
+        self.intent = registry.get('intent')
+        self.sim = registry.get('similarity')
+        self.hedger = HedgedGenerator.from_env(logger=self.logger)
         self.pangu_key = os.environ.get("PANGU_KEY", None)
         if not self.pangu_key:
             raise RuntimeError('pangu key not set')
+        # 生成请求经网关只发给盘古，共用网关的限流、熔断和统计
+        self.gateway = registry.get('generation')
+        if 'pangu' not in self.gateway.routes:
+            raise RuntimeError('pangu is not a generation provider, add it to CA_GENERATION_PROVIDERS')
         self.training = {}
         self.logger.info(f'Pangu Training plugin init success.')
 
     async def init_plugin(self, wechaty: Wechaty) -> None:
         message_controller.init_plugins(wechaty)
+        if not await self.intent.check():
+            self.logger.warning('Rasa server not running, the intents fall back to nlu_fallback until it is up')
         return await super().init_plugin(wechaty)
 
     def _file_check(self) -> bool:
@@ -109,11 +113,15 @@ class PanGuTrainingPlugin(WechatyPlugin):
             courses[table.cell_value(i, 0)] = {'prompt': table.cell_value(i, 2), 'des': f'情景对话模拟训练已开始。\n{table.cell_value(i, 1)}', 'opening': table.cell_value(i, 3)}
         return courses
 
-    def repeat_check(self, list) -> int:
+    async def repeat_check(self, list) -> int:
         """
         check the repeat message
         """
-        similatiry = self.sim(list)
+        try:
+            similatiry = await self.sim.similarity(list)
+        except Exception as e:
+            self.logger.warning(f'repeat check skipped: {e!r}')
+            return 0
         repeat_no = 0
         for item in similatiry:
             if item['similarity'] > 0.9:
@@ -122,7 +130,7 @@ class PanGuTrainingPlugin(WechatyPlugin):
                 return repeat_no
         return repeat_no
 
-    @message_controller.may_disable_message
+    @message_controller.route(priority=10, ignore_self=True, types=[MessageType.MESSAGE_TYPE_TEXT], in_room=False)
     async def on_message(self, msg: Message) -> None:
         if msg.is_self() or msg.talker().contact_id == "weixin":
             return
@@ -136,6 +144,7 @@ class PanGuTrainingPlugin(WechatyPlugin):
             return
 
         text = msg.text()
+        ctx = message_controller.context(msg)
 
         # 3. check if is training
         if talker.contact_id in self.training:
@@ -159,8 +168,9 @@ class PanGuTrainingPlugin(WechatyPlugin):
                 await talker.say('请先选择课程，如需结束或重新开始，请回复：结束训练')
                 return
 
-            if re.match(r"^「.+」\s-+\s.+", text, re.S):
-                text = re.search(r"：.+」", text, re.S).group()[1:-1] + "，" + re.search(r"-\n.+", text, re.S).group()[2:]
+            quoted = await ctx.quote()
+            if quoted:
+                text = quoted[0] + "，" + quoted[1]
 
             text = text.strip().replace('\n', '，')
             self.training[talker.contact_id]['log'].append(f"工作人员说：“{text}”")
@@ -172,7 +182,7 @@ class PanGuTrainingPlugin(WechatyPlugin):
                 await self.stop_train(talker)
                 return
 
-            intent, conf = self.intent.predict(text)
+            intent, conf = await ctx.intent(self.intent, text)
             if intent == "continuetosay":
                 self.logger.info('intent: continuetosay, just pass')
                 return
@@ -192,24 +202,19 @@ class PanGuTrainingPlugin(WechatyPlugin):
 
             prompt = self.courses[self.training[talker.contact_id]['course']]['prompt'] + dialog + "你说：“"
 
-            for i in range(7):
-                reply = Infer.generate("pangu-alpha-13B-md", prompt, self.pangu_key)
-                if not reply or reply == "somethingwentwrongwithyuanservice" or reply == "请求异常，请重试":
-                    self.logger.warning(f'generation failed {str(i + 1)} times.')
-                    self.logger.info(prompt)
-                    continue
-                if len(self.training[talker.contact_id]["log"]) <= 12:
-                    repeat = self.repeat_check([[f"你说：“{reply}”", key] for key in self.training[talker.contact_id]["log"]])
-                else:
-                    repeat = self.repeat_check([[f"你说：“{reply}”", key] for key in self.training[talker.contact_id]["log"][-12:]])
-                if repeat < 2:
-                    break
-                self.logger.warning(f'repeat generation:{reply}')
-                self.logger.info(prompt)
-                prompt = self.courses[self.training[talker.contact_id]['course']]['prompt'] + self.training[talker.contact_id]['log'][-1] + "你说：“"
+            # 同时请求多个候选（一半用较短的提示），逐个校验：可用且不与最近的对话重复，第一个通过的胜出
+            short_prompt = self.courses[self.training[talker.contact_id]['course']]['prompt'] + self.training[talker.contact_id]['log'][-1] + "你说：“"
+            recent = self.training[talker.contact_id]["log"][-12:]
+
+            async def not_repeated(reply: str) -> bool:
+                repeat = await self.repeat_check([[f"你说：“{reply}”", key] for key in recent])
+                if repeat >= 2:
+                    self.logger.warning(f'repeat generation:{reply}')
+                return repeat < 2
 
-            if not reply or reply == "somethingwentwrongwithyuanservice" or reply == "请求异常，请重试":
-                self.logger.warning(f'Yuan may out of service, {reply}')
+            reply = await self.hedger.generate(lambda i: self.gateway.generate(prompt if i % 2 == 0 else short_prompt, "”", providers=['pangu']), not_repeated)
+            if not reply:
+                self.logger.warning('generation may out of service, no usable reply')
                 self.logger.info(prompt)
                 return
 
@@ -217,7 +222,7 @@ class PanGuTrainingPlugin(WechatyPlugin):
             self.training[talker.contact_id]["turn"] += 1
             self.training[talker.contact_id]['log'].append(f"你说：“{reply}”")
 
-            intent, conf = self.intent.predict(reply)
+            intent, conf = await self.intent.predict(reply)
             if intent in ['bye', 'sayno']:
                 await talker.say(f'恭喜您，通过测试，对话轮次：{self.training[talker.contact_id]["turn"]}')
                 self.training[talker.contact_id]['log'].append(f'测试人员：{talker.name} 通过测试，AI角色最终情绪：{intent}')
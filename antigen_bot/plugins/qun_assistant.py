@@ -1,6 +1,6 @@
+import asyncio
 import json
 import os
-import re
 import time
 from typing import Optional, List
 from wechaty import (
@@ -16,11 +16,19 @@ from wechaty import (
 
 from datetime import datetime
 from antigen_bot.message_controller import message_controller
-from utils.DFAFilter import DFAFilter
-from utils.rasaintent import RasaIntent
-from paddlenlp import Taskflow
-from antigen_bot.inspurai import Yuan
-from antigen_bot.docfaq import DocFAQ
+from antigen_bot.answer_cache import AnswerCache, NegativeCache
+from antigen_bot.faq_index import FAQRetriever
+from antigen_bot.media_store import MediaStore
+from antigen_bot.hedging import HedgedGenerator
+from antigen_bot.resilience import resilience
+from antigen_bot.response_cache import ResponseCache
+from antigen_bot.resources import registry
+from antigen_bot.state_store import StateStore
+from antigen_bot.utils import remove_at_info
+from antigen_bot.docfaq import AsyncDocFAQ
+
+# 相似的无答案问题每被问这么多次，再提醒一次群主
+NEGATIVE_NOTIFY_EVERY = 10
 
 
 class QunAssistantPlugin(WechatyPlugin):
@@ -47,54 +55,48 @@ class QunAssistantPlugin(WechatyPlugin):
             self.logger.warning('there must be at least one director, pls retry')
             raise RuntimeError('CA director.json not valid, pls refer to above info and try again')
 
-        if "room_dict.json" in self.config_files:
-            with open(os.path.join(self.config_url, 'room_dict.json'), 'r', encoding='utf-8') as f:
-                self.room_dict = json.load(f)
-        else:
-            self.room_dict = {}
-
-        if "qunzhu.json" in self.config_files:
-            with open(os.path.join(self.config_url, 'qunzhu.json'), 'r', encoding='utf-8') as f:
-                self.qunzhu = json.load(f)
-        else:
-            self.qunzhu = []
+        # 状态保存在 state.db 中，旧版的 json 文件在第一次启动时导入
+        self.state = StateStore.shared(os.path.join(self.config_url, 'state.db'))
+        for ns, depth in [('room_dict', 1), ('qunzhu', 1), ('verify_codes', 1), ('qun_faq', 2), ('qun_media_faq', 2)]:
+            self.state.import_json(ns, os.path.join(self.config_url, f'{ns}.json'), depth)
 
-        if "verify_codes.json" in self.config_files:
-            with open(os.path.join(self.config_url, 'verify_codes.json'), 'r', encoding='utf-8') as f:
-                self.verify_codes = json.load(f)
-        else:
-            self.verify_codes = []
-
-        if "qun_faq.json" in self.config_files:
-            with open(os.path.join(self.config_url, 'qun_faq.json'), 'r', encoding='utf-8') as f:
-                self.qun_faq = json.load(f)
-        else:
-            self.qun_faq = {key: {} for key in self.qunzhu}
+        self.room_dict = self.state.items('room_dict')
+        self.qunzhu = list(self.state.items('qunzhu'))
+        self.verify_codes = list(self.state.items('verify_codes'))
+        self.qun_faq = {key: {} for key in self.qunzhu}
+        self.qun_faq.update(self.state.nested('qun_faq'))
 
+        # 媒体答案以 MediaStore 中的引用保存，重启后依然有效
+        self.media_store = MediaStore(os.path.join(self.config_url, 'media_store'), logger=self.logger)
         self.qun_meida_faq = {key: {} for key in self.qunzhu}
+        self.qun_meida_faq.update(self.state.nested('qun_media_faq'))
+        # 群主FAQ：词法和向量索引召回候选问题，再由相似度模型精排
+        self.sim = registry.get('similarity')
+        self.faq = FAQRetriever(self.sim, candidates=int(os.environ.get('CA_FAQ_CANDIDATES', 20)),
+                                audit=os.environ.get('CA_FAQ_AUDIT') == '1', logger=self.logger)
+        for owner, faq in self.qun_faq.items():
+            self.faq.add(owner, list(faq), 'text')
+        for owner, faq in self.qun_meida_faq.items():
+            self.faq.add(owner, list(faq), 'media')
+        self.answer_cache = AnswerCache()
+        self.negative_cache = NegativeCache()
         self.listen_to = {}
-        self.gfw = DFAFilter()
-        self.gfw.parse()
-        self.sim = Taskflow("text_similarity")
-        self.intent = RasaIntent()
-        self.yuan = Yuan(engine='dialog',
-                         temperature=1,
-                         max_tokens=150,
-                         input_prefix='',
-                         input_suffix='',
-                         output_prefix='',
-                         output_suffix='',
-                         append_output_prefix_to_query=False,
-                         topK=3,
-                         topP=0.9,
-                         frequencyPenalty=1.2, )
+        self.gfw = registry.get('keyword_filter')
+        self.intent = registry.get('intent')
+        self.hedger = HedgedGenerator.from_env(logger=self.logger)
+        # 缓存的争吵按字符召回，再由相似度模型确认是同一类争吵
+        self.response_cache = ResponseCache.from_env(similarity=self.sim)
+        # 生成请求经网关路由到当前最快的可用模型（源、盘古、文心）
+        self.gateway = registry.get('generation')
         self.room_open_seq = {key: {} for key in self.room_dict}
-        self.docfaq = DocFAQ(skill_id='1225240', terminal='awada')
+        self.docfaq = AsyncDocFAQ(skill_id='1225240', terminal='awada')
         self.logger.info(f'UNIT DocFAQ loaded, skill_id: {self.docfaq.skill_id}, terminal: {self.docfaq.terminal}')
         self.logger.info('QunAssistantPlugin init success')
 
     async def init_plugin(self, wechaty: Wechaty) -> None:
         message_controller.init_plugins(wechaty)
+        if not await self.intent.check():
+            self.logger.warning('Rasa server not running, the intents fall back to nlu_fallback until it is up')
         return await super().init_plugin(wechaty)
 
     def _file_check(self) -> bool:
@@ -116,32 +118,65 @@ class QunAssistantPlugin(WechatyPlugin):
             await msg.say("QunAssistantPlugin Director Code: \n"
                           "ding -- check heartbeat \n"
                           "start with ### -- add verify code \n"
-                          "save -- save users status")
+                          "save -- save users status \n"
+                          "stats -- message controller and client status \n"
+                          "faq audit on/off -- report the recall of the FAQ candidates \n"
+                          "reload keywords -- reload the sensitive keyword list \n"
+                          "upstream -- the circuit breakers of the AI services \n"
+                          "upstream reset [name] -- close the circuit breakers by hand")
+            return
+        if msg.text() == 'upstream':
+            await msg.say(resilience.summary() + '\n -- QunAssistant')
+            return
+        if msg.text().startswith('upstream reset'):
+            name = msg.text()[len('upstream reset'):].strip() or None
+            resilience.reset(name)
+            await msg.say(f"{name or 'all'} circuit closed\n{resilience.summary()}\n -- QunAssistant")
+            return
+        if msg.text() == 'reload keywords':
+            # 编译好的自动机整体替换，正在进行的检测不受影响
+            changed = await asyncio.get_event_loop().run_in_executor(None, self.gfw.reload)
+            await msg.say(f"keywords {'reloaded' if changed else 'unchanged'}: {json.dumps(self.gfw.stats())} -- QunAssistant")
+            return
+        if msg.text() in ('faq audit on', 'faq audit off'):
+            self.faq.audit = msg.text().endswith('on')
+            await msg.say(f"FAQ recall audit {'enabled' if self.faq.audit else 'disabled'}, candidates: {self.faq.candidates} -- QunAssistant")
+            return
+        if msg.text() == 'stats':
+            stats = {'controller': message_controller.stats(), 'intent': self.intent.stats(), 'docfaq': self.docfaq.stats(), 'similarity': self.sim.stats(), 'faq': self.faq.stats(), 'answer_cache': self.answer_cache.stats(), 'negative_cache': self.negative_cache.stats(), 'media_store': self.media_store.stats(), 'state': self.state.stats(), 'resources': registry.stats(), 'upstream': resilience.stats(), 'hedging': self.hedger.stats(), 'response_cache': self.response_cache.stats(), 'generation': self.gateway.stats()}
+            await msg.say(json.dumps(stats, indent=2) + '\n -- QunAssistant')
             return
         # 3.functions
         if msg.text().startswith("###"):
             self.verify_codes.append(msg.text()[3:])
-            with open(os.path.join(self.config_url, 'verify_codes.json'), 'w', encoding='utf-8') as f:
-                json.dump(self.verify_codes, f)
+            self.state.set('verify_codes', msg.text()[3:], True)
             await msg.say(f"new verify code: {msg.text()[3:]} added -- QunAssistant")
             return
 
         if msg.text() == 'save':
-            with open(os.path.join(self.config_url, 'room_dict.json'), 'w', encoding='utf-8') as f:
-                json.dump(self.room_dict, f, ensure_ascii=False)
-            with open(os.path.join(self.config_url, 'qunzhu.json'), 'w', encoding='utf-8') as f:
-                json.dump(self.qunzhu, f, ensure_ascii=False)
-            with open(os.path.join(self.config_url, 'qun_faq.json'), 'w', encoding='utf-8') as f:
-                json.dump(self.qun_faq, f, ensure_ascii=False)
-            await msg.say('save success -- QunAssistant')
-
-    @message_controller.may_disable_message
+            # every change is already queued into the state store, just wait for the commit
+            if await self.state.flush(timeout=10):
+                await msg.say('save success -- QunAssistant')
+            else:
+                await msg.say('save timeout, the state store is still writing -- QunAssistant')
+
+    def _accept(self, msg: Message) -> bool:
+        """cheap claim predicate: directors, qunzhu in recording or active rooms"""
+        talker_id = msg.talker().contact_id
+        if talker_id in self.directors or talker_id in self.qunzhu or talker_id in self.listen_to:
+            return True
+        if msg.room():
+            return msg.room().room_id in self.room_dict
+        return msg.text() in self.verify_codes or msg.type() == MessageType.MESSAGE_TYPE_CONTACT
+
+    @message_controller.route(priority=20, ignore_self=True, accept=_accept)
     async def on_message(self, msg: Message) -> None:
         if msg.is_self() or msg.talker().contact_id == "weixin":
             return
 
         talker = msg.talker()
         text = msg.text()
+        ctx = message_controller.context(msg)
 
         # 2. check if is director
         if talker.contact_id in self.directors:
@@ -153,10 +188,8 @@ class QunAssistantPlugin(WechatyPlugin):
             message_controller.disable_all_plugins(msg)
             self.verify_codes.remove(text)
             self.qunzhu.append(talker.contact_id)
-            with open(os.path.join(self.config_url, 'qunzhu.json'), 'w', encoding='utf-8') as f:
-                json.dump(self.qunzhu, f, ensure_ascii=False)
-            with open(os.path.join(self.config_url, 'verify_codes.json'), 'w', encoding='utf-8') as f:
-                json.dump(self.verify_codes, f, ensure_ascii=False)
+            self.state.delete('verify_codes', text)
+            self.state.set('qunzhu', talker.contact_id, True)
             await msg.say("hi，很高兴为您服务，请拉我到需要我协助管理的群内，并@我说：小助理 -- QunAssistant")
             return
 
@@ -168,8 +201,8 @@ class QunAssistantPlugin(WechatyPlugin):
         if msg.room():
             if '@所有人' in msg.text():
                 return
-            text = await msg.mention_text()
-            attention = True if await msg.mention_self() else False
+            text = await ctx.mention_text()
+            attention = await ctx.mention_self()
 
         # 4. handle the pre-record meida faq
         if talker.contact_id in self.listen_to:
@@ -191,13 +224,27 @@ class QunAssistantPlugin(WechatyPlugin):
                     await msg.say("问题已存在，如果更新答案请直接发送媒体文件，否则请发送：结束 -- QunAssistant")
                 else:
                     self.qun_meida_faq[talker.contact_id][text] = []
+                    self.faq.add(talker.contact_id, [text], 'media')
+                    self.faq_changed(talker.contact_id)
                     await msg.say("问题已记录，请继续发送媒体文件（支持视频、图片、文字、公众号文章、小程序、语音等）\n"
                                   "依次一条，依次发送到这里，我会逐一记录 \n"
                                   "最后请发送 结束 -- QunAssistant")
                 return
 
             if self.listen_to[talker.contact_id]:
-                self.qun_meida_faq[talker.contact_id][self.listen_to[talker.contact_id]].append(msg)
+                try:
+                    ref = await self.media_store.to_ref(msg)
+                except Exception as e:
+                    self.logger.error(f'failed to store the media answer: {e}')
+                    await msg.say("这条答案保存失败，请重新发送 -- QunAssistant")
+                    return
+                if ref is None:
+                    await msg.say("暂不支持这种类型的答案，请换一种形式发送 -- QunAssistant")
+                    return
+                question = self.listen_to[talker.contact_id]
+                self.qun_meida_faq[talker.contact_id][question].append(ref)
+                self.state.set('qun_media_faq', (talker.contact_id, question), self.qun_meida_faq[talker.contact_id][question])
+                self.faq_changed(talker.contact_id)
                 await msg.say("已记录，如果还有答案，请继续转发。录入结束请发送：结束 -- QunAssistant")
             else:
                 await msg.say("请先发送问题文本，再录入答案 -- QunAssistant")
@@ -216,9 +263,8 @@ class QunAssistantPlugin(WechatyPlugin):
             return
 
         room = msg.room()
-        await room.ready()
-        topic = await room.topic()
-        owner = await room.owner()
+        topic = await ctx.topic()
+        owner = await ctx.owner()
 
         if talker.contact_id in self.qunzhu:
             if attention is True:
@@ -230,8 +276,7 @@ class QunAssistantPlugin(WechatyPlugin):
                     message_controller.disable_all_plugins(msg)
                     self.room_dict[room.room_id] = talker.contact_id
                     self.room_open_seq[room.room_id] = {}
-                    with open(os.path.join(self.config_url, 'room_dict.json'), 'w', encoding='utf-8') as f:
-                        json.dump(self.room_dict, f, ensure_ascii=False)
+                    self.state.set('room_dict', room.room_id, talker.contact_id)
                     await room.say('大家好，我是AI群助理，我可以帮助群主回复大家的问题，请@我提问，如果遇到我不知道的问题，我会第一时间通知群主~')
                     await talker.say(f'您已在{topic}群中激活了AI助理，如需关闭，请在群中@我说：退下')
 
@@ -239,19 +284,21 @@ class QunAssistantPlugin(WechatyPlugin):
                     message_controller.disable_all_plugins(msg)
                     if room.room_id in self.room_dict:
                         del self.room_dict[room.room_id]
-                        with open(os.path.join(self.config_url, 'room_dict.json'), 'w', encoding='utf-8') as f:
-                            json.dump(self.room_dict, f, ensure_ascii=False)
+                        self.state.delete('room_dict', room.room_id)
                     await talker.say(f'您已在{topic}群中取消了AI助理，如需再次启用，请在群中@我说：小助理')
 
-            if re.match(r"^「.+」\s-+\s.+", text, re.S):  # 判断是否为引用消息
+            quoted = await ctx.quote()
+            if quoted:  # 判断是否为引用消息
                 message_controller.disable_all_plugins(msg)
-                quote = re.search(r"：.+」", text, re.S).group()[1:-1]  # 引用内容
-                reply = re.search(r"-\n.+", text, re.S).group()[2:]  # 回复内容
-                quote = re.sub(r'@.+?\s', "", quote).strip()
-                reply = re.sub(r'@.+?\s', "", reply).strip()
+                quote, reply = quoted  # 引用内容, 回复内容
+                quote = remove_at_info(quote).strip()
+                reply = remove_at_info(reply).strip()
                 if talker.contact_id not in self.qun_faq:
                     self.qun_faq[talker.contact_id] = {}
                 self.qun_faq[talker.contact_id][quote] = reply
+                self.state.set('qun_faq', (talker.contact_id, quote), reply)
+                self.faq.add(talker.contact_id, [quote], 'text')
+                self.faq_changed(talker.contact_id)
             return
 
        # 6. 处理群成员信息，目前支持劝架和智能FAQ，
@@ -260,8 +307,9 @@ class QunAssistantPlugin(WechatyPlugin):
 
         message_controller.disable_all_plugins(msg)
 
-        if re.match(r"^「.+」\s-+\s.+", text, re.S):
-            text = re.search(r"：.+」", text, re.S).group()[1:-1] + "，" + re.search(r"-\n.+", text, re.S).group()[2:]
+        quoted = await ctx.quote()
+        if quoted:
+            text = quoted[0] + "，" + quoted[1]
 
         text = text.strip().replace('\n', '，')
 
@@ -281,12 +329,27 @@ class QunAssistantPlugin(WechatyPlugin):
                 attention = True
             del self.room_open_seq[room.room_id][talker.contact_id]
 
-        intent, conf = self.intent.predict(text)
+        # 相同的问题（归一化后）直接用解析过的答案作答，跳过意图识别和检索，敏感词过滤仍然在前面执行
+        if attention is True:
+            cached = self.answer_cache.get(self.room_dict[room.room_id], text)
+            if cached and await self.reply_answer(room, talker, text, cached):
+                self.logger.info(f'{talker.name} in {topic} asked: {text}, answered from cache')
+                await self.check_alias(room, talker)
+                return
+
+        # 高负载时，未@的消息不再做意图识别
+        if attention is False and not message_controller.admit('intent'):
+            return
+
+        intent, conf = await ctx.intent(self.intent, text)
 
         if intent == 'quarrel':
             self.logger.info(f'{talker.name} in {topic} 争吵: {text}')
             self.logger.info(f'intent: {intent}, conf: {conf}')
-            reply = self.quanjia(text)
+            if not message_controller.admit('quanjia'):
+                self.logger.warning('bot under high load, skip quanjia')
+                return
+            reply = await self.quanjia(text)
             if reply:
                 await room.say(reply, [talker.contact_id])
             return
@@ -347,38 +410,57 @@ class QunAssistantPlugin(WechatyPlugin):
             return
 
         # 7. smart FAQ
-        answered = False
-        if self.qun_faq[self.room_dict[room.room_id]]:
-            similatiry_list = [[text, key] for key in list(self.qun_faq[self.room_dict[room.room_id]].keys())]
-            similatiry = self.sim(similatiry_list)
-            for i in range(len(similatiry)-1, -1, -1):
-                if similatiry[i]['similarity'] > 0.88:
-                    self.logger.info(f"found matched text: {similatiry[i]['text2']}, answered:{self.qun_faq[self.room_dict[room.room_id]][similatiry[i]['text2']]}")
-                    await room.say(self.qun_faq[self.room_dict[room.room_id]][similatiry[i]['text2']], [talker.contact_id])
-                    await room.say("以上答案来自群主历史回复，仅供参考哦~", [talker.contact_id])
-                    answered = True
-                    break
-
-        answer = []
-        if self.qun_meida_faq[self.room_dict[room.room_id]]:
-            similatiry_list = [[text, key] for key in list(self.qun_meida_faq[self.room_dict[room.room_id]].keys())]
-            similatiry = self.sim(similatiry_list)
-            for i in range(len(similatiry)-1, -1, -1):
-                if similatiry[i]['similarity'] > 0.88:
-                    self.logger.info(f"found matched text: {similatiry[i]['text2']}")
-                    answer = self.qun_meida_faq[self.room_dict[room.room_id]][similatiry[i]['text2']]
-                    break
-
-        if answer:
+        faq_owner = self.room_dict[room.room_id]
+        matched = await self.faq.match(faq_owner, text)
+        for kind, (question, score) in matched.items():
+            self.logger.info(f"found matched {kind}: {question}({score:.3f})")
+
+        answer = {kind: question for kind, (question, _) in matched.items()}
+        if await self.reply_answer(room, talker, text, answer):
+            self.answer_cache.set(faq_owner, text, answer)
+        else:
+            say = await self.further_search(room=room, talker=talker, owner=owner, topic=topic, text=text)
+            if say:
+                self.answer_cache.set(faq_owner, text, {'docfaq': say})
+
+        await self.check_alias(room, talker)
+
+    def faq_changed(self, owner: str) -> None:
+        """the owner recorded or changed a Q/A, drop the cached answers and misses"""
+        self.answer_cache.invalidate(owner)
+        self.negative_cache.invalidate(owner)
+
+    async def reply_answer(self, room: Room, talker: Contact, text: str, answer: dict) -> bool:
+        """reply the resolved FAQ answer: {'text': question, 'media': question, 'docfaq': reply}
+
+        Returns:
+            bool: False if there is nothing to reply
+        """
+        faq_owner = self.room_dict[room.room_id]
+        replied = False
+
+        question = answer.get('text')
+        if question in self.qun_faq.get(faq_owner, {}):
+            self.logger.info(f"answered:{self.qun_faq[faq_owner][question]}")
+            await room.say(self.qun_faq[faq_owner][question], [talker.contact_id])
+            await room.say("以上答案来自群主历史回复，仅供参考哦~", [talker.contact_id])
+            replied = True
+
+        media = self.qun_meida_faq.get(faq_owner, {}).get(answer.get('media'), [])
+        if media:
             await room.say(f'对于您说的“{text}”，群主之前有回答，请参考如下', [talker.contact_id])
-            for _answer in answer:
+            for _answer in media:
                 await self.forward_message(_answer, room)
             self.logger.info('Media Answered')
+            replied = True
 
-        if not answer and answered is False:
-            await self.further_search(room=room, talker=talker, owner=owner, topic=topic, text=text)
+        if answer.get('docfaq'):
+            await room.say(answer['docfaq'], [talker.contact_id])
+            replied = True
+        return replied
 
-        # 最后检查下talker的群昵称状态，并更新下talker在bot的备注
+    async def check_alias(self, room: Room, talker: Contact) -> None:
+        """最后检查下talker的群昵称状态，并更新下talker在bot的备注"""
         alias = await room.alias(talker)
         if alias:
             if alias != await talker.alias():
@@ -390,27 +472,56 @@ class QunAssistantPlugin(WechatyPlugin):
         else:
             await room.say('另外提醒您及时按群主要求更改群昵称哦', [talker.contact_id])
 
-    async def further_search(self, room: Room, talker: Contact, owner: Contact, topic: str, text: str) -> None:
+    async def further_search(self, room: Room, talker: Contact, owner: Contact, topic: str, text: str) -> Optional[str]:
+        """search the DocFAQ, return the answer if it is final and may be cached"""
         session_id = ''
         if talker.contact_id in self.room_open_seq[room.room_id]:
             session_id = self.room_open_seq[room.room_id][talker.contact_id].get('session_id', '')
 
-        result = self.docfaq.predict(text, session_id)
-        if result and result['error_code'] == 0 and result['result']['responses'][0]['actions'][0]['action_id'] != 'Innovation_Bot_failure':
-            await room.say(result['result']['responses'][0]['actions'][0]['say'], [talker.contact_id])
-            self.logger.info(f"docFAQ--{result['result']['responses'][0]['actions'][0]['say']}\n")
-            if result['result']['responses'][0]['actions'][0]['action_id'] == 'Innovation_Bot_guide':
-                self.room_open_seq[room.room_id][talker.contact_id] = {'text': text, 'time': time.time, 'session_id': result['result']['session_id']}
-                for option in result['result']['responses'][0]['actions'][0]['options']:
+        # 近期已确认没有答案的相似问题，不再请求 UNIT，也不再重复私信群主，只累计次数
+        missed = None if session_id else self.negative_cache.fold(room.room_id, text)
+        if missed:
+            self.logger.info(f"no answer for {text}, folded into: {missed['text']}({missed['count']})")
+            await room.say("这个问题我暂时还没有答案，已经通知群主了，请稍后再问我哦~", [talker.contact_id])
+            if missed['count'] % NEGATIVE_NOTIFY_EVERY == 0:
+                try:
+                    await owner.say(f"{topic}群中类似“{missed['text']}”的问题已被问了{missed['count']}次，请您及时群内引用回复，或者录入媒体答案 --QunAssistant")
+                except Exception as e:
+                    self.logger.error(e)
+            return None
+
+        if not message_controller.admit('docfaq'):
+            self.logger.warning(f'bot under high load, skip DocFAQ for: {text}')
+            await room.say('当前咨询的人比较多，请稍后再@我提问哦~', [talker.contact_id])
+            return
+
+        try:
+            result = await self.docfaq.predict(text, session_id)
+        except Exception as e:
+            self.logger.error(f'UNIT DocFAQ request failed: {e}')
+            result = {}
+
+        action = result['result']['responses'][0]['actions'][0] if result.get('error_code') == 0 else {}
+        if action and action['action_id'] != 'Innovation_Bot_failure':
+            await room.say(action['say'], [talker.contact_id])
+            self.logger.info(f"docFAQ--{action['say']}\n")
+            if action['action_id'] == 'Innovation_Bot_guide':
+                self.room_open_seq[room.room_id][talker.contact_id] = {'text': text, 'time': time.time(), 'session_id': result['result']['session_id']}
+                for option in action['options']:
                     await room.say(option['option'])
                 await room.say('如果引导项中没有您想要的，您也可以进一步补充关键信息，帮助我们为您找到更合适的答案。')
+            elif not session_id:
+                return action['say']
         else:
+            if action and not session_id:
+                # UNIT 的请求失败不算作没有答案
+                self.negative_cache.add(room.room_id, text, self.room_dict[room.room_id])
             await room.say("抱歉这个问题我没找到答案，已私信通知群主", [talker.contact_id, self.room_dict[room.room_id]])
             try:
                 await owner.say(f'{talker.name}在{topic}群中提问了：{text}，我的记忆中以及文档库中均没有这个答案，请您及时群内引用回复，或者录入媒体答案 --QunAssistant')
             except Exception as e:
                 self.logger.error(e)
-            if result['result']['responses'][0]['actions'][0]['action_id'] != 'Innovation_Bot_failure':
+            if not action:
                 self.logger.error(f'UNIT FAQ failed \n {result}\n')
             else:
                 self.logger.warning('no answer found\n')
@@ -432,20 +543,24 @@ class QunAssistantPlugin(WechatyPlugin):
                     print(receive_id + " have rejected" + amount + " from " + from_id + " .transaction abort.")
         return
     """
-    def quanjia(self, text: str) -> str:
+    async def quanjia(self, text: str) -> str:
+        # 群里的争吵大同小异，相似的争吵直接用缓存的劝架回复，多个回复轮流使用
+        cached = await self.response_cache.get('quanjia', text)
+        if cached:
+            self.logger.info(f'quanjia reply from cache: {cached}')
+            return cached
+
         prompt = f"你所在的群是小区住户聊天群，群成员都是同住一个小区的邻居，平时大家都很和睦。今天你突然看到有人在群里争吵说：“{text}” ，你赶忙劝对方说：“"
         self.logger.info(prompt)
-        for i in range(7):
-            reply = self.yuan.submit_API(prompt, trun="”")
-            #reply = self.zeus.get_response(prompt)
-            if not reply or reply == "somethingwentwrongwithyuanservice" or reply == "请求异常，请重试":
-                self.logger.warning(f'generation failed {str(i + 1)} times.')
-                continue
-
-        if not reply or reply == "somethingwentwrongwithyuanservice" or reply == "请求异常，请重试":
-            self.logger.warning(f'Yuan may out of service, {reply}')
-            return ''
-
+        # 同时请求多个候选，第一个可用且不含敏感词的回复胜出，其余的回复陆续存入缓存
+        start = time.perf_counter()
+        reply = await self.hedger.generate(lambda i: self.gateway.generate(prompt, "”", topK=3),
+                                           lambda reply: not self.gfw.filter(reply),
+                                           collect=lambda extra: self.response_cache.add('quanjia', text, extra))
+        if not reply:
+            self.logger.warning('generation may out of service, no usable quanjia reply')
+            return reply
+        self.response_cache.add('quanjia', text, reply, time.perf_counter() - start)
         return reply
 
     async def on_room_join(self, room: Room, invitees: List[Contact], inviter: Contact, date: datetime) -> None:
@@ -508,29 +623,13 @@ class QunAssistantPlugin(WechatyPlugin):
             await changer.say('非群主不能更改群名称，请勿捣乱，要不咱俩杠到底')
             await room.topic(old_topic)
 
-    async def forward_message(self, msg: Message, room: Room) -> None:
-        """forward the message to the target conversations
+    async def forward_message(self, ref: dict, room: Room) -> None:
+        """send the stored media answer to the room
         Args:
-            msg (Message): the message to forward
+            ref (dict): the media store ref of the answer
         """
-        if msg.type() in [MessageType.MESSAGE_TYPE_IMAGE, MessageType.MESSAGE_TYPE_VIDEO, MessageType.MESSAGE_TYPE_EMOTICON]:
-            file_box = await msg.to_file_box()
-            saved_file = os.path.join(f'.wechaty/{self.name}/file', file_box.name)
-            await file_box.to_file(saved_file, overwrite=True)
-            file_box = FileBox.from_file(saved_file)
-            await room.say(file_box)
-
-        if msg.type() in [MessageType.MESSAGE_TYPE_TEXT, MessageType.MESSAGE_TYPE_URL, MessageType.MESSAGE_TYPE_MINI_PROGRAM]:
-            await msg.forward(room)
-
-        if msg.type() == MessageType.MESSAGE_TYPE_AUDIO:
-            file_box = await msg.to_file_box()
-            saved_file = os.path.join(f'.wechaty/{self.name}/file', file_box.name)
-            await file_box.to_file(saved_file, overwrite=True)
-            new_audio_file = FileBox.from_file(saved_file)
-            new_audio_file.metadata = {
-                "voiceLength": 2000
-            }
-            await room.say(new_audio_file)
+        content = self.media_store.load(ref)
+        if content is not None:
+            await room.say(content)
 
         self.logger.info('Qun_Assistant_Message_Forward_Finish\n')
@@ -9,7 +9,6 @@ from wechaty.plugin import WechatyPlugin
 from wechaty_puppet import get_logger
 
 from antigen_bot.message_controller import message_controller
-from antigen_bot.utils import remove_at_info
 
 
 
@@ -22,7 +21,7 @@ class RepeaterPlugin(WechatyPlugin):
 
         self.room_ids = room_ids
 
-    @message_controller.may_disable_message
+    @message_controller.route(types=[MessageType.MESSAGE_TYPE_TEXT], in_room=True, rooms=lambda plugin: plugin.room_ids)
     async def on_message(self, msg: Message) -> None:
         """listen message event"""
         
@@ -30,11 +29,12 @@ class RepeaterPlugin(WechatyPlugin):
         if not room or room.room_id not in self.room_ids:
             return
         
-        if not await msg.mention_self() or msg.type() != MessageType.MESSAGE_TYPE_TEXT:
+        ctx = message_controller.context(msg)
+        if not await ctx.mention_self() or msg.type() != MessageType.MESSAGE_TYPE_TEXT:
             return
         
-        text = remove_at_info(msg.text())
+        text = ctx.clean_text
 
         talker = msg.talker()
         await room.say(text, mention_ids=[talker.contact_id])
-        message_controller.disable_all_plugins()
\ No newline at end of file
+        message_controller.disable_all_plugins(msg)
\ No newline at end of file
@@ -1,5 +1,4 @@
 import os
-import re
 from typing import Optional
 from wechaty import (
     Wechaty,
@@ -11,15 +10,12 @@ from wechaty import (
     Friendship,
     WechatyPluginOptions
 )
-from paddlenlp import Taskflow
 from antigen_bot.message_controller import message_controller
-from utils.simpleFilter import SimpleFilter
-from utils.rasaintent import RasaIntent
-from antigen_bot.inspurai import Yuan
+from antigen_bot.hedging import HedgedGenerator
+from antigen_bot.resources import registry
 import json
 import xlrd
 from datetime import datetime
-#from antigen_bot.Ernie.Zeus import Zeus
 
 
 class TrainingPlugin(WechatyPlugin):
@@ -58,29 +54,20 @@ class TrainingPlugin(WechatyPlugin):
         else:
             self.record = {}
 
-        self.gfw = SimpleFilter()
-        self.intent = RasaIntent()
-        self.sim = Taskflow("text_similarity")
-        self.yuan = Yuan(engine='dialog',
-                         temperature=1,
-                         max_tokens=150,
-                         input_prefix='',
-                         input_suffix='',
-                         output_prefix='',
-                         output_suffix='',
-                         append_output_prefix_to_query=False,
-                         topK=5,
-                         topP=0.9,
-                         frequencyPenalty=1.2, )
-        #self.zeus = Zeus()
+        self.gfw = registry.get('keyword_filter')
+        self.intent = registry.get('intent')
+        self.sim = registry.get('similarity')
+        self.hedger = HedgedGenerator.from_env(logger=self.logger)
+        # 生成请求经网关路由到当前最快的可用模型（源、盘古、文心）
+        self.gateway = registry.get('generation')
         self.training = {}
         self.logger.info(f'Training plugin init success.')
-        engine_name = self.yuan.get_engine()
-        self.logger.info(
-            f'with yuan engine:{engine_name},with temperature=1, max_tokens=150, topK=5, topP=0.9, frequencyPenalty=1.2')
+        self.logger.info(f"with generation providers: {', '.join(self.gateway.routes)}")
 
     async def init_plugin(self, wechaty: Wechaty) -> None:
         message_controller.init_plugins(wechaty)
+        if not await self.intent.check():
+            self.logger.warning('Rasa server not running, the intents fall back to nlu_fallback until it is up')
         return await super().init_plugin(wechaty)
 
     def _file_check(self) -> bool:
@@ -145,11 +132,15 @@ class TrainingPlugin(WechatyPlugin):
                                               'opening': table.cell_value(i, 3)}
         return courses
 
-    def repeat_check(self, list) -> int:
+    async def repeat_check(self, list) -> int:
         """
         check the repeat message
         """
-        similatiry = self.sim(list)
+        try:
+            similatiry = await self.sim.similarity(list)
+        except Exception as e:
+            self.logger.warning(f'repeat check skipped: {e!r}')
+            return 0
         repeat_no = 0
         for item in similatiry:
             if item['similarity'] > 0.9:
@@ -158,7 +149,15 @@ class TrainingPlugin(WechatyPlugin):
                 return repeat_no
         return repeat_no
 
-    @message_controller.may_disable_message
+    def _accept(self, msg: Message) -> bool:
+        """cheap claim predicate: room messages only matter for directors and training rooms"""
+        room = msg.room()
+        if not room or msg.talker().contact_id in self.directors:
+            return True
+        # the topic is unknown before the room is ready, let the handler decide
+        return not room.payload or room.payload.topic in self.train_room
+
+    @message_controller.route(priority=10, ignore_self=True, types=[MessageType.MESSAGE_TYPE_TEXT], accept=_accept)
     async def on_message(self, msg: Message) -> None:
         if msg.is_self() or msg.talker().contact_id == "weixin":
             return
@@ -172,27 +171,28 @@ class TrainingPlugin(WechatyPlugin):
         if msg.room() and '@所有人' in msg.text():
             return
 
-        text = await msg.mention_text() if room else msg.text()
+        ctx = message_controller.context(msg)
+        text = await ctx.mention_text()
 
         # 2. check if is director
         if talker.contact_id in self.directors:
             if text == '觉醒':
                 message_controller.disable_all_plugins(msg)
                 await room.ready(force_sync=True)
-                self.train_room[await room.topic()] = [contact.contact_id for contact in await room.member_list()]
+                self.train_room[await ctx.topic()] = [contact.contact_id for contact in await room.member_list()]
                 await room.say('大家好，我是数字社工助理，我可以通过扮演各种居民角色，以情景对话模拟的方式帮助大家提升工作技能。\n'
                                '欢迎大家微信加我开始体验。')
                 return
 
             if text == '结束服务':
                 message_controller.disable_all_plugins(msg)
-                del self.train_room[await room.topic()]
+                del self.train_room[await ctx.topic()]
                 return
 
             await self.director_message(msg)
             return
 
-        if self.bot.user_self() in await msg.mention_list() and await room.topic() in self.train_room:
+        if room and await ctx.mention_self() and await ctx.topic() in self.train_room:
             message_controller.disable_all_plugins(msg)
             await room.say('您好，我是数字社工助理，我可以通过扮演各种居民角色，以情景对话模拟的方式帮助大家提升工作技能。\n'
                            '欢迎微信加我开始体验。')
@@ -224,8 +224,9 @@ class TrainingPlugin(WechatyPlugin):
                 await talker.say('请先选择课程，如需结束或重新开始，请回复：结束训练')
                 return
 
-            if re.match(r"^「.+」\s-+\s.+", text, re.S):
-                text = re.search(r"：.+」", text, re.S).group()[1:-1] + "，" + re.search(r"-\n.+", text, re.S).group()[2:]
+            quoted = await ctx.quote()
+            if quoted:
+                text = quoted[0] + "，" + quoted[1]
 
             text = text.strip().replace('\n', '，')
             self.training[talker.contact_id]['log'].append(f"工作人员说：“{text}”")
@@ -237,7 +238,7 @@ class TrainingPlugin(WechatyPlugin):
                 await self.stop_train(talker)
                 return
 
-            intent, conf = self.intent.predict(text)
+            intent, conf = await ctx.intent(self.intent, text)
             if intent in ['impatient', 'aichallenge', 'badreply', 'angry', 'provocate', 'complain', 'quarrel', 'sayno']:
                 await talker.say(f"侦测到您未合理控制谈话情绪，本次挑战失败，对话轮次：{self.training[talker.contact_id]['turn']}")
                 self.training[talker.contact_id]['log'].append(f'测试人员：{talker.name} 因未合理控制情绪挑战失败，情绪侦测：{intent}')
@@ -253,25 +254,19 @@ class TrainingPlugin(WechatyPlugin):
 
             prompt = self.courses[self.training[talker.contact_id]['course']]['prompt'] + dialog + "你说：“"
 
-            for i in range(7):
-                reply = self.yuan.submit_API(prompt, trun="”")
-                #reply = self.zeus.get_response(prompt)
-                if not reply or reply == "somethingwentwrongwithyuanservice" or reply == "请求异常，请重试":
-                    self.logger.warning(f'generation failed {str(i + 1)} times.')
-                    self.logger.info(prompt)
-                    continue
-                if len(self.training[talker.contact_id]["log"]) <= 12:
-                    repeat = self.repeat_check([[f"你说：“{reply}”", key] for key in self.training[talker.contact_id]["log"]])
-                else:
-                    repeat = self.repeat_check([[f"你说：“{reply}”", key] for key in self.training[talker.contact_id]["log"][-12:]])
-                if repeat < 2:
-                    break
-                self.logger.warning(f'repeat generation:{reply}')
-                self.logger.info(prompt)
-                prompt = self.courses[self.training[talker.contact_id]['course']]['prompt'] + self.training[talker.contact_id]['log'][-1] + "你说：“"
+            # 同时请求多个候选（一半用较短的提示），逐个校验：可用且不与最近的对话重复，第一个通过的胜出
+            short_prompt = self.courses[self.training[talker.contact_id]['course']]['prompt'] + self.training[talker.contact_id]['log'][-1] + "你说：“"
+            recent = self.training[talker.contact_id]["log"][-12:]
+
+            async def not_repeated(reply: str) -> bool:
+                repeat = await self.repeat_check([[f"你说：“{reply}”", key] for key in recent])
+                if repeat >= 2:
+                    self.logger.warning(f'repeat generation:{reply}')
+                return repeat < 2
 
-            if not reply or reply == "somethingwentwrongwithyuanservice" or reply == "请求异常，请重试":
-                self.logger.warning(f'Yuan may out of service, {reply}')
+            reply = await self.hedger.generate(lambda i: self.gateway.generate(prompt if i % 2 == 0 else short_prompt, "”", topK=5), not_repeated)
+            if not reply:
+                self.logger.warning('generation may out of service, no usable reply')
                 self.logger.info(prompt)
                 return
 
@@ -279,7 +274,7 @@ class TrainingPlugin(WechatyPlugin):
             self.training[talker.contact_id]["turn"] += 1
             self.training[talker.contact_id]['log'].append(f"你说：“{reply}”")
 
-            intent, conf = self.intent.predict(reply)
+            intent, conf = await self.intent.predict(reply)
             if intent in ['bye', 'greeting']:
                 await talker.say(f'恭喜您，通过测试，对话轮次：{self.training[talker.contact_id]["turn"]}')
                 self.training[talker.contact_id]['log'].append(f'测试人员：{talker.name} 通过测试，AI角色最终情绪：{intent}')
@@ -0,0 +1,294 @@
+"""deadlines, circuit breakers, bulkheads and fallbacks for the upstream AI services"""
+from __future__ import annotations
+import asyncio
+import functools
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass, replace
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_RAISE = object()
+
+
+class ServiceUnavailable(RuntimeError):
+    """the call is rejected without reaching the service"""
+
+
+class CircuitOpen(ServiceUnavailable):
+    """the circuit breaker of the service is open"""
+
+
+class BulkheadFull(ServiceUnavailable):
+    """too many calls of the service are running or waiting"""
+
+
+@dataclass
+class Policy:
+    """the limits of one upstream service
+
+    timeout: the deadline of one call in seconds
+    failures: consecutive failures which open the circuit
+    reset_timeout: seconds the circuit stays open before a half-open probe
+    half_open_calls: probes allowed at the same time in half-open state
+    max_concurrency: calls running at the same time
+    max_waiting: calls waiting for a slot, more are rejected at once
+    """
+    timeout: float = 10
+    failures: int = 5
+    reset_timeout: float = 30
+    half_open_calls: int = 1
+    max_concurrency: int = 4
+    max_waiting: int = 16
+
+
+DEFAULT_POLICIES: Dict[str, Policy] = {
+    'rasa': Policy(timeout=5, failures=5, reset_timeout=15, max_concurrency=16, max_waiting=256),
+    'docfaq': Policy(timeout=8, failures=5, reset_timeout=60, max_concurrency=8, max_waiting=32),
+    'yuan': Policy(timeout=40, failures=3, reset_timeout=120, max_concurrency=4, max_waiting=8),
+    'pangu': Policy(timeout=30, failures=3, reset_timeout=120, max_concurrency=4, max_waiting=8),
+    'zeus': Policy(timeout=60, failures=3, reset_timeout=120, max_concurrency=2, max_waiting=4),
+    'vilg': Policy(timeout=120, failures=3, reset_timeout=300, max_concurrency=2, max_waiting=4),
+    'antigen_image': Policy(timeout=30, failures=3, reset_timeout=60, max_concurrency=2, max_waiting=8),
+}
+
+
+def policy_from_env(name: str, policy: Policy) -> Policy:
+    """override the policy by CA_RESILIENCE_<NAME>, e.g. `timeout=20,failures=3`"""
+    value = os.environ.get(f'CA_RESILIENCE_{name.upper()}')
+    if not value:
+        return policy
+    changes = {}
+    for item in value.split(','):
+        key, number = item.split('=')
+        changes[key.strip()] = type(getattr(policy, key.strip()))(number)
+    return replace(policy, **changes)
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` consecutive failures -> half-open after `reset_timeout`
+
+    a half-open breaker lets `half_open_calls` probes through, a successful
+    probe closes it and a failed one opens it again.
+    """
+    def __init__(self, failures: int = 5, reset_timeout: float = 30, half_open_calls: int = 1,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self._clock = clock
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.opened = 0
+
+    def allow(self) -> bool:
+        """check if a call may go through now, a half-open probe is counted"""
+        if self.state == OPEN and self._clock() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self.probes = 0
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and self.probes < self.half_open_calls:
+            self.probes += 1
+            return True
+        return False
+
+    def success(self) -> None:
+        self.state = CLOSED
+        self.consecutive_failures = 0
+
+    def failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failures:
+            if self.state != OPEN:
+                self.opened += 1
+            self.state = OPEN
+            self.opened_at = self._clock()
+
+    def retry_after(self) -> float:
+        if self.state != OPEN:
+            return 0.0
+        return max(self.reset_timeout - (self._clock() - self.opened_at), 0.0)
+
+
+class ServiceGuard:
+    """every call of one upstream service goes through its guard
+
+    the call is rejected at once when the circuit is open or the bulkhead is
+    full, otherwise it waits for a slot and runs under the deadline. A
+    rejected or failed call raises, or returns the fallback when there is one
+    (a value, or a callable taking the exception).
+    """
+    def __init__(self, name: str, policy: Optional[Policy] = None, fallback: Any = _RAISE,
+                 clock: Callable[[], float] = time.monotonic, logger: Optional[logging.Logger] = None) -> None:
+        self.name = name
+        self.policy = policy or Policy()
+        self.fallback = fallback
+        self.logger = logger or logging.getLogger('Resilience')
+        self.breaker = CircuitBreaker(self.policy.failures, self.policy.reset_timeout, self.policy.half_open_calls, clock)
+
+        self.running = 0
+        self.waiting = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected_open = 0
+        self.rejected_full = 0
+        self.fallbacks = 0
+        self.abandoned = 0
+        self.last_error = ''
+
+    def _fallback(self, fallback: Any, error: Exception) -> Any:
+        if fallback is _RAISE:
+            fallback = self.fallback
+        if fallback is _RAISE:
+            raise error
+        self.fallbacks += 1
+        return fallback(error) if callable(fallback) else fallback
+
+    async def call(self, func: Callable[..., Awaitable[Any]], *args: Any, fallback: Any = _RAISE, **kwargs: Any) -> Any:
+        """await func(*args, **kwargs) under the policy of the service"""
+        return await self._guarded(lambda: func(*args, **kwargs), fallback)
+
+    async def call_blocking(self, func: Callable[..., Any], *args: Any, fallback: Any = _RAISE, **kwargs: Any) -> Any:
+        """run a blocking client in the default executor under the policy
+
+        on timeout or cancellation the caller is released, but the thread
+        still finishes the call and keeps its bulkhead slot until then, so
+        the bulkhead bounds the threads (and the upstream requests) too.
+        """
+        loop = asyncio.get_running_loop()
+        return await self._guarded(lambda: loop.run_in_executor(None, functools.partial(func, *args, **kwargs)),
+                                   fallback, blocking=True)
+
+    async def _guarded(self, start: Callable[[], Awaitable[Any]], fallback: Any, blocking: bool = False) -> Any:
+        self.calls += 1
+        if not self.breaker.allow():
+            self.rejected_open += 1
+            return self._fallback(fallback, CircuitOpen(
+                f'{self.name} circuit is open, retry after {self.breaker.retry_after():.0f}s'))
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.policy.max_concurrency)
+        if self._semaphore.locked() and self.waiting >= self.policy.max_waiting:
+            self.rejected_full += 1
+            # the probe did not reach the service, let the next call probe
+            if self.breaker.state == HALF_OPEN:
+                self.breaker.probes -= 1
+            return self._fallback(fallback, BulkheadFull(
+                f'{self.name} bulkhead is full: {self.running} running, {self.waiting} waiting'))
+
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        work = None
+        try:
+            work = start()
+            # the executor future is shielded: cancelling it would not stop the thread
+            result = await asyncio.wait_for(asyncio.shield(work) if blocking else work, timeout=self.policy.timeout)
+        except asyncio.CancelledError:
+            # a cancelled probe tells nothing about the service
+            if self.breaker.state == HALF_OPEN:
+                self.breaker.probes = max(self.breaker.probes - 1, 0)
+            raise
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+                e = asyncio.TimeoutError(f'{self.name} call timeout after {self.policy.timeout}s')
+            self.failures += 1
+            self.last_error = repr(e)
+            self.breaker.failure()
+            if self.breaker.state == OPEN:
+                self.logger.warning(f'{self.name} circuit opened after: {e!r}')
+            return self._fallback(fallback, e)
+        finally:
+            if blocking and work is not None and not work.done():
+                self.abandoned += 1
+                work.add_done_callback(self._release)
+            else:
+                self._release()
+        self.successes += 1
+        self.breaker.success()
+        return result
+
+    def _release(self, work: Optional[asyncio.Future] = None) -> None:
+        """free the slot, of an abandoned blocking call when its thread finishes"""
+        if work is not None and not work.cancelled():
+            # the result of the abandoned call is dropped, retrieve its error to keep the loop quiet
+            work.exception()
+        self.running -= 1
+        self._semaphore.release()
+
+    def reset(self) -> None:
+        """close the circuit by hand"""
+        self.breaker.success()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.breaker.state,
+            'retry_after': round(self.breaker.retry_after(), 1),
+            'consecutive_failures': self.breaker.consecutive_failures,
+            'opened': self.breaker.opened,
+            'running': self.running,
+            'waiting': self.waiting,
+            'calls': self.calls,
+            'successes': self.successes,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'rejected_open': self.rejected_open,
+            'rejected_full': self.rejected_full,
+            'fallbacks': self.fallbacks,
+            'abandoned': self.abandoned,
+            'last_error': self.last_error,
+            'policy': asdict(self.policy),
+        }
+
+
+class Resilience:
+    """the guards of the upstream services, created on first use"""
+    def __init__(self, policies: Optional[Dict[str, Policy]] = None) -> None:
+        self.policies = dict(DEFAULT_POLICIES if policies is None else policies)
+        self._guards: Dict[str, ServiceGuard] = {}
+
+    def service(self, name: str) -> ServiceGuard:
+        guard = self._guards.get(name)
+        if guard is None:
+            policy = policy_from_env(name, self.policies.get(name, Policy()))
+            guard = self._guards[name] = ServiceGuard(name, policy)
+        return guard
+
+    def reset(self, name: Optional[str] = None) -> None:
+        for guard_name, guard in self._guards.items():
+            if name is None or guard_name == name:
+                guard.reset()
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: guard.stats() for name, guard in self._guards.items()}
+
+    def summary(self) -> str:
+        """one line per service for the director"""
+        lines = []
+        for name, guard in sorted(self._guards.items()):
+            stats = guard.stats()
+            line = (f"{name}: {stats['state']}, {stats['successes']}/{stats['calls']} ok, "
+                    f"{stats['timeouts']} timeout, {stats['rejected_open'] + stats['rejected_full']} rejected, "
+                    f"{stats['running']} running")
+            if stats['state'] != CLOSED:
+                line += f", retry after {stats['retry_after']}s"
+            lines.append(line)
+        return '\n'.join(lines) or 'no upstream call yet'
+
+
+resilience = Resilience()
@@ -0,0 +1,121 @@
+"""process-wide registry of the heavy resources shared by the plugins"""
+from __future__ import annotations
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+def rss_bytes() -> int:
+    """the resident memory of the process, 0 where it is unknown"""
+    try:
+        with open('/proc/self/statm', 'r', encoding='utf-8') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+
+class ResourceRegistry:
+    """named resources created once, on the first `get`, and shared
+
+    the factories run under a per-resource lock, so concurrent callers wait
+    for the same instance. The load time and the growth of the resident
+    memory while loading are kept for `stats` (the memory is approximate when
+    other threads allocate at the same time). A failed factory is retried on
+    the next `get`.
+    """
+    def __init__(self, logger: Optional[logging.Logger] = None) -> None:
+        self.logger = logger or logging.getLogger('ResourceRegistry')
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._resources: Dict[str, Any] = {}
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any], replace: bool = False) -> None:
+        with self._lock:
+            if name in self._factories and not replace:
+                raise ValueError(f'resource <{name}> is already registered')
+            self._factories[name] = factory
+            self._locks.setdefault(name, threading.Lock())
+            self._records[name] = {'loaded': False, 'users': 0, 'load_ms': None, 'rss_bytes': None, 'errors': 0}
+            self._resources.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        """the shared resource, created by its factory on the first call"""
+        if name not in self._factories:
+            raise KeyError(f'resource <{name}> is not registered')
+        record = self._records[name]
+        if name not in self._resources:
+            with self._locks[name]:
+                if name not in self._resources:
+                    self._load(name, record)
+        record['users'] += 1
+        return self._resources[name]
+
+    def _load(self, name: str, record: Dict[str, Any]) -> None:
+        rss = rss_bytes()
+        start = time.perf_counter()
+        try:
+            resource = self._factories[name]()
+        except Exception:
+            record['errors'] += 1
+            raise
+        record.update({
+            'loaded': True,
+            'load_ms': round((time.perf_counter() - start) * 1000, 1),
+            'rss_bytes': max(rss_bytes() - rss, 0),
+        })
+        self._resources[name] = resource
+        self.logger.info(f"resource <{name}> loaded in {record['load_ms']}ms")
+
+    def loaded(self, name: str) -> bool:
+        return name in self._resources
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {'rss_bytes': rss_bytes()}
+        for name, record in self._records.items():
+            stats[name] = dict(record)
+            if name in self._resources and hasattr(self._resources[name], 'stats'):
+                stats[name]['stats'] = self._resources[name].stats()
+        return stats
+
+
+def _keyword_filter():
+    from utils.DFAFilter import DFAFilter
+    gfw = DFAFilter()
+    gfw.parse()
+    return gfw
+
+
+def _intent():
+    from utils.rasaintent import AsyncRasaIntent
+    rasa = AsyncRasaIntent.shared()
+    threshold = float(os.environ.get('CA_INTENT_THRESHOLD', 0.8))
+    if threshold > 1:
+        return rasa
+    # the local classifier answers the confident cases, rasa the rest
+    from utils.intent_classifier import MODEL_FILE, IntentClassifier, TieredIntent
+    local = IntentClassifier.load_or_train(os.environ.get('CA_INTENT_MODEL', MODEL_FILE))
+    return TieredIntent(local, rasa, threshold)
+
+
+def _generation():
+    from antigen_bot.generation import GenerationGateway
+    gateway = GenerationGateway.from_env()
+    if not gateway.routes:
+        gateway.logger.warning('no generation provider configured, set YUAN_ACCOUNT, PANGU_KEY or baidu_access_token')
+    return gateway
+
+
+def _similarity():
+    from antigen_bot.similarity import SimilarityService
+    return SimilarityService.shared()
+
+
+registry = ResourceRegistry()
+registry.register('keyword_filter', _keyword_filter)
+registry.register('intent', _intent)
+registry.register('similarity', _similarity)
+registry.register('generation', _generation)
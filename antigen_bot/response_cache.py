@@ -0,0 +1,180 @@
+"""semantic cache of the validated generations, keyed by (prompt template, input text)"""
+from __future__ import annotations
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from antigen_bot.faq_index import Embedder, FAQIndex
+from antigen_bot.utils import normalize_text
+
+
+class ResponseCache:
+    """generations of similar inputs served again, one vector index per template
+
+    the same input (after normalization) is a hit. Otherwise the cached
+    inputs whose n-gram vector is at least `threshold` (cosine) close are
+    only candidates (see `NgramEmbedder`). With a `similarity` service
+    (the Taskflow model) the candidates are reranked and the best one is a
+    hit from `confirm_threshold` on; without one the vector score decides.
+    The replies stored for the input are served in turn for variety.
+
+    an entry keeps at most `candidates` replies and expires `ttl` seconds
+    after it was created, beyond `max_size` entries of a template the least
+    recently used one is evicted.
+
+    every hit saves one upstream generation, its latency is estimated by the
+    mean latency of the generations stored in the entry.
+    """
+    def __init__(self, threshold: float = 0.85, candidates: int = 3, max_size: int = 500, ttl: Optional[float] = 24 * 3600,
+                 similarity: Any = None, confirm_threshold: float = 0.88, recall: int = 5,
+                 embedder: Optional[Embedder] = None, clock: Callable[[], float] = time.monotonic) -> None:
+        if max_size <= 0 or candidates <= 0:
+            raise ValueError('max_size and candidates should greater than 0')
+        self.threshold = threshold
+        self.candidates = candidates
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity
+        self.confirm_threshold = confirm_threshold
+        self.recall = recall
+        self._clock = clock
+        self._index = FAQIndex(embedder)
+        # template -> normalized input -> entry, in LRU order
+        self._entries: Dict[str, OrderedDict[str, Dict[str, Any]]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_latency = 0.0
+        self.evictions = 0
+        self.expirations = 0
+        self.unconfirmed = 0
+        self.confirm_errors = 0
+
+    @classmethod
+    def from_env(cls, **kwargs) -> 'ResponseCache':
+        """configured by CA_RESPONSE_CACHE_THRESHOLD, _CANDIDATES, _SIZE and _TTL"""
+        kwargs.setdefault('threshold', float(os.environ.get('CA_RESPONSE_CACHE_THRESHOLD', 0.85)))
+        kwargs.setdefault('candidates', int(os.environ.get('CA_RESPONSE_CACHE_CANDIDATES', 3)))
+        kwargs.setdefault('max_size', int(os.environ.get('CA_RESPONSE_CACHE_SIZE', 500)))
+        kwargs.setdefault('ttl', float(os.environ.get('CA_RESPONSE_CACHE_TTL', 24 * 3600)))
+        return cls(**kwargs)
+
+    def _expired(self, entry: Dict[str, Any], now: float) -> bool:
+        return self.ttl is not None and now - entry['time'] >= self.ttl
+
+    def _drop(self, template: str, key: str) -> None:
+        del self._entries[template][key]
+        self._index.remove(template, key)
+
+    def _purge(self, template: str, now: float) -> int:
+        entries = self._entries.get(template, {})
+        expired = [key for key, entry in entries.items() if self._expired(entry, now)]
+        for key in expired:
+            self._drop(template, key)
+        self.expirations += len(expired)
+        return len(expired)
+
+    def _candidates(self, template: str, key: str) -> List[str]:
+        """the live cached inputs above the threshold, best first, the expired ones are dropped first"""
+        self._purge(template, self._clock())
+        entries = self._entries.get(template)
+        if not entries:
+            return []
+        if key in entries:
+            return [key]
+        return [question for _, question, _ in self._index.search(template, key, k=self.recall, threshold=self.threshold)]
+
+    async def _confirm(self, text: str, template: str, candidates: List[str]) -> Optional[str]:
+        """the candidate the similarity model scores best from `confirm_threshold` on"""
+        entries = self._entries[template]
+        try:
+            result = await self.similarity.similarity([[text, entries[key]['text']] for key in candidates])
+        except Exception:
+            # a busy or failed model confirms nothing, the generation goes on
+            self.confirm_errors += 1
+            return None
+        best, score = max(zip(candidates, (float(item['similarity']) for item in result)), key=lambda item: item[1])
+        if score < self.confirm_threshold:
+            self.unconfirmed += 1
+            return None
+        # the entry may be dropped while the model was running
+        return best if best in entries else None
+
+    async def get(self, template: str, text: str) -> Optional[str]:
+        """the next stored reply of the most similar cached input, None on a miss"""
+        key = normalize_text(text)
+        candidates = self._candidates(template, key) if key else []
+        best = candidates[0] if candidates else None
+        if candidates and candidates[0] != key and self.similarity is not None:
+            best = await self._confirm(text, template, candidates)
+        if best is None:
+            self.misses += 1
+            return None
+        entry = self._entries[template][best]
+        self._entries[template].move_to_end(best)
+        reply = entry['replies'][entry['turn'] % len(entry['replies'])]
+        entry['turn'] += 1
+        self.hits += 1
+        self.saved_latency += entry['latency']
+        return reply
+
+    def add(self, template: str, text: str, reply: str, latency: Optional[float] = None) -> None:
+        """store a validated reply of the input
+
+        the reply joins the entry of the same input (after normalization),
+        a similar one gets its own entry. `latency` is the upstream time
+        spent on the reply, if it is known.
+        """
+        key = normalize_text(text)
+        if not key or not reply:
+            return
+        entries = self._entries.setdefault(template, OrderedDict())
+        entry = entries.get(key)
+        if entry is not None and self._expired(entry, self._clock()):
+            self._drop(template, key)
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            entry = entries[key] = {'text': text, 'replies': [], 'turn': 0, 'latency': 0.0, 'generations': 0, 'time': self._clock()}
+            self._index.add(template, [key])
+            while len(entries) > self.max_size:
+                self._drop(template, next(iter(entries)))
+                self.evictions += 1
+        else:
+            entries.move_to_end(key)
+        if reply not in entry['replies'] and len(entry['replies']) < self.candidates:
+            entry['replies'].append(reply)
+        if latency is not None:
+            entry['generations'] += 1
+            entry['latency'] += (latency - entry['latency']) / entry['generations']
+
+    def purge(self) -> int:
+        """drop the expired entries"""
+        now = self._clock()
+        return sum(self._purge(template, now) for template in list(self._entries))
+
+    def clear(self, template: Optional[str] = None) -> None:
+        for name in [name for name in self._entries if template is None or name == template]:
+            for key in list(self._entries[name]):
+                self._drop(name, key)
+            del self._entries[name]
+
+    def stats(self) -> Dict[str, Any]:
+        self.purge()
+        total = self.hits + self.misses
+        return {
+            'threshold': self.threshold,
+            'confirm_threshold': self.confirm_threshold if self.similarity is not None else None,
+            'templates': len(self._entries),
+            'size': sum(len(entries) for entries in self._entries.values()),
+            'replies': sum(len(entry['replies']) for entries in self._entries.values() for entry in entries.values()),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'saved_latency_s': round(self.saved_latency, 3),
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'unconfirmed': self.unconfirmed,
+            'confirm_errors': self.confirm_errors,
+        }
@@ -0,0 +1,235 @@
+"""persistent delayed-job scheduler running on the asyncio event loop"""
+from __future__ import annotations
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+Handler = Callable[['Job'], Awaitable[Any]]
+
+
+@dataclass
+class Job:
+    """one delayed job, `payload` must be json serializable to survive restarts"""
+    job_id: str
+    kind: str
+    run_at: float
+    owner: str = ''
+    payload: Dict[str, Any] = field(default_factory=dict)
+
+
+class DelayedJobScheduler:
+    """run the jobs at their wall-clock time without blocking the event loop
+
+    the pending jobs are kept in a heap (O(log n) schedule, lazy O(1) cancel), and
+    every change is appended to a json-lines journal, which is replayed and
+    compacted on start, so the jobs survive restarts. Overdue jobs found on
+    start run immediately.
+    """
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        compact_threshold: int = 1000,
+        clock: Callable[[], float] = time.time,
+        logger: Optional[logging.Logger] = None
+    ) -> None:
+        self.path = path
+        self.compact_threshold = compact_threshold
+        self._clock = clock
+        self.logger = logger or logging.getLogger('DelayedJobScheduler')
+
+        self._handlers: Dict[str, Handler] = {}
+        self._jobs: Dict[str, Job] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._owners: Dict[str, Set[str]] = {}
+        self._journal_size = 0
+
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+
+        self.executed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+        if self.path:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def register(self, kind: str, handler: Handler) -> None:
+        """register the coroutine function which executes the jobs of the kind"""
+        self._handlers[kind] = handler
+
+    # ------------------------------ persistence ------------------------------
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    self.logger.warning(f'skip the broken journal line: {line}')
+                    continue
+                if record.get('op') == 'add':
+                    self._add(Job(**record['job']))
+                elif record.get('op') == 'remove':
+                    self._remove(record['job_id'])
+        self._compact()
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        if not self.path:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._journal_size += 1
+        if self._journal_size > max(self.compact_threshold, 2 * len(self._jobs)):
+            self._compact()
+
+    def _compact(self) -> None:
+        """rewrite the journal with the pending jobs only"""
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for job in self._jobs.values():
+                f.write(json.dumps({'op': 'add', 'job': asdict(job)}, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.path)
+        self._journal_size = len(self._jobs)
+
+    # ------------------------------ bookkeeping ------------------------------
+    def _add(self, job: Job) -> None:
+        self._jobs[job.job_id] = job
+        heapq.heappush(self._heap, (job.run_at, job.job_id))
+        self._owners.setdefault(job.owner, set()).add(job.job_id)
+
+    def _remove(self, job_id: str) -> Optional[Job]:
+        # the heap entry is left in place and skipped when it is popped
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return None
+        owned = self._owners.get(job.owner)
+        if owned is not None:
+            owned.discard(job_id)
+            if not owned:
+                del self._owners[job.owner]
+        return job
+
+    # ------------------------------ public api ------------------------------
+    def schedule(self, kind: str, delay: float, payload: Optional[Dict[str, Any]] = None, owner: str = '') -> Job:
+        """schedule the job to run after `delay` seconds"""
+        if kind not in self._handlers:
+            raise ValueError(f'no handler registered for the job kind: {kind}')
+
+        job = Job(job_id=uuid.uuid4().hex[:8], kind=kind, run_at=self._clock() + max(0.0, delay), owner=owner, payload=payload or {})
+        self._add(job)
+        self._append({'op': 'add', 'job': asdict(job)})
+        if self._wakeup is not None and self._peek()[1] == job.job_id:
+            self._wakeup.set()
+        return job
+
+    def cancel(self, job_id: str, owner: Optional[str] = None) -> Optional[Job]:
+        """cancel the pending job, only the owner's job if `owner` is given"""
+        job = self._jobs.get(job_id)
+        if job is None or (owner is not None and job.owner != owner):
+            return None
+        self._remove(job_id)
+        self._append({'op': 'remove', 'job_id': job_id})
+        self.cancelled += 1
+        if len(self._heap) > 2 * len(self._jobs) + 64:
+            # too many cancelled entries, rebuild the heap
+            self._heap = [(job.run_at, job.job_id) for job in self._jobs.values()]
+            heapq.heapify(self._heap)
+        return job
+
+    def jobs(self, owner: Optional[str] = None) -> List[Job]:
+        """the pending jobs (of the owner) ordered by the run time"""
+        if owner is None:
+            jobs = list(self._jobs.values())
+        else:
+            jobs = [self._jobs[job_id] for job_id in self._owners.get(owner, ())]
+        return sorted(jobs, key=lambda job: job.run_at)
+
+    def start(self) -> None:
+        """start the timer task, must be called inside the running event loop"""
+        if self._runner is not None and not self._runner.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._runner = asyncio.ensure_future(self._run())
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def _peek(self) -> Optional[Tuple[float, str]]:
+        """the earliest pending heap entry, dropping the cancelled ones"""
+        while self._heap and self._heap[0][1] not in self._jobs:
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else None
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            entry = self._peek()
+            if entry is None:
+                await self._wakeup.wait()
+                continue
+
+            run_at, job_id = entry
+            delay = run_at - self._clock()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            job = self._remove(job_id)
+            if job is None:
+                continue
+            self._append({'op': 'remove', 'job_id': job_id})
+            task = asyncio.ensure_future(self._execute(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, job: Job) -> None:
+        handler = self._handlers.get(job.kind)
+        if handler is None:
+            self.failed += 1
+            self.logger.error(f'no handler registered for the job<{job.job_id}> kind: {job.kind}')
+            return
+        try:
+            await handler(job)
+            self.executed += 1
+        except Exception as e:
+            self.failed += 1
+            self.logger.exception(f'job<{job.job_id}> {job.kind} failed: {e}')
+
+    def stats(self) -> Dict[str, Any]:
+        entry = self._peek()
+        return {
+            'pending': len(self._jobs),
+            'running': len(self._running),
+            'executed': self.executed,
+            'failed': self.failed,
+            'cancelled': self.cancelled,
+            'next_in': round(entry[0] - self._clock(), 1) if entry is not None else None,
+        }
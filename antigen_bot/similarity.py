@@ -0,0 +1,159 @@
+"""text similarity service running the PaddleNLP Taskflow off the event loop"""
+from __future__ import annotations
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from antigen_bot.dispatcher import percentile
+
+BACKENDS = ('thread', 'process')
+
+# the model of the current worker, threads keep their own copy in the thread local,
+# processes have their own module globals anyway
+_worker = threading.local()
+
+
+def load_taskflow(task: str) -> Callable[[List[List[str]]], List[dict]]:
+    """the default model factory, imports paddlenlp inside the worker"""
+    from paddlenlp import Taskflow
+    return Taskflow(task)
+
+
+def _init_worker(factory: Callable[[str], Any], task: str, loads: Optional[List[float]] = None) -> None:
+    start = time.perf_counter()
+    _worker.model = factory(task)
+    if loads is not None:
+        loads.append(time.perf_counter() - start)
+
+
+def _predict(pairs: List[List[str]]) -> List[dict]:
+    return _worker.model(pairs)
+
+
+class SimilarityOverloaded(RuntimeError):
+    """raised when the queue of the similarity service is full"""
+
+
+class SimilarityService:
+    """awaitable text similarity backed by a thread or process pool
+
+    every worker loads the model once in its initializer. `similarity` awaits
+    the result of one batch of [text1, text2] pairs, rejects the call when
+    `max_queue_size` batches are already waiting, and gives up after `timeout`
+    seconds (the worker still finishes the batch).
+    """
+    _shared: Optional['SimilarityService'] = None
+
+    def __init__(
+        self,
+        backend: str = 'thread',
+        workers: int = 1,
+        max_queue_size: int = 64,
+        timeout: float = 10,
+        task: str = 'text_similarity',
+        factory: Callable[[str], Any] = load_taskflow,
+        logger: Optional[logging.Logger] = None
+    ) -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f'backend should be one of {BACKENDS}, got {backend}')
+        if workers <= 0:
+            raise ValueError('workers should greater than 0')
+        self.backend = backend
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self.timeout = timeout
+        self.task = task
+        self.factory = factory
+        self.logger = logger or logging.getLogger('SimilarityService')
+
+        self._executor: Optional[Executor] = None
+        self.pending = 0
+        self.calls = 0
+        self.pairs = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.errors = 0
+        self._latencies: Deque[float] = deque(maxlen=1000)
+        self._model_loads: List[float] = []
+
+    @classmethod
+    def shared(cls, **kwargs) -> 'SimilarityService':
+        """the process-wide service, configured by CA_SIMILARITY_BACKEND and CA_SIMILARITY_WORKERS"""
+        if cls._shared is None:
+            kwargs.setdefault('backend', os.environ.get('CA_SIMILARITY_BACKEND', 'thread'))
+            kwargs.setdefault('workers', int(os.environ.get('CA_SIMILARITY_WORKERS', 1)))
+            cls._shared = cls(**kwargs)
+        return cls._shared
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            pool = ThreadPoolExecutor if self.backend == 'thread' else ProcessPoolExecutor
+            # the thread workers report their model loads, a process keeps its own copy of the list
+            loads = self._model_loads if self.backend == 'thread' else None
+            self._executor = pool(max_workers=self.workers, initializer=_init_worker, initargs=(self.factory, self.task, loads))
+        return self._executor
+
+    async def similarity(self, pairs: List[List[str]]) -> List[dict]:
+        """the similarity of each [text1, text2] pair, like `Taskflow('text_similarity')(pairs)`"""
+        if not pairs:
+            return []
+        if self.pending >= self.max_queue_size:
+            self.rejected += 1
+            raise SimilarityOverloaded(f'{self.pending} similarity batches are waiting')
+
+        loop = asyncio.get_running_loop()
+        batch = self._get_executor().submit(_predict, pairs)
+        # the batch keeps running after a timeout, it stays pending until the executor is done with it
+        self.pending += 1
+        batch.add_done_callback(lambda _: self._call_soon(loop, self._batch_done))
+        self.calls += 1
+        self.pairs += len(pairs)
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(batch), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.logger.warning(f'similarity of {len(pairs)} pairs timeout after {self.timeout}s')
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self._latencies.append(time.perf_counter() - start)
+
+    def _batch_done(self) -> None:
+        self.pending -= 1
+
+    @staticmethod
+    def _call_soon(loop: asyncio.AbstractEventLoop, callback) -> None:
+        try:
+            loop.call_soon_threadsafe(callback)
+        except RuntimeError:
+            # the loop is closed, nothing is waiting any more
+            pass
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': self.backend,
+            'workers': self.workers,
+            'models_loaded': len(self._model_loads),
+            'model_load_s': round(sum(self._model_loads), 3),
+            'pending': self.pending,
+            'calls': self.calls,
+            'pairs': self.pairs,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+            'latency_p50': round(percentile(self._latencies, 50), 4),
+            'latency_p99': round(percentile(self._latencies, 99), 4),
+        }
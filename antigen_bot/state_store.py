@@ -0,0 +1,244 @@
+"""embedded key-value state store shared by the plugins"""
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple, Union
+
+Key = Union[str, Tuple[str, ...]]
+
+_DELETED = object()
+_STOP = object()
+
+
+def _encode_key(key: Key) -> str:
+    return json.dumps(list(key) if isinstance(key, tuple) else key, ensure_ascii=False)
+
+
+def _decode_key(raw: str) -> Key:
+    key = json.loads(raw)
+    return tuple(key) if isinstance(key, list) else key
+
+
+class StateStore:
+    """SQLite (WAL) backed namespaced key-value store
+
+    `set` and `delete` only enqueue the change, a writer thread commits the
+    queued changes in batches, one transaction per batch, so the event loop
+    never waits for the disk and every update costs O(1) instead of
+    rewriting a whole json file. The reads see the queued changes at once.
+
+    keys are strings or tuples of strings, values anything json serializable.
+    """
+    _shared: Dict[str, 'StateStore'] = {}
+
+    def __init__(self, path: str, batch_size: int = 256, logger: Optional[logging.Logger] = None) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.logger = logger or logging.getLogger('StateStore')
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._reader = self._connect()
+        self._reader.execute(
+            'CREATE TABLE IF NOT EXISTS state (ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (ns, key))'
+        )
+        self._reader.commit()
+        self._read_lock = threading.Lock()
+
+        self._queue: queue.Queue = queue.Queue()
+        # changes not committed yet: (ns, key) -> (seq, value)
+        self._pending: Dict[Tuple[str, str], Tuple[int, Any]] = {}
+        self._pending_lock = threading.Lock()
+        self._committed = threading.Condition(self._pending_lock)
+        self._seq = 0
+        self._committed_seq = 0
+
+        self.writes = 0
+        self.batches = 0
+        self.errors = 0
+
+        self._writer = threading.Thread(target=self._write_loop, name='StateStoreWriter', daemon=True)
+        self._writer.start()
+
+    @classmethod
+    def shared(cls, path: str) -> 'StateStore':
+        """the process-wide store of the database file"""
+        path = os.path.abspath(path)
+        if path not in cls._shared:
+            cls._shared[path] = cls(path)
+        return cls._shared[path]
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    # ------------------------------ writes ------------------------------
+    def _enqueue(self, ns: str, key: Key, value: Any) -> None:
+        raw_key = _encode_key(key)
+        # encode now, the caller may keep mutating the value
+        if value is not _DELETED:
+            value = json.dumps(value, ensure_ascii=False)
+        with self._pending_lock:
+            self._seq += 1
+            self._pending[(ns, raw_key)] = (self._seq, value)
+            self._queue.put((self._seq, ns, raw_key, value))
+
+    def set(self, ns: str, key: Key, value: Any) -> None:
+        self._enqueue(ns, key, value)
+
+    def delete(self, ns: str, key: Key) -> None:
+        self._enqueue(ns, key, _DELETED)
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            with self._pending_lock:
+                # only the latest change of each key is written
+                changes = [
+                    (seq, ns, raw_key, value) for seq, ns, raw_key, value in batch
+                    if self._pending.get((ns, raw_key), (None,))[0] == seq
+                ]
+            try:
+                with conn:
+                    for _, ns, raw_key, value in changes:
+                        if value is _DELETED:
+                            conn.execute('DELETE FROM state WHERE ns = ? AND key = ?', (ns, raw_key))
+                        else:
+                            conn.execute(
+                                'INSERT OR REPLACE INTO state (ns, key, value) VALUES (?, ?, ?)', (ns, raw_key, value)
+                            )
+            except Exception as e:
+                # the changes stay in the pending overlay for the readers and are retried later
+                self.errors += 1
+                self.logger.exception(f'failed to commit {len(changes)} state changes: {e}')
+                time.sleep(1)
+                for change in changes:
+                    self._queue.put(change)
+                continue
+
+            self.writes += len(changes)
+            self.batches += 1
+            with self._committed:
+                for seq, ns, raw_key, _ in changes:
+                    if self._pending.get((ns, raw_key), (None,))[0] == seq:
+                        del self._pending[(ns, raw_key)]
+                self._committed_seq = max(self._committed_seq, batch[-1][0])
+                self._committed.notify_all()
+        conn.close()
+
+    def sync(self, timeout: Optional[float] = None) -> bool:
+        """block until the queued changes are committed"""
+        with self._committed:
+            target = self._seq
+            return self._committed.wait_for(lambda: self._committed_seq >= target and not self._pending_upto(target), timeout=timeout)
+
+    def _pending_upto(self, target: int) -> bool:
+        return any(seq <= target for seq, _ in self._pending.values())
+
+    async def flush(self, timeout: Optional[float] = None) -> bool:
+        """wait for the queued changes to be committed, without blocking the event loop"""
+        return await asyncio.get_event_loop().run_in_executor(None, self.sync, timeout)
+
+    def close(self) -> None:
+        self._queue.put(_STOP)
+        self._writer.join()
+        with self._read_lock:
+            self._reader.close()
+        for path, store in list(self._shared.items()):
+            if store is self:
+                del self._shared[path]
+
+    # ------------------------------ reads ------------------------------
+    def get(self, ns: str, key: Key, default: Any = None) -> Any:
+        raw_key = _encode_key(key)
+        with self._pending_lock:
+            pending = self._pending.get((ns, raw_key))
+        if pending is not None:
+            return default if pending[1] is _DELETED else json.loads(pending[1])
+
+        with self._read_lock:
+            row = self._reader.execute('SELECT value FROM state WHERE ns = ? AND key = ?', (ns, raw_key)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def items(self, ns: str) -> Dict[Key, Any]:
+        """all of the key-values of the namespace"""
+        # take the pending changes first, a change committed in between is then in the table
+        with self._pending_lock:
+            pending = [(raw_key, value) for (pending_ns, raw_key), (_, value) in self._pending.items() if pending_ns == ns]
+        with self._read_lock:
+            rows = self._reader.execute('SELECT key, value FROM state WHERE ns = ?', (ns,)).fetchall()
+        result = dict(rows)
+        for raw_key, value in pending:
+            if value is _DELETED:
+                result.pop(raw_key, None)
+            else:
+                result[raw_key] = value
+        return {_decode_key(raw_key): json.loads(value) for raw_key, value in result.items()}
+
+    def nested(self, ns: str) -> Dict[str, Dict[str, Any]]:
+        """the namespace with (outer, inner) keys as a two-level dict"""
+        result: Dict[str, Dict[str, Any]] = {}
+        for (outer, inner), value in self.items(ns).items():
+            result.setdefault(outer, {})[inner] = value
+        return result
+
+    # ------------------------------ import ------------------------------
+    def import_json(self, ns: str, path: str, depth: int = 1) -> bool:
+        """one-time import of a legacy json file into the namespace
+
+        a list becomes {item: True}; with depth 2 a {outer: {inner: value}}
+        (or {outer: [inner, ...]}) dict is keyed by (outer, inner).
+
+        Returns:
+            bool: if the file is imported now
+        """
+        if self.get('__meta__', ('imported', ns)) or not os.path.exists(path):
+            return False
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        if isinstance(data, list):
+            data = {item: True for item in data}
+        for key, value in data.items():
+            if depth == 2:
+                if isinstance(value, list):
+                    value = {item: True for item in value}
+                for inner, inner_value in value.items():
+                    self.set(ns, (key, inner), inner_value)
+            else:
+                self.set(ns, key, value)
+        self.set('__meta__', ('imported', ns), path)
+        self.logger.info(f'imported {path} into the state store namespace: {ns}')
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pending': len(self._pending),
+            'writes': self.writes,
+            'batches': self.batches,
+            'errors': self.errors,
+        }
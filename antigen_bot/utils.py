@@ -7,11 +7,29 @@ utils function for AntigenBot
 """
 #from __future__ import annotations
 import re
+import unicodedata
 
 def remove_at_info(text: str) -> str:
     """get the clear message, remove the command prefix and at"""
     return re.sub(r'@.+?\s', "", text)
 
+
+def normalize_text(text: str) -> str:
+    """normalize the question for cache keys
+
+    remove the @ info, turn the full-width chars into half-width ones (NFKC),
+    lower the case and drop all whitespace and punctuation
+    """
+    text = unicodedata.normalize('NFKC', remove_at_info(text)).lower()
+    return ''.join(char for char in text if unicodedata.category(char)[0] not in ('P', 'S', 'Z', 'C'))
+
+
+def del_special_chars(text: str) -> str:
+    """remove the special tokens and chars of the generation models"""
+    for char in ['<unk>', '<eod>', '#', '▃', '▁', '▂', '　']:
+        text = text.replace(char, '')
+    return text
+
 if __name__ == "__main__":
     print("====remove at info test====")
 
@@ -0,0 +1,123 @@
+"""Unit test for the Aho–Corasick keyword filter"""
+from __future__ import annotations
+import os
+import random
+
+from utils.ACFilter import ACFilter, Automaton, compile_file, load_keywords
+from utils.DFAFilter import DFAFilter
+from utils.simpleFilter import SimpleFilter
+
+
+def brute_force(keywords, message):
+    message = message.lower()
+    return sorted(
+        (start, keyword) for keyword in set(keywords)
+        for start in range(len(message)) if message.startswith(keyword, start)
+    )
+
+
+def test_overlapping_matches():
+    ac = ACFilter(['he', 'she', 'his', 'hers'])
+    assert ac.scan('ushers') == [(1, 'she'), (2, 'he'), (2, 'hers')]
+    assert ac.filter('ushers') == 'she'
+    assert ac.filter('nothing') is None
+    assert ac.scan('') == []
+
+
+def test_mismatch_resets_the_walk():
+    # the old trie walk skipped the mismatched chars and reported "ac" in "abc"
+    ac = ACFilter(['ac', '法轮功'])
+    assert ac.filter('abc') is None
+    assert ac.filter('法轮大法') is None
+    assert ac.scan('练法轮功') == [(1, '法轮功')]
+
+
+def test_add_rebuilds_lazily():
+    ac = ACFilter()
+    assert ac.filter('核酸') is None
+    ac.add(' 核酸 ')
+    ac.add('')
+    assert ac.scan('做核酸') == [(1, '核酸')]
+    assert ac.stats()['keywords'] == 1
+
+
+def test_same_as_brute_force():
+    rng = random.Random(7)
+    alphabet = 'abcd法轮'
+    keywords = [''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(40)]
+    ac = ACFilter(keywords)
+    for _ in range(200):
+        message = ''.join(rng.choice(alphabet + 'xyz') for _ in range(rng.randint(0, 30)))
+        assert sorted(ac.scan(message)) == brute_force(keywords, message)
+
+
+def test_drop_in_filters(tmp_path):
+    keywords = load_keywords()
+    message = 'Hello，' + keywords[10].upper() + ' 世界'
+
+    dfa = DFAFilter(logs=str(tmp_path))
+    dfa.parse()
+    simple = SimpleFilter(logs=str(tmp_path))
+    for gfw in (dfa, simple):
+        assert gfw.filter(message) is not None
+        assert gfw.filter('今天天气很好') is None
+        assert sorted(gfw.scan(message)) == brute_force(keywords, message)
+
+
+def test_compiled_file_is_reused(tmp_path):
+    source = tmp_path / 'keywords'
+    source.write_text('核酸\n团购\n', encoding='utf-8')
+    target = str(tmp_path / 'cache' / 'keywords.acf')
+
+    automaton, compiled = compile_file(str(source), target)
+    assert compiled and automaton.path == target
+    assert automaton.keywords == ['核酸', '团购']
+    mtime = os.path.getmtime(target)
+
+    automaton, compiled = compile_file(str(source), target)
+    assert not compiled
+    assert os.path.getmtime(target) == mtime
+
+    ac = ACFilter()
+    assert not ac.load(str(source), target)
+    assert ac.scan('做核酸，参加团购') == [(1, '核酸'), (6, '团购')]
+
+
+def test_invalid_file_is_rebuilt(tmp_path):
+    source = tmp_path / 'keywords'
+    source.write_text('核酸\n', encoding='utf-8')
+    target = tmp_path / 'keywords.acf'
+    target.write_bytes(b'garbage')
+    assert Automaton.read_header(str(target)) is None
+
+    automaton, compiled = compile_file(str(source), str(target))
+    assert compiled
+    assert automaton.size == 3
+
+
+def test_hot_reload(tmp_path):
+    source = tmp_path / 'keywords'
+    source.write_text('核酸\n', encoding='utf-8')
+    ac = ACFilter()
+    ac.load(str(source), str(tmp_path / 'keywords.acf'))
+    old = ac._automaton
+    assert ac.filter('团购') is None
+    assert not ac.reload()
+
+    source.write_text('核酸\n团购\n', encoding='utf-8')
+    assert ac.reload()
+    assert ac.filter('团购') == '团购'
+    # the old mapping stays valid for a scan still using it
+    assert old.keywords == ['核酸']
+
+    ac.add('抢菜')
+    assert ac.filter('抢菜') == '抢菜'
+    assert ac.stats()['keywords'] == 3
+    # the added keyword survives a reload, which still tells the file is unchanged
+    assert not ac.reload()
+    assert ac.filter('抢菜') == '抢菜'
+
+    source.write_text('核酸\n', encoding='utf-8')
+    assert ac.reload()
+    assert ac.filter('团购') is None
+    assert sorted(ac.keywords) == ['抢菜', '核酸']
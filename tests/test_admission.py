@@ -0,0 +1,33 @@
+"""Unit test for the load shedder"""
+from __future__ import annotations
+import pytest
+
+from antigen_bot.admission import LoadShedder
+
+
+def test_shed_in_tiers():
+    """features should be shed in order as the load grows"""
+    load = 0
+    shedder = LoadShedder(load=lambda: load, thresholds=[2, 4, 6])
+
+    assert shedder.admit('quanjia') and shedder.admit('docfaq') and shedder.admit('intent')
+
+    load = 2
+    assert not shedder.admit('quanjia')
+    assert shedder.admit('docfaq')
+
+    load = 6
+    assert shedder.tier() == 3
+    assert not shedder.admit('intent')
+
+    counters = shedder.stats()['features']
+    assert counters['quanjia'] == {'admitted': 1, 'shed': 1}
+    assert counters['intent'] == {'admitted': 1, 'shed': 1}
+
+
+def test_invalid_thresholds():
+    """thresholds should match the tiers and be ascending"""
+    with pytest.raises(ValueError):
+        LoadShedder(load=lambda: 0, thresholds=[1, 2])
+    with pytest.raises(ValueError):
+        LoadShedder(load=lambda: 0, thresholds=[3, 2, 1])
@@ -0,0 +1,47 @@
+"""Unit test for the FAQ answer and negative caches"""
+from __future__ import annotations
+
+from antigen_bot.answer_cache import AnswerCache, NegativeCache
+
+
+def test_normalized_hit_and_invalidate():
+    cache = AnswerCache()
+    cache.set('owner', '@小助理 核酸几点？', {'text': '核酸几点'})
+
+    assert cache.get('owner', '核酸 几点') == {'text': '核酸几点'}
+    assert cache.get('owner', '核酸几点！！') == {'text': '核酸几点'}
+    assert cache.get('another owner', '核酸几点') is None
+    assert cache.get('owner', '团购什么时候到') is None
+
+    cache.invalidate('owner')
+    assert cache.get('owner', '核酸几点') is None
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['invalidations']) == (2, 3, 1)
+
+
+def test_skip_empty_key():
+    cache = AnswerCache()
+    cache.set('owner', '？？？', {'docfaq': 'answer'})
+    cache.set('owner', '核酸', {})
+    assert cache.stats()['size'] == 0
+
+
+def test_negative_cache_folds_near_duplicates():
+    now = [0.0]
+    cache = NegativeCache(ttl=100, clock=lambda: now[0])
+    assert cache.fold('room', '核酸检测几点开始') is None
+    cache.add('room', '核酸检测几点开始', 'owner')
+
+    assert cache.fold('room', '核酸检测几点开始？')['count'] == 2
+    assert cache.fold('room', '核酸检测几点开始呀')['count'] == 3
+    assert cache.fold('room', '团购什么时候到') is None
+    assert cache.fold('another room', '核酸检测几点开始') is None
+
+    now[0] = 101
+    assert cache.fold('room', '核酸检测几点开始') is None
+
+    cache.add('room', '核酸检测几点开始', 'owner')
+    cache.invalidate('owner')
+    assert cache.fold('room', '核酸检测几点开始') is None
+    assert cache.stats() == {'rooms': 0, 'size': 0, 'misses': 2, 'folded': 2}
@@ -0,0 +1,71 @@
+"""Unit test for the bounded containers"""
+from __future__ import annotations
+from antigen_bot.cache import TTLCache, TimeBucketedSet
+
+
+class FakeClock:
+    """manual clock for the ttl test"""
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ttl_cache_lru_eviction():
+    """the least recently used entry should be evicted first"""
+    cache = TTLCache(max_size=2, ttl=None)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+    assert cache.stats()['evictions'] == 1
+
+
+def test_ttl_cache_expiration():
+    """entries should expire after ttl seconds"""
+    clock = FakeClock()
+    cache = TTLCache(max_size=10, ttl=5, clock=clock)
+    cache.set('a', 1)
+    clock.now = 4
+    assert cache.get('a') == 1
+
+    clock.now = 6
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_time_bucketed_set():
+    """the set should forget members after the window and keep bounded"""
+    clock = FakeClock()
+    ids = TimeBucketedSet(window=60, buckets=6, max_size=100, clock=clock)
+    assert ids.add('msg-1') is False
+    assert ids.add('msg-1') is True
+
+    clock.now = 61
+    assert 'msg-1' not in ids
+    assert ids.stats()['expirations'] == 1
+
+    for index in range(500):
+        clock.now += 1
+        ids.add(f'id-{index}')
+    assert len(ids) <= 100
+
+
+def test_ttl_cache_purge_behind_recent_hit():
+    """a hit moves the entry to the hot end, the expired ones behind it are still purged"""
+    clock = FakeClock()
+    cache = TTLCache(max_size=10, ttl=5, clock=clock)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    clock.now = 3
+    cache.set('c', 3)
+    assert cache.get('a') == 1
+
+    clock.now = 6
+    assert cache.purge() == 2
+    assert list(cache) == ['c']
+    assert cache.stats()['expirations'] == 2
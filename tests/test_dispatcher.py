@@ -0,0 +1,88 @@
+"""Unit test for the per-conversation dispatcher"""
+from __future__ import annotations
+import asyncio
+from typing import List
+import pytest
+
+from antigen_bot.dispatcher import ConversationDispatcher
+
+
+@pytest.mark.asyncio
+async def test_conversation_in_order():
+    """messages in one conversation run in order even if the first one is slow"""
+    dispatcher = ConversationDispatcher(max_concurrency=4)
+    records: List[str] = []
+
+    def handler(name: str, delay: float):
+        async def _run():
+            await asyncio.sleep(delay)
+            records.append(name)
+        return _run
+
+    await dispatcher.submit('room-a', handler('a-1', 0.05))
+    await dispatcher.submit('room-a', handler('a-2', 0))
+    await dispatcher.submit('room-b', handler('b-1', 0))
+    await dispatcher.join()
+
+    # room-b is not blocked by the slow handler of room-a
+    assert records == ['b-1', 'a-1', 'a-2']
+    stats = dispatcher.stats()
+    assert stats['processed'] == 3
+    assert stats['backlog'] == 0
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio
+async def test_global_concurrency_cap():
+    """no more than max_concurrency handlers run at the same time"""
+    dispatcher = ConversationDispatcher(max_concurrency=2)
+    running, peak = 0, 0
+
+    async def handler():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    for index in range(6):
+        await dispatcher.submit(f'room-{index}', handler)
+    await dispatcher.join()
+    assert peak == 2
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio
+async def test_full_queue_drops():
+    """the message is dropped when the conversation queue is full"""
+    dispatcher = ConversationDispatcher(max_queue_size=1)
+
+    async def handler():
+        await asyncio.sleep(0.01)
+
+    assert await dispatcher.submit('room', handler)
+    assert not await dispatcher.submit('room', handler)
+    assert dispatcher.stats()['dropped'] == 1
+    await dispatcher.join()
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio
+async def test_submit_and_wait():
+    """a waiting submitter returns after its handler, other conversations keep running"""
+    dispatcher = ConversationDispatcher(max_concurrency=4)
+    records: List[str] = []
+
+    def handler(name: str, delay: float):
+        async def _run():
+            await asyncio.sleep(delay)
+            records.append(name)
+        return _run
+
+    slow = asyncio.ensure_future(dispatcher.submit('room-a', handler('a-1', 0.05), wait=True))
+    assert await dispatcher.submit('room-b', handler('b-1', 0), wait=True)
+    assert records == ['b-1']
+    assert not slow.done()
+    assert await slow
+    assert records == ['b-1', 'a-1']
+    await dispatcher.close()
@@ -0,0 +1,52 @@
+"""Unit test for the async DocFAQ client"""
+from __future__ import annotations
+import pytest
+from aiohttp import web
+
+from antigen_bot import docfaq
+from antigen_bot.docfaq import AsyncDocFAQ
+
+
+def _answer(action_id: str, say: str) -> dict:
+    return {'error_code': 0, 'result': {'session_id': 's', 'responses': [{'actions': [{'action_id': action_id, 'say': say}]}]}}
+
+
+@pytest.mark.asyncio
+async def test_token_and_answer_cache(monkeypatch):
+    """the token is fetched once and the repeated question is answered from memory"""
+    calls = {'token': 0, 'chat': 0}
+
+    async def token(request: web.Request):
+        calls['token'] += 1
+        return web.json_response({'access_token': 'token', 'expires_in': 2592000})
+
+    async def chat(request: web.Request):
+        calls['chat'] += 1
+        assert request.query['access_token'] == 'token'
+        data = await request.json()
+        return web.json_response(_answer('faq_answer', data['request']['query'] + '的答案'))
+
+    app = web.Application()
+    app.router.add_get('/token', token)
+    app.router.add_post('/chat', chat)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    monkeypatch.setattr(docfaq, 'TOKEN_URL', f'http://127.0.0.1:{port}/token')
+    monkeypatch.setattr(docfaq, 'CHAT_URL', f'http://127.0.0.1:{port}/chat')
+    monkeypatch.setenv('accesstoken', 'ak||sk')
+
+    faq = AsyncDocFAQ(skill_id='1', terminal='test')
+    try:
+        first = await faq.predict('核酸几点？')
+        second = await faq.predict('核酸 几点')
+        assert first == second
+        await faq.predict('核酸几点', session_id='session')
+
+        assert calls == {'token': 1, 'chat': 2}
+        assert faq.stats()['hits'] == 1
+    finally:
+        await faq.close()
+        await runner.cleanup()
@@ -0,0 +1,100 @@
+"""Unit test for the FAQ indexes and the retriever"""
+from __future__ import annotations
+import time
+
+import pytest
+
+from antigen_bot.faq_index import BM25Index, FAQIndex, FAQRetriever, NgramEmbedder
+
+
+def test_best_match_not_first_hit():
+    index = FAQIndex()
+    index.add('owner', ['核酸检测几点开始', '核酸检测', '团购什么时候到'], 'text')
+    index.add('owner', ['抗原怎么拍照上传'], 'media')
+
+    result = index.search('owner', '核酸检测几点开始？', k=3)
+    assert result[0][:2] == ('text', '核酸检测几点开始')
+    assert result[0][2] > result[1][2]
+
+    assert index.search('owner', '抗原怎么拍照上传', k=1, kind='media')[0][1] == '抗原怎么拍照上传'
+    assert index.search('owner', '今天天气不错', threshold=0.75) == []
+    assert index.search('another owner', '核酸检测') == []
+
+
+def test_add_and_remove():
+    calls = []
+    embedder = NgramEmbedder()
+
+    def counting(texts):
+        calls.append(list(texts))
+        return embedder(texts)
+
+    index = FAQIndex(counting)
+    index.add('owner', [f'问题{i}' for i in range(40)])
+    index.add('owner', ['问题1'])
+    assert len(calls) == 1 and len(index) == 40
+
+    assert index.remove('owner', '问题3')
+    assert ('owner', 'text', '问题3') not in index
+    assert ('owner', 'text', '问题39') in index
+    assert all(question != '问题3' for _, question, _ in index.search('owner', '问题3', k=40))
+    assert index.search('owner', '问题39', k=1)[0][1] == '问题39'
+
+
+def test_large_faq_is_fast():
+    index = FAQIndex()
+    index.add('owner', [f'第{i}号楼的核酸检测安排在什么时候{i % 7}' for i in range(10000)])
+    start = time.perf_counter()
+    result = index.search('owner', '第1234号楼的核酸检测安排在什么时候2', k=1)
+    assert time.perf_counter() - start < 0.1
+    assert result[0][1] == '第1234号楼的核酸检测安排在什么时候2'
+
+
+def test_bm25_incremental():
+    index = BM25Index()
+    index.add('owner', ['核酸检测几点开始', '团购什么时候到'], 'text')
+    index.add('owner', ['抗原怎么上传'], 'media')
+    assert index.search('owner', '团购到了吗', k=1)[0][:2] == ('text', '团购什么时候到')
+    assert index.search('owner', '抗原', k=1)[0][:2] == ('media', '抗原怎么上传')
+
+    assert index.remove('owner', '团购什么时候到')
+    assert all(question != '团购什么时候到' for _, question, _ in index.search('owner', '团购到了吗'))
+    assert len(index) == 2
+
+
+class FakeSimilarity:
+    def __init__(self, fail: bool = False) -> None:
+        self.fail = fail
+        self.pairs = []
+
+    async def similarity(self, pairs):
+        if self.fail:
+            raise RuntimeError('busy')
+        self.pairs.append(len(pairs))
+        return [{'similarity': 1.0 if text1.rstrip('？') == text2 else 0.1} for text1, text2 in pairs]
+
+
+@pytest.mark.asyncio
+async def test_retriever_reranks_candidates_only():
+    similarity = FakeSimilarity()
+    retriever = FAQRetriever(similarity, candidates=5, audit=True)
+    retriever.add('owner', [f'第{i}号楼什么时候做核酸' for i in range(200)])
+    retriever.add('owner', ['抗原怎么上传'], 'media')
+
+    matched = await retriever.match('owner', '第42号楼什么时候做核酸？')
+    assert matched == {'text': ('第42号楼什么时候做核酸', 1.0)}
+    # the first call reranks the candidates, the second one is the full scan audit
+    assert similarity.pairs[0] <= 10 and similarity.pairs[1] == 201
+    assert retriever.stats()['recall'] == 1.0
+
+    similarity.fail = True
+    matched = await retriever.match('owner', '抗原怎么上传？')
+    assert matched == {'media': ('抗原怎么上传', 1.0)}
+    # without the model a question sharing most characters is not answered
+    assert await retriever.match('owner', '第42号楼什么时候做的核酸') == {}
+    assert retriever.stats()['fallbacks'] == 2
+
+    retriever.fallback_threshold = 0.7
+    matched = await retriever.match('owner', '第42号楼什么时候做的核酸')
+    assert matched['text'][0] == '第42号楼什么时候做核酸'
+
@@ -0,0 +1,35 @@
+"""Unit test for the filter benchmark"""
+from __future__ import annotations
+import json
+
+from utils.ACFilter import ACFilter, load_keywords
+from utils.filter_benchmark import generate, main
+
+
+def test_corpora_are_reproducible():
+    keywords = load_keywords()
+    for kind in ('chat', 'notice', 'adversarial'):
+        assert generate(kind, 20, 1, keywords) == generate(kind, 20, 1, keywords)
+    assert all(len(message) >= 300 for message in generate('notice', 20, 1, keywords))
+
+    # the adversarial prefixes are misses, only the inserted keywords hit
+    ac = ACFilter(keywords)
+    messages = generate('adversarial', 200, 1, keywords, hit_rate=0)
+    assert not any(ac.filter(message) for message in messages)
+
+
+def test_report(tmp_path):
+    output = tmp_path / 'report.json'
+    main(['--sizes', '20', '--corpora', 'chat,adversarial', '--repeat', '1', '--output', str(output)])
+    report = json.loads(output.read_text(encoding='utf-8'))
+
+    assert set(report['engines']) == {'naive', 'dfa', 'simple', 'ac_memory'}
+    assert report['engines']['simple']['mapped_bytes'] > 0
+    assert len(report['results']) == 8
+    for result in report['results']:
+        assert result['messages'] == 20
+        assert result['msgs_per_sec'] > 0
+        assert result['p99_us'] >= result['p50_us']
+    # every engine finds the same messages
+    hits = {(result['corpus'], result['hits']) for result in report['results']}
+    assert len(hits) == 2
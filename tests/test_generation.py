@@ -0,0 +1,100 @@
+"""Unit test for the generation gateway"""
+from __future__ import annotations
+import asyncio
+
+import pytest
+
+from antigen_bot.generation import GenerationGateway, StubProvider, TokenBucket, normalize_output
+from antigen_bot.resilience import ServiceUnavailable
+
+
+def test_normalize_output():
+    assert normalize_output(' 大家▃都是邻居<eod>”后面不要 ', '”') == '大家都是邻居'
+    assert normalize_output('没有停止符', '”') == '没有停止符'
+    assert normalize_output(None) == ''
+
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = TokenBucket(rate=2, burst=2, clock=lambda: now[0])
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert bucket.wait_time() == 0.5
+    now[0] = 0.5
+    assert bucket.try_acquire()
+    now[0] = 10.0
+    assert bucket.tokens == 2
+
+
+@pytest.mark.asyncio
+async def test_route_to_the_fastest_provider():
+    slow = StubProvider('slow', '慢”', latency=0.05)
+    fast = StubProvider('fast', '快”', latency=0.01)
+    gateway = GenerationGateway([slow, fast], {'slow': (10, 10), 'fast': (10, 10)})
+    # the providers never measured are tried first
+    assert await gateway.generate('p1') == '慢'
+    assert await gateway.generate('p2') == '快'
+    assert gateway.ranking() == ['fast', 'slow']
+    assert await gateway.generate('p3') == '快'
+    assert len(fast.prompts) == 2
+
+
+@pytest.mark.asyncio
+async def test_failover_and_cooldown():
+    now = [0.0]
+    broken = StubProvider('broken', RuntimeError('boom'))
+    backup = StubProvider('backup', 'something went wrong with yuan service')
+    good = StubProvider('good', '好好说话”后面')
+    rates = {name: (1, 10) for name in ('broken', 'backup', 'good')}
+    gateway = GenerationGateway([broken, backup, good], rates, failures=2, cooldown=60, clock=lambda: now[0])
+    gateway.routes['good'].latency = 1.0
+
+    assert await gateway.generate('p') == '好好说话'
+    assert await gateway.generate('p') == '好好说话'
+    # two consecutive errors take the providers out of the ranking
+    assert gateway.ranking() == ['good']
+    assert await gateway.generate('p') == '好好说话'
+    assert len(broken.prompts) == 2
+
+    now[0] = 61.0
+    assert gateway.ranking()[-1] == 'good'
+    stats = gateway.stats()
+    assert stats['failovers'] == 4
+    assert stats['providers']['broken']['errors'] == 2
+
+
+@pytest.mark.asyncio
+async def test_unavailable_and_all_failed():
+    stub = StubProvider('stub', RuntimeError('boom'))
+    gateway = GenerationGateway([stub])
+    with pytest.raises(RuntimeError):
+        await gateway.generate('p')
+    stub.up = False
+    with pytest.raises(ServiceUnavailable):
+        await gateway.generate('p')
+    with pytest.raises(ServiceUnavailable):
+        await GenerationGateway([]).generate('p')
+
+
+@pytest.mark.asyncio
+async def test_throttled_provider_spills_over_then_waits():
+    first = StubProvider('first', '一”')
+    second = StubProvider('second', '二”', latency=0.01)
+    gateway = GenerationGateway([first, second], rates={'first': (20, 1), 'second': (20, 1)})
+    gateway.routes['first'].latency = 0.001
+    gateway.routes['second'].latency = 0.01
+
+    replies = await asyncio.gather(*(gateway.generate('p') for _ in range(3)))
+    assert sorted(replies) == ['一', '一', '二']
+    assert gateway.stats()['throttled'] == 1
+
+
+def test_from_env(monkeypatch):
+    for name in ('YUAN_ACCOUNT', 'PANGU_KEY', 'baidu_access_token'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv('CA_GENERATION_PROVIDERS', 'yuan,pangu,stub')
+    monkeypatch.setenv('CA_GENERATION_RATE_STUB', '5,2')
+    gateway = GenerationGateway.from_env()
+    assert list(gateway.routes) == ['stub']
+    bucket = gateway.routes['stub'].bucket
+    assert (bucket.rate, bucket.burst) == (5.0, 2)
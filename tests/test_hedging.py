@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from antigen_bot.hedging import HedgedGenerator, usable
+
+
+def test_usable():
+    assert usable('你好')
+    assert not usable('')
+    assert not usable('   ')
+    assert not usable(None)
+    assert not usable('somethingwentwrongwithyuanservice')
+    assert not usable('请求异常，请重试')
+
+
+@pytest.mark.asyncio
+async def test_first_acceptable_wins_and_others_cancelled():
+    cancelled = []
+    delays = [0.3, 0.01, 0.3]
+
+    async def candidate(i):
+        try:
+            await asyncio.sleep(delays[i])
+        except asyncio.CancelledError:
+            cancelled.append(i)
+            raise
+        return f'reply {i}'
+
+    hedger = HedgedGenerator(candidates=3, deadline=5)
+    assert await hedger.generate(candidate) == 'reply 1'
+    await asyncio.sleep(0)
+    assert sorted(cancelled) == [0, 2]
+    stats = hedger.stats()
+    assert stats['accepted'] == 1
+    assert stats['cancelled'] == 2
+
+
+@pytest.mark.asyncio
+async def test_rejected_and_failed_candidates_are_skipped():
+    async def candidate(i):
+        await asyncio.sleep(0.01 * (i + 1))
+        if i == 0:
+            raise RuntimeError('boom')
+        if i == 1:
+            return 'somethingwentwrongwithyuanservice'
+        if i == 2:
+            return 'repeated'
+        return 'fresh'
+
+    async def validate(reply):
+        return reply != 'repeated'
+
+    hedger = HedgedGenerator(candidates=4, deadline=5)
+    assert await hedger.generate(candidate, validate) == 'fresh'
+    stats = hedger.stats()
+    assert stats['errors'] == 1
+    assert stats['rejected'] == 2
+
+
+@pytest.mark.asyncio
+async def test_exhausted_returns_empty():
+    async def candidate(i):
+        return ''
+
+    hedger = HedgedGenerator(candidates=2, deadline=5)
+    assert await hedger.generate(candidate) == ''
+    assert hedger.stats()['exhausted'] == 1
+
+
+@pytest.mark.asyncio
+async def test_deadline_returns_empty():
+    async def candidate(i):
+        await asyncio.sleep(10)
+        return 'late'
+
+    hedger = HedgedGenerator(candidates=2, deadline=0.05)
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    assert await hedger.generate(candidate) == ''
+    assert loop.time() - start < 1
+    assert hedger.stats()['deadline_exceeded'] == 1
+    assert hedger.stats()['cancelled'] == 2
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.setenv('CA_HEDGE_CANDIDATES', '5')
+    monkeypatch.setenv('CA_HEDGE_DEADLINE', '12.5')
+    hedger = HedgedGenerator.from_env()
+    assert hedger.candidates == 5
+    assert hedger.deadline == 12.5
+    with pytest.raises(ValueError):
+        HedgedGenerator(candidates=0)
+
+
+@pytest.mark.asyncio
+async def test_collect_the_others_in_background():
+    collected = []
+    delays = [0.01, 0.05, 0.3]
+
+    async def candidate(i):
+        await asyncio.sleep(delays[i])
+        return f'reply {i}'
+
+    hedger = HedgedGenerator(candidates=3, deadline=0.2)
+    assert await hedger.generate(candidate, collect=collected.append) == 'reply 0'
+    assert collected == []
+    await asyncio.sleep(0.4)
+    # the candidate arriving after the deadline is cancelled
+    assert collected == ['reply 1']
+    stats = hedger.stats()
+    assert (stats['collected'], stats['cancelled']) == (1, 1)
@@ -0,0 +1,54 @@
+"""Unit test for the async Yuan client"""
+from __future__ import annotations
+import pytest
+from aiohttp import web
+
+from antigen_bot.inspurai import AsyncYuan
+from antigen_bot.inspurai import url_config
+
+
+@pytest.fixture
+def yuan_account(monkeypatch):
+    monkeypatch.setenv('YUAN_ACCOUNT', 'user||13800000000')
+
+
+def test_header_cached_per_day(yuan_account):
+    """the token header is only computed once a day"""
+    headers = url_config.header_generation()
+    assert headers == url_config.header_generation()
+    assert url_config.ACCOUNT == 'user'
+
+
+@pytest.mark.asyncio
+async def test_async_submit_api(yuan_account, monkeypatch):
+    """submit the query and poll the reply until it is ready"""
+    polls = []
+
+    async def submit(request: web.Request):
+        assert request.query['data'] == '你好&再见'
+        return web.json_response({'flag': True, 'resData': 'request-id'})
+
+    async def reply(request: web.Request):
+        polls.append(request.query['requestId'])
+        if len(polls) < 2:
+            return web.json_response({'flag': True, 'resData': None})
+        return web.json_response({'flag': True, 'resData': '别吵了”邻居'})
+
+    app = web.Application()
+    app.router.add_get('/submit', submit)
+    app.router.add_get('/reply', reply)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    monkeypatch.setattr(url_config, 'SUBMIT_URL', f'http://127.0.0.1:{port}/submit')
+    monkeypatch.setattr(url_config, 'REPLY_URL', f'http://127.0.0.1:{port}/reply')
+
+    yuan = AsyncYuan(engine='dialog', input_suffix='', output_prefix='', poll_interval=0.01)
+    try:
+        assert await yuan.submit_API('你好&再见', trun='”') == '别吵了'
+        assert polls == ['request-id', 'request-id']
+    finally:
+        await yuan.close()
+        await runner.cleanup()
@@ -0,0 +1,96 @@
+"""Unit test for the local intent classifier"""
+from __future__ import annotations
+import os
+
+import pytest
+
+from utils.intent_classifier import IntentClassifier, TieredIntent, agreement_report, holdout_split, load_nlu
+from utils.rasaintent import normalize_intent_text
+
+
+class FakeRasa:
+    def __init__(self) -> None:
+        self.texts = []
+
+    async def predict(self, text):
+        self.texts.append(text)
+        return 'nlu_fallback', 0.3
+
+
+@pytest.fixture(scope='module')
+def classifier() -> IntentClassifier:
+    return IntentClassifier.train()
+
+
+def test_load_nlu():
+    examples = load_nlu()
+    assert len(examples) > 200
+    assert ('再见', 'bye') in examples
+    assert len({intent for _, intent in examples}) == 15
+
+
+def test_predict(classifier: IntentClassifier):
+    assert classifier.predict('再见！') == ('bye', 1.0)
+    intent, confidence = classifier.predict('今天核酸几点开始')
+    assert intent in classifier.labels
+    assert 0 < confidence < 1
+
+
+def test_save_and_load(classifier: IntentClassifier, tmp_path):
+    path = str(tmp_path / 'intent_model.npz')
+    classifier.save(path)
+    loaded = IntentClassifier.load(path)
+    assert loaded.labels == classifier.labels
+    for text in ['再见', '你真烦人', '团购的菜到了吗']:
+        assert loaded.predict(text)[0] == classifier.predict(text)[0]
+        assert loaded.predict(text)[1] == pytest.approx(classifier.predict(text)[1], abs=1e-5)
+
+
+def test_load_or_train(tmp_path):
+    data = tmp_path / 'intents.yml'
+    data.write_text('version: "3.1"\nnlu:\n- intent: bye\n  examples: |\n    - 再见\n    - 拜拜\n'
+                    '- intent: greeting\n  examples: |\n    - 你好\n    - 早上好\n', encoding='utf-8')
+    path = str(tmp_path / 'model.npz')
+    assert IntentClassifier.load_or_train(path, str(data)).predict('拜拜') == ('bye', 1.0)
+    assert os.path.exists(path)
+
+    data.write_text(data.read_text(encoding='utf-8') + '    - 晚安\n', encoding='utf-8')
+    os.utime(str(data), (os.path.getmtime(path) + 10, os.path.getmtime(path) + 10))
+    assert IntentClassifier.load_or_train(path, str(data)).predict('晚安') == ('greeting', 1.0)
+
+
+@pytest.mark.asyncio
+async def test_tiered_intent(classifier: IntentClassifier):
+    rasa = FakeRasa()
+    intent = TieredIntent(classifier, rasa, threshold=0.8)
+    assert await intent.predict('再见') == ('bye', 1.0)
+    assert await intent.predict('这个小区的快递柜坏了三天') == ('nlu_fallback', 0.3)
+    assert rasa.texts == ['这个小区的快递柜坏了三天']
+
+    stats = intent.stats()
+    assert (stats['requests'], stats['local'], stats['fallthrough']) == (2, 1, 1)
+
+
+def test_agreement_report(classifier: IntentClassifier):
+    texts = ['再见', '你好', '这个小区的快递柜坏了三天']
+    report = agreement_report(classifier, texts, ['bye', 'asking', 'complain'], thresholds=(0.99,))
+    result = report['thresholds'][0]
+    assert report['messages'] == 3
+    assert result['local'] == 2
+    assert result['agreement'] == 0.5
+    assert result['disagreements'] == {'asking->greeting': 1}
+
+
+def test_holdout_split():
+    examples = load_nlu()
+    train, test = holdout_split(examples, 0.2)
+    assert {intent for _, intent in train} == {intent for _, intent in examples}
+    assert 0 < len(test) <= 0.25 * len(examples)
+    seen = {normalize_intent_text(text) for text, _ in train}
+    assert all(normalize_intent_text(text) not in seen for text, _ in test)
+
+    classifier = IntentClassifier().fit([text for text, _ in train], [intent for _, intent in train])
+    report = agreement_report(classifier, [text for text, _ in test], [intent for _, intent in test], thresholds=(0.0,))
+    # the held-out texts are unseen, none of them is answered by an exact match
+    assert report['messages'] == len(test)
+    assert all(classifier.predict(text)[1] < 1.0 for text, _ in test)
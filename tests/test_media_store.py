@@ -0,0 +1,47 @@
+"""Unit test for the content-addressed media store"""
+from __future__ import annotations
+import pytest
+from wechaty import FileBox, MessageType, UrlLink
+
+from antigen_bot.media_store import MediaStore
+
+
+class FakeMessage:
+    def __init__(self, type_: MessageType, content) -> None:
+        self._type = type_
+        self.content = content
+
+    def type(self) -> MessageType:
+        return self._type
+
+    def text(self) -> str:
+        return self.content
+
+    async def to_file_box(self) -> FileBox:
+        return FileBox.from_buffer(self.content, name='answer.jpg')
+
+    async def to_url_link(self) -> UrlLink:
+        return self.content
+
+
+@pytest.mark.asyncio
+async def test_store_dedup_and_reload(tmp_path):
+    store = MediaStore(str(tmp_path))
+    image = await store.to_ref(FakeMessage(MessageType.MESSAGE_TYPE_IMAGE, b'jpeg bytes'))
+    again = await store.to_ref(FakeMessage(MessageType.MESSAGE_TYPE_IMAGE, b'jpeg bytes'))
+    text = await store.to_ref(FakeMessage(MessageType.MESSAGE_TYPE_TEXT, '核酸9点开始'))
+
+    assert image == again and image['type'] == 'image'
+    assert store.stats() == {'objects': 1, 'bytes': 10, 'dedup_hits': 1}
+    assert store.load(text) == '核酸9点开始'
+
+    # a new store reads the manifest and loads the file without any download
+    reloaded = MediaStore(str(tmp_path))
+    file_box = reloaded.load(image)
+    assert file_box.name == 'answer.jpg'
+    with open(reloaded.path(image['digest']), 'rb') as f:
+        assert f.read() == b'jpeg bytes'
+    assert reloaded.stats()['objects'] == 1
+
+    assert reloaded.load({'type': 'image', 'digest': '0' * 64, 'name': 'lost.jpg'}) is None
+    assert await store.to_ref(FakeMessage(MessageType.MESSAGE_TYPE_CONTACT, '')) is None
@@ -0,0 +1,79 @@
+"""Unit test for the shared message context"""
+from __future__ import annotations
+import asyncio
+from collections import Counter
+from types import SimpleNamespace
+import pytest
+
+from antigen_bot.message_context import MessageContext, parse_quote
+
+
+class CountingMessage:
+    """message which counts the puppet calls"""
+    def __init__(self, text: str) -> None:
+        self._text = text
+        self.calls: Counter = Counter()
+        self._room = SimpleNamespace(room_id='room', ready=self._ready, topic=self._topic)
+
+    async def _ready(self) -> None:
+        self.calls['ready'] += 1
+
+    async def _topic(self) -> str:
+        self.calls['topic'] += 1
+        return 'topic'
+
+    def room(self):
+        return self._room
+
+    def text(self) -> str:
+        return self._text
+
+    async def mention_self(self) -> bool:
+        self.calls['mention_self'] += 1
+        await asyncio.sleep(0)
+        return True
+
+    async def mention_text(self) -> str:
+        self.calls['mention_text'] += 1
+        return self._text.replace('@bot ', '')
+
+
+class CountingIntent:
+    """sync intent predictor"""
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def predict(self, text: str):
+        self.calls += 1
+        return 'greeting', 0.9
+
+
+@pytest.mark.asyncio
+async def test_context_memoize():
+    """every property should be computed once no matter how many readers"""
+    msg = CountingMessage('@bot 你好')
+    ctx = MessageContext(msg)
+    intent = CountingIntent()
+
+    results = await asyncio.gather(*[ctx.mention_self() for _ in range(3)])
+    assert results == [True, True, True]
+    assert await ctx.topic() == 'topic'
+    assert await ctx.topic() == 'topic'
+    assert await ctx.intent(intent) == ('greeting', 0.9)
+    assert await ctx.intent(intent) == ('greeting', 0.9)
+
+    assert msg.calls == Counter(mention_self=1, ready=1, topic=1, mention_text=1)
+    assert intent.calls == 1
+
+    # another predictor gets its own answer, not the memo of the first one
+    other = CountingIntent()
+    other.predict = lambda text: ('bye', 0.8)
+    assert await ctx.intent(other) == ('bye', 0.8)
+    assert await ctx.intent(intent) == ('greeting', 0.9)
+
+
+def test_parse_quote():
+    """split the quote message into quote and reply"""
+    text = '「张三：核酸几点」\n- - - - - - - - - - - - - - -\n八点开始'
+    assert parse_quote(text) == ('核酸几点', '八点开始')
+    assert parse_quote('核酸几点') is None
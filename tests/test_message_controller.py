@@ -0,0 +1,119 @@
+"""Unit test for the message router of MessageController"""
+from __future__ import annotations
+from types import SimpleNamespace
+from typing import List, Optional
+import pytest
+from wechaty import MessageType
+
+from antigen_bot.message_controller import message_controller
+
+
+class FakeMessage:
+    """the minimal message used by the route predicates"""
+    def __init__(self, message_id: str, text: str, room_id: Optional[str] = None) -> None:
+        self.message_id = message_id
+        self._text = text
+        self._room = SimpleNamespace(room_id=room_id) if room_id else None
+
+    def is_self(self) -> bool:
+        return False
+
+    def talker(self):
+        return SimpleNamespace(contact_id='talker')
+
+    def type(self) -> MessageType:
+        return MessageType.MESSAGE_TYPE_TEXT
+
+    def room(self):
+        return self._room
+
+    def text(self) -> str:
+        return self._text
+
+
+class BasePlugin:
+    """records the messages it handled"""
+    def __init__(self, name: str, claim: bool = False) -> None:
+        self.name = name
+        self.claim = claim
+        self.handled: List[str] = []
+
+
+class LowPlugin(BasePlugin):
+    @message_controller.route(priority=0)
+    async def on_message(self, msg) -> None:
+        self.handled.append(msg.message_id)
+
+
+class HighPlugin(BasePlugin):
+    @message_controller.route(priority=10, prefixes=['#'])
+    async def on_message(self, msg) -> None:
+        self.handled.append(msg.message_id)
+        if self.claim:
+            message_controller.disable_all_plugins(msg.message_id)
+
+
+def _setup(claim: bool):
+    low, high = LowPlugin('low'), HighPlugin('high', claim=claim)
+    bot = SimpleNamespace(_plugin_manager=SimpleNamespace(_plugins={'low': low, 'high': high}))
+    low.bot = high.bot = bot
+    message_controller.plugin_names = []
+    message_controller.init_plugins(bot)
+    return low, high
+
+
+@pytest.mark.asyncio
+async def test_first_claimant_stops_dispatch():
+    """the high priority plugin claims the message so the low one never sees it"""
+    low, high = _setup(claim=True)
+    msg = FakeMessage('route-1', '#command')
+
+    # wechaty calls every plugin, only the first call dispatches
+    await low.on_message(msg)
+    await high.on_message(msg)
+
+    assert high.handled == ['route-1']
+    assert low.handled == []
+
+
+@pytest.mark.asyncio
+async def test_predicates_skip_plugin():
+    """the prefix predicate should skip the plugin without calling it"""
+    low, high = _setup(claim=True)
+    msg = FakeMessage('route-2', 'hello')
+    await low.on_message(msg)
+
+    assert high.handled == []
+    assert low.handled == ['route-2']
+    assert message_controller.stats()['routes']['high']['skipped'] >= 1
+
+
+class AlwaysPlugin(BasePlugin):
+    @message_controller.route(priority=0, always=True)
+    async def on_message(self, msg) -> None:
+        self.handled.append(msg.message_id)
+
+
+@pytest.mark.asyncio
+async def test_always_route_and_stopped_plugin():
+    """an always-on plugin sees claimed messages, a stopped plugin sees nothing"""
+    from wechaty.plugin import PluginStatus
+
+    low, high, always = LowPlugin('low'), HighPlugin('high', claim=True), AlwaysPlugin('always')
+    status = {'low': PluginStatus.Running, 'high': PluginStatus.Running, 'always': PluginStatus.Running}
+    bot = SimpleNamespace(_plugin_manager=SimpleNamespace(
+        _plugins={'low': low, 'high': high, 'always': always}, plugin_status=status.get))
+    low.bot = high.bot = always.bot = bot
+    message_controller.plugin_names = []
+    message_controller.init_plugins(bot)
+
+    await low.on_message(FakeMessage('route-3', '#command'))
+    assert high.handled == ['route-3']
+    assert low.handled == []
+    assert always.handled == ['route-3']
+
+    status['high'] = PluginStatus.Stopped
+    await low.on_message(FakeMessage('route-4', '#command'))
+    assert high.handled == ['route-3']
+    assert low.handled == ['route-4']
+    assert always.handled == ['route-3', 'route-4']
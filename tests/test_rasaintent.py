@@ -0,0 +1,79 @@
+"""Unit test for the async rasa intent client"""
+from __future__ import annotations
+import asyncio
+import pytest
+from aiohttp import web
+
+from utils.rasaintent import AsyncRasaIntent, normalize_intent_text
+
+
+def test_normalize_intent_text():
+    assert normalize_intent_text('  好的！ ') == '好的'
+    assert normalize_intent_text('Hello   World') == 'hello world'
+
+
+@pytest.mark.asyncio
+async def test_cache_and_coalesce(tmp_path):
+    """the same text is only sent to rasa once"""
+    calls = []
+
+    async def parse(request: web.Request):
+        data = await request.json()
+        calls.append(data['text'])
+        await asyncio.sleep(0.01)
+        return web.json_response({'intent': {'name': 'praise', 'confidence': 0.9}})
+
+    app = web.Application()
+    app.router.add_post('/model/parse', parse)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    intent = AsyncRasaIntent(logs=str(tmp_path), port=str(port))
+    try:
+        results = await asyncio.gather(intent.predict('谢谢'), intent.predict('谢谢！'), intent.predict('好的'))
+        assert results == [('praise', 0.9)] * 3
+        assert await intent.predict('谢谢') == ('praise', 0.9)
+
+        assert sorted(calls) == ['好的', '谢谢']
+        stats = intent.stats()
+        assert stats['coalesced'] == 1
+        assert stats['hits'] == 1
+        assert stats['batches'] == 1
+    finally:
+        await AsyncRasaIntent._get_session().close()
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_original_text_sent_and_logged(tmp_path):
+    """the cache is keyed by the normalized text, rasa and the log get the user's text"""
+    calls = []
+
+    async def parse(request: web.Request):
+        data = await request.json()
+        calls.append(data['text'])
+        return web.json_response({'intent': {'name': 'greeting', 'confidence': 0.9}})
+
+    app = web.Application()
+    app.router.add_post('/model/parse', parse)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    intent = AsyncRasaIntent(logs=str(tmp_path), port=str(port))
+    try:
+        assert await intent.check()
+        assert await intent.predict('Hello  World！') == ('greeting', 0.9)
+        assert await intent.predict('hello world') == ('greeting', 0.9)
+        assert calls == ['苍老师德艺双馨', 'Hello  World！']
+        for handler in intent.logger.handlers:
+            handler.flush()
+        assert 'text: Hello  World！---Intent: greeting' in (tmp_path / 'intent_LTE.log').read_text(encoding='utf-8')
+    finally:
+        await AsyncRasaIntent._get_session().close()
+        await runner.cleanup()
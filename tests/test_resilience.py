@@ -0,0 +1,149 @@
+"""Unit test for the upstream service guards"""
+from __future__ import annotations
+import asyncio
+import time
+
+import pytest
+
+from antigen_bot.resilience import (
+    BulkheadFull, CircuitOpen, Policy, Resilience, ServiceGuard, policy_from_env
+)
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def fail():
+    raise ConnectionError('upstream down')
+
+
+async def ok():
+    return 'ok'
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_and_probes():
+    clock = Clock()
+    guard = ServiceGuard('yuan', Policy(failures=2, reset_timeout=30), clock=clock)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            await guard.call(fail)
+    assert guard.breaker.state == 'open'
+
+    # fail fast without calling the service
+    calls = []
+
+    async def tracked():
+        calls.append(1)
+        return 'ok'
+    with pytest.raises(CircuitOpen):
+        await guard.call(tracked)
+    assert not calls
+
+    # a failed half-open probe opens the circuit again
+    clock.now = 31
+    with pytest.raises(ConnectionError):
+        await guard.call(fail)
+    assert guard.breaker.state == 'open'
+
+    clock.now = 62
+    assert await guard.call(ok) == 'ok'
+    assert guard.breaker.state == 'closed'
+    stats = guard.stats()
+    assert (stats['failures'], stats['rejected_open'], stats['opened']) == (3, 1, 2)
+
+
+@pytest.mark.asyncio
+async def test_deadline_and_fallback():
+    guard = ServiceGuard('rasa', Policy(timeout=0.05))
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    start = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        await guard.call(slow)
+    assert time.monotonic() - start < 0.5
+
+    assert await guard.call(fail, fallback=('nlu_fallback', 0.0)) == ('nlu_fallback', 0.0)
+    assert await guard.call(fail, fallback=lambda e: type(e).__name__) == 'ConnectionError'
+    assert guard.stats()['timeouts'] == 1
+    assert guard.stats()['fallbacks'] == 2
+
+
+@pytest.mark.asyncio
+async def test_bulkhead():
+    guard = ServiceGuard('pangu', Policy(max_concurrency=1, max_waiting=1))
+    release = asyncio.Event()
+    running = []
+
+    async def busy():
+        running.append(1)
+        await release.wait()
+        return 'done'
+
+    first = asyncio.ensure_future(guard.call(busy))
+    second = asyncio.ensure_future(guard.call(busy))
+    await asyncio.sleep(0.01)
+    assert (guard.running, guard.waiting) == (1, 1)
+    with pytest.raises(BulkheadFull):
+        await guard.call(busy)
+
+    release.set()
+    assert await asyncio.gather(first, second) == ['done', 'done']
+    assert len(running) == 2
+    # the rejected calls do not count as failures of the service
+    assert guard.breaker.consecutive_failures == 0
+
+
+@pytest.mark.asyncio
+async def test_call_blocking():
+    guard = ServiceGuard('antigen_image', Policy(timeout=0.05))
+    assert await guard.call_blocking(lambda x: x * 2, 21) == 42
+    with pytest.raises(asyncio.TimeoutError):
+        await guard.call_blocking(time.sleep, 0.3)
+
+
+@pytest.mark.asyncio
+async def test_blocking_call_holds_its_slot_until_the_thread_finishes():
+    guard = ServiceGuard('pangu', Policy(timeout=0.05, max_concurrency=1, max_waiting=0))
+    with pytest.raises(asyncio.TimeoutError):
+        await guard.call_blocking(time.sleep, 0.3)
+    # the caller is released, the thread still runs and keeps the slot
+    assert guard.running == 1
+    with pytest.raises(BulkheadFull):
+        await guard.call_blocking(lambda: 'late')
+
+    await asyncio.sleep(0.3)
+    assert guard.running == 0
+
+    # a cancelled caller (e.g. a losing hedge) does not free the slot either
+    task = asyncio.ensure_future(guard.call_blocking(time.sleep, 0.2))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.sleep(0.01)
+    assert guard.running == 1
+    await asyncio.sleep(0.3)
+    assert guard.running == 0
+    assert guard.stats()['abandoned'] == 2
+    assert await guard.call_blocking(lambda: 'done') == 'done'
+
+
+@pytest.mark.asyncio
+async def test_registry_and_env(monkeypatch):
+    monkeypatch.setenv('CA_RESILIENCE_YUAN', 'timeout=5,failures=1')
+    assert policy_from_env('yuan', Policy()) == Policy(timeout=5.0, failures=1)
+
+    resilience = Resilience()
+    guard = resilience.service('yuan')
+    assert resilience.service('yuan') is guard
+    with pytest.raises(ConnectionError):
+        await guard.call(fail)
+    assert 'yuan: open' in resilience.summary()
+    resilience.reset('yuan')
+    assert resilience.stats()['yuan']['state'] == 'closed'
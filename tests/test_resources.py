@@ -0,0 +1,73 @@
+"""Unit test for the shared resource registry"""
+from __future__ import annotations
+import threading
+import time
+
+import pytest
+
+from antigen_bot.resources import ResourceRegistry, _keyword_filter, registry
+
+
+def test_created_once_across_threads():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        time.sleep(0.05)
+        return object()
+
+    resources = ResourceRegistry()
+    resources.register('model', factory)
+    assert not resources.loaded('model')
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(resources.get('model'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len({id(result) for result in results}) == 1
+    stats = resources.stats()['model']
+    assert stats['loaded'] and stats['users'] == 8
+    assert stats['load_ms'] >= 50
+
+
+def test_failed_factory_is_retried():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError('model not ready')
+        return 'model'
+
+    resources = ResourceRegistry()
+    resources.register('model', factory)
+    with pytest.raises(RuntimeError):
+        resources.get('model')
+    assert resources.get('model') == 'model'
+    assert resources.stats()['model']['errors'] == 1
+
+
+def test_register_and_unknown():
+    resources = ResourceRegistry()
+    resources.register('model', lambda: 1)
+    with pytest.raises(ValueError):
+        resources.register('model', lambda: 2)
+    resources.register('model', lambda: 2, replace=True)
+    assert resources.get('model') == 2
+    with pytest.raises(KeyError):
+        resources.get('missing')
+
+
+def test_default_resources(tmp_path, monkeypatch):
+    assert {'keyword_filter', 'intent', 'similarity', 'generation'} <= set(registry.stats())
+    # the plugins share one filter instance, loaded by a registry of this test only
+    monkeypatch.chdir(tmp_path)
+    resources = ResourceRegistry()
+    resources.register('keyword_filter', _keyword_filter)
+    gfw = resources.get('keyword_filter')
+    assert resources.get('keyword_filter') is gfw
+    assert gfw.filter('今天天气很好') is None
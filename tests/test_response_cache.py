@@ -0,0 +1,124 @@
+"""Unit test for the semantic response cache"""
+from __future__ import annotations
+
+import pytest
+
+from antigen_bot.response_cache import ResponseCache
+
+
+class FakeSimilarity:
+    def __init__(self, similar=(), fail: bool = False) -> None:
+        self.similar = set(similar)
+        self.fail = fail
+        self.pairs = []
+
+    async def similarity(self, pairs):
+        if self.fail:
+            raise RuntimeError('busy')
+        self.pairs.extend(pairs)
+        return [{'similarity': 0.95 if (text1, text2) in self.similar else 0.3} for text1, text2 in pairs]
+
+
+@pytest.mark.asyncio
+async def test_similar_input_hits_and_rotates():
+    cache = ResponseCache(threshold=0.85, candidates=2)
+    assert await cache.get('quanjia', '你家狗又乱叫') is None
+    cache.add('quanjia', '你家狗又乱叫', '大家都是邻居，有话好好说', latency=2.0)
+    cache.add('quanjia', '你家狗又乱叫', '消消气，狗也不是故意的')
+    cache.add('quanjia', '你家狗又乱叫', '第三个回复超出了候选数')
+
+    replies = [await cache.get('quanjia', '你家狗又乱叫了！') for _ in range(3)]
+    assert replies == ['大家都是邻居，有话好好说', '消消气，狗也不是故意的', '大家都是邻居，有话好好说']
+
+    # a different quarrel or template is a miss
+    assert await cache.get('quanjia', '别吵了') is None
+    assert await cache.get('another', '你家狗又乱叫') is None
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['size'], stats['replies']) == (3, 3, 1, 2)
+    assert stats['saved_latency_s'] == 6.0
+
+
+def test_only_the_same_input_joins_entry():
+    cache = ResponseCache()
+    cache.add('quanjia', '别吵了', '好好说话')
+    cache.add('quanjia', '别吵了！', '都少说两句')
+    cache.add('quanjia', '别吵了别吵了', '冷静一下')
+    assert cache.stats()['size'] == 2
+    assert cache.stats()['replies'] == 3
+
+
+@pytest.mark.asyncio
+async def test_similarity_model_confirms_the_hit():
+    similarity = FakeSimilarity(similar=[('你家狗又乱叫了！', '你家狗又乱叫')])
+    cache = ResponseCache(threshold=0.5, similarity=similarity)
+    cache.add('quanjia', '你家狗又乱叫', '大家都是邻居，有话好好说')
+    cache.add('quanjia', '你家又乱停车', '车停好就行了')
+
+    assert await cache.get('quanjia', '你家狗又乱叫了！') == '大家都是邻居，有话好好说'
+    # close in characters, but the model tells it is another quarrel
+    assert await cache.get('quanjia', '你家孩子又乱叫') is None
+    # the same input needs no model
+    calls = len(similarity.pairs)
+    assert await cache.get('quanjia', '你家又乱停车') == '车停好就行了'
+    assert len(similarity.pairs) == calls
+
+    similarity.fail = True
+    assert await cache.get('quanjia', '你家狗又乱叫了！') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['unconfirmed'], stats['confirm_errors']) == (2, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_ttl_and_size_eviction():
+    now = [0.0]
+    cache = ResponseCache(max_size=2, ttl=100, clock=lambda: now[0])
+    cache.add('quanjia', '你家狗又乱叫', 'a')
+    cache.add('quanjia', '楼上装修太吵了', 'b')
+    assert await cache.get('quanjia', '你家狗又乱叫') == 'a'
+    cache.add('quanjia', '车又停在消防通道', 'c')
+    # the least recently used entry is evicted
+    assert await cache.get('quanjia', '楼上装修太吵了') is None
+    assert await cache.get('quanjia', '你家狗又乱叫') == 'a'
+
+    now[0] = 100.0
+    assert await cache.get('quanjia', '你家狗又乱叫') is None
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['expirations'] == 2
+    assert stats['size'] == 0
+
+
+@pytest.mark.asyncio
+async def test_expired_best_match_does_not_hide_a_live_one():
+    now = [0.0]
+    cache = ResponseCache(threshold=0.5, ttl=100, clock=lambda: now[0])
+    cache.add('quanjia', '你家狗又乱叫了', 'old')
+    now[0] = 60.0
+    cache.add('quanjia', '你家的狗又乱叫', 'new')
+    now[0] = 120.0
+    assert await cache.get('quanjia', '你家狗又乱叫了！') == 'new'
+    assert cache.stats()['expirations'] == 1
+
+
+@pytest.mark.asyncio
+async def test_skip_empty_and_disable():
+    cache = ResponseCache()
+    cache.add('quanjia', '？？？', 'reply')
+    cache.add('quanjia', '别吵了', '')
+    assert cache.stats()['size'] == 0
+
+    disabled = ResponseCache(threshold=1.1)
+    disabled.add('quanjia', '别吵了', '好好说话')
+    assert await disabled.get('quanjia', '别吵了吧') is None
+    with pytest.raises(ValueError):
+        ResponseCache(candidates=0)
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.setenv('CA_RESPONSE_CACHE_THRESHOLD', '0.9')
+    monkeypatch.setenv('CA_RESPONSE_CACHE_SIZE', '10')
+    cache = ResponseCache.from_env()
+    assert cache.threshold == 0.9
+    assert cache.max_size == 10
+    assert cache.candidates == 3
@@ -0,0 +1,83 @@
+"""Unit test for the delayed job scheduler"""
+from __future__ import annotations
+import asyncio
+import pytest
+
+from antigen_bot.scheduler import DelayedJobScheduler
+
+
+@pytest.mark.asyncio
+async def test_jobs_run_in_time_order():
+    """jobs run by their time, not by the order they are scheduled"""
+    done = []
+
+    async def handler(job):
+        done.append(job.payload['name'])
+
+    scheduler = DelayedJobScheduler()
+    scheduler.register('notice', handler)
+    scheduler.start()
+    scheduler.schedule('notice', 0.2, {'name': 'late'})
+    scheduler.schedule('notice', 0.05, {'name': 'early'})
+    await asyncio.sleep(0.3)
+    await scheduler.close()
+
+    assert done == ['early', 'late']
+    assert scheduler.stats()['executed'] == 2
+
+
+@pytest.mark.asyncio
+async def test_list_and_cancel_by_owner():
+    done = []
+
+    async def handler(job):
+        done.append(job.job_id)
+
+    scheduler = DelayedJobScheduler()
+    scheduler.register('notice', handler)
+    scheduler.start()
+    job = scheduler.schedule('notice', 0.05, owner='alice')
+    scheduler.schedule('notice', 60, owner='bob')
+
+    assert [item.job_id for item in scheduler.jobs('alice')] == [job.job_id]
+    assert scheduler.cancel(job.job_id, owner='bob') is None
+    assert scheduler.cancel(job.job_id, owner='alice') is job
+    await asyncio.sleep(0.1)
+    await scheduler.close()
+
+    assert not done
+    assert scheduler.jobs('alice') == []
+    assert len(scheduler) == 1
+
+
+@pytest.mark.asyncio
+async def test_jobs_survive_restart(tmp_path):
+    """pending jobs are replayed from the journal, the overdue ones run at once"""
+    path = str(tmp_path / 'jobs.jsonl')
+    now = [1000.0]
+
+    async def noop(job):
+        pass
+
+    scheduler = DelayedJobScheduler(path, clock=lambda: now[0])
+    scheduler.register('notice', noop)
+    kept = scheduler.schedule('notice', 10, {'reply': '核酸检测'}, owner='alice')
+    cancelled = scheduler.schedule('notice', 20, owner='alice')
+    scheduler.cancel(cancelled.job_id)
+
+    done = []
+
+    async def handler(job):
+        done.append(job)
+
+    now[0] = 2000.0
+    restarted = DelayedJobScheduler(path, clock=lambda: now[0])
+    restarted.register('notice', handler)
+    assert [job.job_id for job in restarted.jobs('alice')] == [kept.job_id]
+
+    restarted.start()
+    await asyncio.sleep(0.05)
+    await restarted.close()
+
+    assert [job.payload for job in done] == [{'reply': '核酸检测'}]
+    assert len(DelayedJobScheduler(path)) == 0
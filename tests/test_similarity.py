@@ -0,0 +1,72 @@
+"""Unit test for the similarity service"""
+from __future__ import annotations
+import asyncio
+import time
+import pytest
+
+from antigen_bot.similarity import SimilarityOverloaded, SimilarityService
+
+
+class FakeModel:
+    """character overlap instead of the Taskflow model"""
+    loads = 0
+
+    def __init__(self, task: str) -> None:
+        FakeModel.loads += 1
+
+    def __call__(self, pairs):
+        result = []
+        for text1, text2 in pairs:
+            common = len(set(text1) & set(text2)) / max(len(set(text1) | set(text2)), 1)
+            result.append({'text1': text1, 'text2': text2, 'similarity': common})
+        return result
+
+
+class SlowModel(FakeModel):
+    def __call__(self, pairs):
+        time.sleep(0.2)
+        return super().__call__(pairs)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+async def test_similarity(backend):
+    service = SimilarityService(backend=backend, workers=1, factory=FakeModel)
+    try:
+        result = await service.similarity([['核酸几点', '核酸几点'], ['核酸几点', '团购']])
+        await service.similarity([['a', 'b']])
+    finally:
+        service.close()
+
+    assert [item['similarity'] for item in result] == [1.0, 0.0]
+    assert service.stats()['calls'] == 2
+    if backend == 'thread':
+        # the model is loaded once per worker, not once per call
+        assert FakeModel.loads == 1
+        assert service.stats()['models_loaded'] == 1
+
+
+@pytest.mark.asyncio
+async def test_timeout_and_overload():
+    service = SimilarityService(workers=1, max_queue_size=1, timeout=0.05, factory=SlowModel)
+    try:
+        with pytest.raises(asyncio.TimeoutError):
+            await service.similarity([['a', 'b']])
+
+        # the timed out batch still runs in the executor and counts against the queue
+        assert service.stats()['pending'] == 1
+        with pytest.raises(SimilarityOverloaded):
+            await service.similarity([['a', 'b']])
+
+        await asyncio.sleep(0.3)
+        assert service.stats()['pending'] == 0
+        with pytest.raises(asyncio.TimeoutError):
+            await service.similarity([['a', 'b']])
+        await asyncio.sleep(0.3)
+    finally:
+        service.close()
+
+    stats = service.stats()
+    assert stats['timeouts'] == 2
+    assert stats['rejected'] == 1
+    assert stats['pending'] == 0
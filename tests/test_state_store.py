@@ -0,0 +1,95 @@
+"""Unit test for the embedded state store"""
+from __future__ import annotations
+import json
+
+import pytest
+
+from antigen_bot.state_store import StateStore
+
+
+@pytest.fixture
+def store(tmp_path) -> StateStore:
+    store = StateStore(str(tmp_path / 'state.db'))
+    yield store
+    store.close()
+
+
+def test_set_get_delete(store: StateStore):
+    store.set('qunzhu', 'wxid_1', ['room_1'])
+    store.set('qun_faq', ('wxid_1', '核酸几点'), {'text': '八点'})
+    assert store.get('qunzhu', 'wxid_1') == ['room_1']
+    assert store.get('qun_faq', ('wxid_1', '核酸几点')) == {'text': '八点'}
+    assert store.get('qunzhu', 'wxid_2', 'missing') == 'missing'
+
+    store.delete('qunzhu', 'wxid_1')
+    assert store.get('qunzhu', 'wxid_1') is None
+    assert store.sync(timeout=5)
+    assert store.get('qunzhu', 'wxid_1') is None
+    assert store.get('qun_faq', ('wxid_1', '核酸几点')) == {'text': '八点'}
+
+
+def test_value_is_copied_on_set(store: StateStore):
+    rooms = ['room_1']
+    store.set('qunzhu', 'wxid_1', rooms)
+    rooms.append('room_2')
+    assert store.sync(timeout=5)
+    assert store.get('qunzhu', 'wxid_1') == ['room_1']
+
+
+def test_items_and_nested(store: StateStore):
+    for i in range(300):
+        store.set('qun_faq', (f'owner_{i % 3}', f'question_{i}'), i)
+    store.delete('qun_faq', ('owner_0', 'question_0'))
+
+    # the pending and committed changes read the same
+    for _ in range(2):
+        nested = store.nested('qun_faq')
+        assert sorted(nested) == ['owner_0', 'owner_1', 'owner_2']
+        assert len(nested['owner_0']) == 99
+        assert nested['owner_1']['question_1'] == 1
+        assert len(store.items('qun_faq')) == 299
+        assert store.sync(timeout=5)
+
+    stats = store.stats()
+    assert stats['pending'] == 0
+    assert stats['errors'] == 0
+    assert stats['batches'] < 300
+
+
+@pytest.mark.asyncio
+async def test_flush_and_reopen(tmp_path):
+    path = str(tmp_path / 'state.db')
+    store = StateStore(path)
+    store.set('room_dict', 'room_1', 'wxid_1')
+    assert await store.flush(timeout=5)
+    store.close()
+
+    store = StateStore(path)
+    assert store.items('room_dict') == {'room_1': 'wxid_1'}
+    store.close()
+
+
+def test_import_json_once(store: StateStore, tmp_path):
+    path = tmp_path / 'qun_faq.json'
+    path.write_text(json.dumps({'wxid_1': {'核酸几点': ['八点'], '团购': ['明天']}}), encoding='utf-8')
+    assert store.import_json('qun_faq', str(path), depth=2)
+    assert store.nested('qun_faq') == {'wxid_1': {'核酸几点': ['八点'], '团购': ['明天']}}
+
+    store.delete('qun_faq', ('wxid_1', '团购'))
+    assert not store.import_json('qun_faq', str(path), depth=2)
+    assert store.nested('qun_faq') == {'wxid_1': {'核酸几点': ['八点']}}
+
+    codes = tmp_path / 'verify_codes.json'
+    codes.write_text(json.dumps(['1234', '5678']), encoding='utf-8')
+    assert store.import_json('verify_codes', str(codes))
+    assert store.items('verify_codes') == {'1234': True, '5678': True}
+    assert not store.import_json('missing', str(tmp_path / 'missing.json'))
+
+
+def test_shared(tmp_path):
+    path = str(tmp_path / 'shared.db')
+    store = StateStore.shared(path)
+    assert StateStore.shared(path) is store
+    store.close()
+    assert StateStore.shared(path) is not store
+    StateStore.shared(path).close()
@@ -0,0 +1,333 @@
+"""
+Aho–Corasick 多模式匹配：一次扫描找出文本中所有的关键词及其位置
+DFAFilter 和 SimpleFilter 都基于它实现
+自动机可以编译成二进制文件（带关键词文件的校验和），多个进程 mmap 同一个文件，不必各自重建
+关键词数据来自：https://github.com/fwwdn/sensitive-stop-words
+
+编译：python -m utils.ACFilter [keywords] [keywords.acf]
+"""
+from __future__ import annotations
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import threading
+import uuid
+from array import array
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+KEYWORDS_FILE = os.path.join(os.path.split(os.path.realpath(__file__))[0], 'keywords')
+
+# magic, sha256 of the source, states, edges, bytes of the keywords, byte order
+HEADER = struct.Struct('<8s32sIIII')
+MAGIC = b'ACFILT01'
+BYTE_ORDER = 0 if sys.byteorder == 'little' else 1
+
+Buffer = Union[array, memoryview]
+
+
+def load_keywords(path: str = KEYWORDS_FILE) -> List[str]:
+    """the lower-cased, non-empty keywords of the file"""
+    with open(path, encoding='utf-8') as f:
+        return [keyword for keyword in (line.lower().strip() for line in f) if keyword]
+
+
+def source_checksum(path: str) -> bytes:
+    """sha256 of the keyword file"""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+class Automaton:
+    """the flat arrays of a compiled automaton, state 0 is the root:
+        offsets[s]:offsets[s + 1]  the slice of the edges of state s,
+        labels / targets           the edge characters (sorted code points)
+                                   and their target states,
+        fail[s]                    the failure link,
+        length[s]                  the length of the keyword ending at s, or 0,
+        output[s]                  the nearest state on the failure chain
+                                   which ends a keyword, or 0.
+
+    the arrays are either in memory or zero-copy views of a mapped file.
+    """
+    def __init__(self, offsets: Buffer, labels: Buffer, targets: Buffer, fail: Buffer, length: Buffer, output: Buffer,
+                 keywords: bytes, checksum: bytes = b'', path: Optional[str] = None) -> None:
+        self.offsets, self.labels, self.targets = offsets, labels, targets
+        self.fail, self.length, self.output = fail, length, output
+        self._keywords = keywords
+        self.checksum = checksum
+        self.path = path
+        self.starts = frozenset(labels[offsets[0]:offsets[1]])
+
+    @property
+    def keywords(self) -> List[str]:
+        return bytes(self._keywords).decode('utf-8').split('\n') if len(self._keywords) else []
+
+    @property
+    def size(self) -> int:
+        return len(self.length)
+
+    @classmethod
+    def compile(cls, keywords: List[str], checksum: bytes = b'') -> 'Automaton':
+        """build the automaton of the distinct, lower-cased keywords"""
+        # 1. the trie, with dicts only while building
+        children: List[Dict[int, int]] = [{}]
+        length = array('I', [0])
+        for keyword in keywords:
+            state = 0
+            for char in keyword:
+                code = ord(char)
+                target = children[state].get(code)
+                if target is None:
+                    target = len(children)
+                    children[state][code] = target
+                    children.append({})
+                    length.append(0)
+                state = target
+            length[state] = len(keyword)
+
+        # 2. the failure and output links, breadth first
+        size = len(children)
+        fail = array('I', bytes(4 * size))
+        output = array('I', bytes(4 * size))
+        queue = deque(children[0].values())
+        while queue:
+            state = queue.popleft()
+            for code, target in children[state].items():
+                link = fail[state]
+                while link and code not in children[link]:
+                    link = fail[link]
+                link = children[link].get(code, 0)
+                if link == target:
+                    link = 0
+                fail[target] = link
+                output[target] = link if length[link] else output[link]
+                queue.append(target)
+
+        # 3. the flat edge arrays
+        offsets = array('I', [0])
+        labels = array('I')
+        targets = array('I')
+        for edges in children:
+            for code in sorted(edges):
+                labels.append(code)
+                targets.append(edges[code])
+            offsets.append(len(labels))
+
+        return cls(offsets, labels, targets, fail, length, output, '\n'.join(keywords).encode('utf-8'), checksum)
+
+    def save(self, path: str) -> None:
+        """write the automaton file, atomically replacing the old one"""
+        keywords = bytes(self._keywords)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, self.checksum, self.size, len(self.labels), len(keywords), BYTE_ORDER))
+            for values in (self.offsets, self.labels, self.targets, self.fail, self.length, self.output):
+                f.write(values if isinstance(values, memoryview) else values.tobytes())
+            f.write(keywords)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def read_header(path: str) -> Optional[Tuple[bytes, int, int, int]]:
+        """(checksum, states, edges, bytes of the keywords) of a valid file, else None"""
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(HEADER.size)
+        except OSError:
+            return None
+        if len(header) < HEADER.size:
+            return None
+        magic, checksum, states, edges, keyword_bytes, byte_order = HEADER.unpack(header)
+        if magic != MAGIC or byte_order != BYTE_ORDER:
+            return None
+        expected = HEADER.size + 4 * (4 * states + 1 + 2 * edges) + keyword_bytes
+        if os.path.getsize(path) != expected:
+            return None
+        return checksum, states, edges, keyword_bytes
+
+    @classmethod
+    def open(cls, path: str) -> 'Automaton':
+        """map the automaton file, the pages are shared by all of the processes mapping it"""
+        header = cls.read_header(path)
+        if header is None:
+            raise ValueError(f'invalid automaton file: {path}')
+        checksum, states, edges, keyword_bytes = header
+
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(buffer)
+        arrays = []
+        position = HEADER.size
+        for count in (states + 1, edges, edges, states, states, states):
+            arrays.append(view[position:position + 4 * count].cast('I'))
+            position += 4 * count
+        keywords = view[position:position + keyword_bytes]
+        return cls(*arrays, keywords=keywords, checksum=checksum, path=path)
+
+
+def compile_file(source: str = KEYWORDS_FILE, target: Optional[str] = None) -> Tuple[Automaton, bool]:
+    """map the compiled automaton of the keyword file, compile it first if the source changed
+
+    Returns:
+        Tuple[Automaton, bool]: the mapped automaton, if it is compiled now
+    """
+    target = target or source + '.acf'
+    checksum = source_checksum(source)
+    header = Automaton.read_header(target)
+    compiled = header is None or header[0] != checksum
+    if compiled:
+        directory = os.path.dirname(target)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        keywords = list(dict.fromkeys(load_keywords(source)))
+        Automaton.compile(keywords, checksum).save(target)
+    return Automaton.open(target), compiled
+
+
+class ACFilter:
+    """Aho–Corasick keyword filter over the lower-cased keywords
+
+    the automaton is compiled from the keywords in memory, or mapped from the
+    compiled file of a keyword file with `load`. `reload` swaps in the new
+    automaton as one reference, a scan in progress finishes on the old one.
+    The keywords added after `load` are kept across `reload`, on top of the
+    keywords of the file.
+    """
+    def __init__(self, keywords: Optional[Iterable[str]] = None) -> None:
+        self._automaton = Automaton.compile([])
+        self._added: List[str] = []
+        # the keywords added on top of the loaded keyword file
+        self._runtime: List[str] = []
+        self._seen = set()
+        self._lock = threading.Lock()
+        self.source: Optional[str] = None
+        self.compiled: Optional[str] = None
+        if keywords is not None:
+            self.extend(keywords)
+            self.build()
+
+    @property
+    def keywords(self) -> List[str]:
+        return self._automaton.keywords + self._added
+
+    def add(self, keyword: str) -> None:
+        """add a keyword, the automaton is rebuilt on the next scan"""
+        keyword = keyword.lower().strip()
+        if not keyword:
+            return
+        if not self._seen and self._automaton.size > 1:
+            self._seen.update(self._automaton.keywords)
+        if keyword not in self._seen:
+            self._seen.add(keyword)
+            self._added.append(keyword)
+            if self.source is not None:
+                self._runtime.append(keyword)
+
+    def extend(self, keywords: Iterable[str]) -> None:
+        for keyword in keywords:
+            self.add(keyword)
+
+    def build(self) -> None:
+        """compile the keywords into the automaton, in memory
+
+        the checksum of the keyword file is kept, so `reload` still tells
+        whether the file changed.
+        """
+        with self._lock:
+            self._automaton = Automaton.compile(self.keywords, self._automaton.checksum)
+            self._added = []
+
+    def load(self, source: str = KEYWORDS_FILE, compiled: Optional[str] = None) -> bool:
+        """map the compiled automaton of the keyword file, compiling it only if the file changed
+
+        Returns:
+            bool: if the file is compiled now
+        """
+        automaton, changed = compile_file(source, compiled)
+        with self._lock:
+            self._automaton = automaton
+            self._added = []
+            self._runtime = []
+            self._seen = set()
+            self.source, self.compiled = source, automaton.path
+        return changed
+
+    def reload(self) -> bool:
+        """pick up the changes of the keyword file without restarting
+
+        Returns:
+            bool: if the keywords changed
+        """
+        if self.source is None:
+            return False
+        checksum = self._automaton.checksum
+        runtime = self._runtime
+        self.load(self.source, self.compiled)
+        self.extend(runtime)
+        return self._automaton.checksum != checksum
+
+    def scan(self, message: str, first: bool = False) -> List[Tuple[int, str]]:
+        """all of the (offset, keyword) in the lower-cased message, in the order of their end
+
+        Args:
+            message (str): the text to scan
+            first (bool): stop at the first keyword found
+        """
+        if self._added:
+            self.build()
+        automaton = self._automaton
+        message = message.lower()
+        offsets, labels, targets = automaton.offsets, automaton.labels, automaton.targets
+        fail, length, output = automaton.fail, automaton.length, automaton.output
+        starts = automaton.starts
+        matches = []
+        state = 0
+        for end, char in enumerate(message, 1):
+            code = ord(char)
+            # most of the chars start no keyword, skip them at the root
+            if not state and code not in starts:
+                continue
+            while True:
+                lo, hi = offsets[state], offsets[state + 1]
+                if lo < hi:
+                    i = bisect_left(labels, code, lo, hi)
+                    if i < hi and labels[i] == code:
+                        state = targets[i]
+                        break
+                if not state:
+                    break
+                state = fail[state]
+
+            hit = state if length[state] else output[state]
+            while hit:
+                start = end - length[hit]
+                matches.append((start, message[start:end]))
+                if first:
+                    return matches
+                hit = output[hit]
+        return matches
+
+    def filter(self, message: str) -> Optional[str]:
+        """the first keyword in the message, None if there is none"""
+        matches = self.scan(message, first=True)
+        return matches[0][1] if matches else None
+
+    def stats(self) -> Dict[str, Union[int, str, None]]:
+        automaton = self._automaton
+        return {
+            'keywords': len(automaton.keywords) + len(self._added),
+            'states': automaton.size,
+            'edges': len(automaton.labels),
+            'mapped': automaton.path,
+            'checksum': automaton.checksum.hex()[:12],
+        }
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else KEYWORDS_FILE
+    target = sys.argv[2] if len(sys.argv) > 2 else None
+    automaton, changed = compile_file(source, target)
+    print(f"{automaton.path}: {'compiled' if changed else 'up to date'}, {automaton.size} states, {len(automaton.labels)} edges")
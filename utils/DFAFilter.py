@@ -9,11 +9,17 @@ https://github.com/guojia60180/sensitive-words-filter
 import os
 import logging
 
+try:
+    from utils.ACFilter import ACFilter, KEYWORDS_FILE
+except ImportError:
+    from ACFilter import ACFilter, KEYWORDS_FILE
 
-class DFAFilter:
-    '''有穷状态机完成'''
+
+class DFAFilter(ACFilter):
+    '''有穷状态机完成，现由 Aho–Corasick 自动机实现，一次扫描即可'''
 
     def __init__(self, logs: str = '.utils'):
+        super().__init__()
         # 1. create the cache_dir
         self.cache_dir = logs
         os.makedirs(self.cache_dir, exist_ok=True)
@@ -29,58 +35,15 @@ class DFAFilter:
         file_handler.setLevel('INFO')
         self.logger.addHandler(file_handler)
 
-        self.keywords_chains = {}
-        self.delimit = '\x00'
-
-    def add(self, keyword):
-        keyword = keyword.lower()
-        chars = keyword.strip()
-        if not chars:
-            return
-
-        level = self.keywords_chains
-        for i in range(len(chars)):
-            if chars[i] in level:
-                level = level[chars[i]]
-            else:
-                if not isinstance(level, dict):
-                    break
-
-                for j in range(i, len(chars)):
-                    level[chars[j]] = {}
-                    last_level, last_char = level, chars[j]
-                    level=level[chars[j]]
-
-                last_level[last_char] = {self.delimit: 0}
-                break
-
-        if i == len(chars)-1:
-            level[self.delimit] = 0
-
-    file = os.path.split(os.path.realpath(__file__))[0]
-
-    def parse(self, path=os.path.join(file, 'keywords')):
-        with open(path, encoding='utf-8') as f:
-            for keyword in f:
-                self.add(keyword.strip())
+    def parse(self, path=KEYWORDS_FILE):
+        # the compiled automaton is cached in cache_dir and mapped, rebuilt only when the keywords change
+        self.load(path, os.path.join(self.cache_dir, os.path.basename(path) + '.acf'))
 
     def filter(self, message):
-        message = message.lower()
-        start = 0
-        while start < len(message):
-            res = []
-            level = self.keywords_chains
-            for char in message[start:]:
-                if char in level:
-                    if self.delimit not in level[char]:
-                        level = level[char]
-                        res.append(char)
-                    else:
-                        res.append(char)
-                        self.logger.info(f"文本：{message}'，检测到敏感词：{''.join(res)}")
-                        return ''.join(res)
-            start += 1
-        return None
+        keyword = super().filter(message)
+        if keyword:
+            self.logger.info(f"文本：{message.lower()}'，检测到敏感词：{keyword}")
+        return keyword
 
 
 if __name__ == "__main__":
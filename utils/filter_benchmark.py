@@ -0,0 +1,238 @@
+"""
+敏感词过滤器的基准测试（非交互），输出 JSON 报告，便于在同一台机器上对比过滤器的改动
+测试语料为合成的类微信消息：短聊天、长篇转发通知、含大量关键词前缀的对抗输入
+
+python -m utils.filter_benchmark --sizes 1000,10000 --output filter_benchmark.json
+"""
+from __future__ import annotations
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from antigen_bot.dispatcher import percentile
+
+try:
+    from utils.ACFilter import ACFilter, KEYWORDS_FILE, load_keywords
+    from utils.DFAFilter import DFAFilter
+    from utils.simpleFilter import SimpleFilter
+except ImportError:
+    from ACFilter import ACFilter, KEYWORDS_FILE, load_keywords
+    from DFAFilter import DFAFilter
+    from simpleFilter import SimpleFilter
+
+CHAT_PHRASES = [
+    '今天核酸几点开始', '团购的菜到了吗', '收到', '谢谢群主', '好的', '几号楼可以下楼了', '快递放哪里了',
+    '明天还要做核酸吗', '请问抗原什么时候发', '我家还没领到', '辛苦志愿者', '哈哈哈', '[强]', '有人换鸡蛋吗',
+    '物业电话多少', '药店开门了没', '@小助理 在吗', '求一箱牛奶', '接龙+1', '小区封到什么时候',
+]
+NOTICE_SENTENCES = [
+    '各位居民朋友大家好，', '根据街道疫情防控工作安排，', '明天上午八点至十一点在小区南门开展全员核酸检测，',
+    '请大家按楼栋顺序有序下楼，', '全程佩戴口罩，保持两米间距，', '行动不便的老人请提前联系楼长上门采样，',
+    '团购物资将于下午统一配送到各楼栋门口，', '请勿聚集，领取后及时回家，', '如有发热、咳嗽等症状请及时报告，',
+    '感谢大家的理解与配合！', '详情请见居委会公众号通知。', '\n',
+]
+
+
+def chat_messages(n: int, rng: random.Random) -> List[str]:
+    """short chat, one to three phrases"""
+    return [''.join(rng.choice(CHAT_PHRASES) for _ in range(rng.randint(1, 3))) for _ in range(n)]
+
+
+def notice_messages(n: int, rng: random.Random) -> List[str]:
+    """long pasted notices, a few hundred to two thousand characters"""
+    messages = []
+    for _ in range(n):
+        length = rng.randint(300, 2000)
+        parts = []
+        while sum(map(len, parts)) < length:
+            parts.append(rng.choice(NOTICE_SENTENCES))
+        messages.append(''.join(parts))
+    return messages
+
+
+def adversarial_messages(n: int, rng: random.Random, keywords: List[str]) -> List[str]:
+    """many partial keyword prefixes, each walking deep into the automaton and failing"""
+    matcher = ACFilter(keywords)
+    prefixes = [keyword[:-1] for keyword in keywords if len(keyword) > 2 and not matcher.filter(keyword[:-1])]
+    return [
+        ''.join(rng.choice(prefixes) + rng.choice('，。') for _ in range(rng.randint(10, 60)))
+        for _ in range(n)
+    ]
+
+
+def generate(kind: str, n: int, seed: int, keywords: List[str], hit_rate: float = 0.01) -> List[str]:
+    """the corpus of the kind, with a keyword inserted into `hit_rate` of the messages"""
+    rng = random.Random(f'{kind}-{seed}')
+    if kind == 'chat':
+        messages = chat_messages(n, rng)
+    elif kind == 'notice':
+        messages = notice_messages(n, rng)
+    elif kind == 'adversarial':
+        messages = adversarial_messages(n, rng, keywords)
+    else:
+        raise ValueError(f'unknown corpus: {kind}')
+
+    for i in range(n):
+        if rng.random() < hit_rate:
+            position = rng.randint(0, len(messages[i]))
+            messages[i] = messages[i][:position] + rng.choice(keywords) + messages[i][position:]
+    return messages
+
+
+class NaiveFilter:
+    """the linear `in` scan over all of the keywords, the baseline"""
+    def __init__(self) -> None:
+        self.keywords = load_keywords()
+
+    def filter(self, message: str) -> Optional[str]:
+        message = message.lower()
+        for keyword in self.keywords:
+            if keyword in message:
+                return keyword
+        return None
+
+
+def engines(cache_dir: str) -> Dict[str, Callable[[], Any]]:
+    """the factories of the filters to benchmark, add a new engine here"""
+    def dfa():
+        gfw = DFAFilter(logs=cache_dir)
+        gfw.parse()
+        return gfw
+
+    return {
+        'naive': NaiveFilter,
+        'dfa': dfa,
+        'simple': lambda: SimpleFilter(logs=cache_dir),
+        'ac_memory': lambda: ACFilter(load_keywords()),
+    }
+
+
+def measure_build(factory: Callable[[], Any]) -> Dict[str, Any]:
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    engine = factory()
+    build_seconds = time.perf_counter() - start
+    heap_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # the mapped automaton file is shared page cache, not heap
+    mapped = engine.stats().get('mapped') if hasattr(engine, 'stats') else None
+    return {
+        'engine': engine,
+        'build_ms': round(build_seconds * 1000, 3),
+        'heap_bytes': heap_bytes,
+        'mapped_bytes': os.path.getsize(mapped) if mapped else 0,
+    }
+
+
+def measure_scan(engine: Any, messages: List[str], repeat: int) -> Dict[str, Any]:
+    """the best of `repeat` timed runs, then one traced run for the peak memory"""
+    best = None
+    for _ in range(repeat):
+        latencies = []
+        hits = 0
+        start = time.perf_counter()
+        for message in messages:
+            t = time.perf_counter_ns()
+            if engine.filter(message):
+                hits += 1
+            latencies.append(time.perf_counter_ns() - t)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            best = (elapsed, latencies, hits)
+
+    elapsed, latencies, hits = best
+    tracemalloc.start()
+    for message in messages:
+        engine.filter(message)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'messages': len(messages),
+        'hits': hits,
+        'msgs_per_sec': round(len(messages) / elapsed, 1) if elapsed else None,
+        'p50_us': round(percentile(latencies, 50) / 1000, 2),
+        'p99_us': round(percentile(latencies, 99) / 1000, 2),
+        'scan_peak_bytes': peak_bytes,
+    }
+
+
+def run(sizes: List[int], corpora: List[str], engine_names: Optional[List[str]] = None,
+        seed: int = 0, repeat: int = 3, cache_dir: Optional[str] = None) -> Dict[str, Any]:
+    """benchmark the engines over the corpora, return the report"""
+    keywords = load_keywords()
+    cache_dir = cache_dir or tempfile.mkdtemp(prefix='filter_benchmark_')
+    factories = engines(cache_dir)
+    engine_names = engine_names or list(factories)
+    unknown = set(engine_names) - set(factories)
+    if unknown:
+        raise ValueError(f'unknown engines: {sorted(unknown)}')
+
+    report: Dict[str, Any] = {
+        'meta': {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'keywords': len(keywords),
+            'keywords_file': KEYWORDS_FILE,
+            'seed': seed,
+            'repeat': repeat,
+            'sizes': sizes,
+            'corpora': corpora,
+        },
+        'engines': {},
+        'results': [],
+    }
+    corpus_cache = {(kind, n): generate(kind, n, seed, keywords) for kind in corpora for n in sizes}
+
+    for name in engine_names:
+        build = measure_build(factories[name])
+        engine = build.pop('engine')
+        report['engines'][name] = build
+        for (kind, n), messages in corpus_cache.items():
+            result = measure_scan(engine, messages, repeat)
+            result.update({'engine': name, 'corpus': kind, 'size': n,
+                           'chars': sum(map(len, messages))})
+            report['results'].append(result)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description='benchmark the sensitive keyword filters')
+    parser.add_argument('--sizes', default='1000,10000', help='comma separated corpus sizes')
+    parser.add_argument('--corpora', default='chat,notice,adversarial', help='comma separated corpora')
+    parser.add_argument('--engines', default='', help='comma separated engines, all by default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='', help='the json report file, stdout by default')
+    args = parser.parse_args(argv)
+
+    report = run(
+        sizes=[int(size) for size in args.sizes.split(',')],
+        corpora=args.corpora.split(','),
+        engine_names=args.engines.split(',') if args.engines else None,
+        seed=args.seed,
+        repeat=args.repeat,
+    )
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
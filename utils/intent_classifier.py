@@ -0,0 +1,302 @@
+"""
+本地轻量意图识别：字符 n-gram 特征 + softmax 线性模型（numpy），由 intents.yml 训练
+置信度达到阈值的直接返回，否则再交给 rasa，寒暄、感谢、再见之类的短句不必走 HTTP
+
+训练并导出：python -m utils.intent_classifier train [--data utils/intents.yml] [--output .utils/intent_model.npz]
+与 rasa 的一致率报告：python -m utils.intent_classifier report --texts texts.txt [--port 5005]（texts.txt 是真实的消息记录，一行一条）
+没有消息记录时：python -m utils.intent_classifier report [--holdout 0.2]，按意图分层留出一部分训练样例，用其余样例训练，在留出的样例上和标注比对
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+import zlib
+from collections import Counter, deque
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from antigen_bot.dispatcher import percentile
+
+try:
+    from utils.rasaintent import AsyncRasaIntent, normalize_intent_text
+except ImportError:
+    from rasaintent import AsyncRasaIntent, normalize_intent_text
+
+INTENTS_FILE = os.path.join(os.path.split(os.path.realpath(__file__))[0], 'intents.yml')
+MODEL_FILE = os.path.join('.utils', 'intent_model.npz')
+
+
+def load_nlu(path: str = INTENTS_FILE) -> List[Tuple[str, str]]:
+    """the (example, intent) pairs of a rasa nlu yml file"""
+    examples = []
+    intent = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            matched = re.match(r'^-\s*intent:\s*(\S+)', line)
+            if matched:
+                intent = matched.group(1)
+                continue
+            matched = re.match(r'^\s+-\s+(.+)$', line)
+            if matched and intent:
+                examples.append((matched.group(1).strip(), intent))
+    return examples
+
+
+class IntentClassifier:
+    """multinomial logistic regression over hashed char n-grams
+
+    the whole model is three arrays: weights (dim x intents, float32), bias
+    and the intent labels. The normalized training examples are kept too, an
+    exact match answers with confidence 1.0.
+    """
+    def __init__(self, dim: int = 2048, ngram_range: Tuple[int, int] = (1, 3)) -> None:
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.labels: List[str] = []
+        self.weights = np.zeros((dim, 0), dtype=np.float32)
+        self.bias = np.zeros(0, dtype=np.float32)
+        self.exact: Dict[str, int] = {}
+
+    def _ngrams(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """the hashed n-gram ids of the text and their l2 normalized counts"""
+        text = normalize_intent_text(text)
+        counts: Dict[int, float] = {}
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                key = zlib.crc32(text[i:i + n].encode('utf-8')) % self.dim
+                counts[key] = counts.get(key, 0.0) + 1.0
+        ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        norm = np.linalg.norm(values)
+        return ids, values / norm if norm else values
+
+    def features(self, text: str) -> np.ndarray:
+        ids, values = self._ngrams(text)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        vector[ids] = values
+        return vector
+
+    def fit(self, texts: Sequence[str], intents: Sequence[str], epochs: int = 500, lr: float = 10.0, l2: float = 1e-4) -> 'IntentClassifier':
+        """full batch gradient descent on the cross entropy"""
+        self.labels = sorted(set(intents))
+        index = {label: i for i, label in enumerate(self.labels)}
+        x = np.stack([self.features(text) for text in texts])
+        y = np.array([index[intent] for intent in intents])
+        targets = np.eye(len(self.labels), dtype=np.float32)[y]
+
+        self.weights = np.zeros((self.dim, len(self.labels)), dtype=np.float32)
+        self.bias = np.zeros(len(self.labels), dtype=np.float32)
+        for _ in range(epochs):
+            gradient = (self._softmax(x @ self.weights + self.bias) - targets) / len(texts)
+            self.weights -= lr * (x.T @ gradient + l2 * self.weights)
+            self.bias -= lr * gradient.sum(axis=0)
+
+        # an example labelled with more than one intent is not an exact answer
+        labelled: Dict[str, set] = {}
+        for text, intent in zip(texts, intents):
+            labelled.setdefault(normalize_intent_text(text), set()).add(index[intent])
+        self.exact = {text: next(iter(ids)) for text, ids in labelled.items() if len(ids) == 1}
+        return self
+
+    @staticmethod
+    def _softmax(logits: np.ndarray) -> np.ndarray:
+        logits = logits - logits.max(axis=-1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        if not self.labels:
+            raise RuntimeError('the intent classifier is not trained')
+        exact = self.exact.get(normalize_intent_text(text))
+        if exact is not None:
+            return self.labels[exact], 1.0
+        ids, values = self._ngrams(text)
+        probability = self._softmax(values @ self.weights[ids] + self.bias)
+        best = int(probability.argmax())
+        return self.labels[best], float(probability[best])
+
+    def save(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        exact_texts = list(self.exact)
+        tmp_path = f'{path}.tmp.npz'
+        np.savez_compressed(
+            tmp_path,
+            weights=self.weights,
+            bias=self.bias,
+            labels=np.array(self.labels),
+            exact_texts=np.array(exact_texts),
+            exact_labels=np.array([self.exact[text] for text in exact_texts], dtype=np.int32),
+            config=np.array([self.dim, *self.ngram_range], dtype=np.int32),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'IntentClassifier':
+        with np.load(path) as data:
+            dim, low, high = (int(value) for value in data['config'])
+            classifier = cls(dim=dim, ngram_range=(low, high))
+            classifier.weights = data['weights']
+            classifier.bias = data['bias']
+            classifier.labels = [str(label) for label in data['labels']]
+            classifier.exact = {str(text): int(label) for text, label in zip(data['exact_texts'], data['exact_labels'])}
+        return classifier
+
+    @classmethod
+    def train(cls, data: str = INTENTS_FILE, **kwargs) -> 'IntentClassifier':
+        examples = load_nlu(data)
+        return cls(**kwargs).fit([text for text, _ in examples], [intent for _, intent in examples])
+
+    @classmethod
+    def load_or_train(cls, path: str = MODEL_FILE, data: str = INTENTS_FILE) -> 'IntentClassifier':
+        """the exported model, trained and exported again when the nlu file is newer"""
+        if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(data):
+            return cls.load(path)
+        classifier = cls.train(data)
+        classifier.save(path)
+        return classifier
+
+
+class TieredIntent:
+    """the local classifier first, rasa only when it is unsure
+
+    a drop-in for `AsyncRasaIntent` (`predict` returns (intent, confidence)).
+    """
+    def __init__(self, local: IntentClassifier, remote: Any, threshold: float = 0.8) -> None:
+        self.local = local
+        self.remote = remote
+        self.threshold = threshold
+
+        self.requests = 0
+        self.local_answers = 0
+        self.fallthrough = 0
+        self._latencies = deque(maxlen=1000)
+
+    async def check(self) -> bool:
+        """check if the rasa server behind the local classifier is running"""
+        return await self.remote.check()
+
+    async def predict(self, text: str) -> Tuple[str, float]:
+        self.requests += 1
+        start = time.perf_counter()
+        intent, confidence = self.local.predict(text)
+        self._latencies.append(time.perf_counter() - start)
+        if confidence >= self.threshold:
+            self.local_answers += 1
+            return intent, confidence
+        self.fallthrough += 1
+        return await self.remote.predict(text)
+
+    def stats(self) -> dict:
+        return {
+            'threshold': self.threshold,
+            'requests': self.requests,
+            'local': self.local_answers,
+            'local_rate': round(self.local_answers / self.requests, 4) if self.requests else 0.0,
+            'fallthrough': self.fallthrough,
+            'local_latency_p99': round(percentile(self._latencies, 99), 6),
+            'remote': self.remote.stats() if hasattr(self.remote, 'stats') else None,
+        }
+
+
+def holdout_split(examples: Sequence[Tuple[str, str]], fraction: float = 0.2,
+                  seed: int = 0) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    """(train, test) split of the (example, intent) pairs, stratified by intent
+
+    every intent keeps at least one training example, and a test example
+    equal to a training one after normalization is dropped, so the test
+    texts are all unseen by the classifier.
+    """
+    if not 0 < fraction < 1:
+        raise ValueError('fraction should be between 0 and 1')
+    by_intent: Dict[str, List[Tuple[str, str]]] = {}
+    for example in examples:
+        by_intent.setdefault(example[1], []).append(example)
+    rng = np.random.default_rng(seed)
+    train, test = [], []
+    for intent in sorted(by_intent):
+        group = by_intent[intent]
+        order = rng.permutation(len(group))
+        size = min(int(round(len(group) * fraction)), len(group) - 1)
+        test.extend(group[i] for i in order[:size])
+        train.extend(group[i] for i in order[size:])
+    seen = {normalize_intent_text(text) for text, _ in train}
+    return train, [(text, intent) for text, intent in test if normalize_intent_text(text) not in seen]
+
+
+def agreement_report(classifier: IntentClassifier, texts: Iterable[str], rasa: Iterable[str],
+                     thresholds: Sequence[float] = (0.5, 0.6, 0.7, 0.8, 0.9)) -> Dict[str, Any]:
+    """how many rasa round trips each threshold saves, and how often the local answer agrees with rasa
+
+    Args:
+        texts: the messages
+        rasa: the rasa intent of each message
+    """
+    predictions = [(classifier.predict(text), expected) for text, expected in zip(texts, rasa)]
+    report: Dict[str, Any] = {'messages': len(predictions), 'thresholds': []}
+    for threshold in thresholds:
+        answered = [(intent, expected) for (intent, confidence), expected in predictions if confidence >= threshold]
+        agreed = sum(1 for intent, expected in answered if intent == expected)
+        disagreements = Counter(f'{expected}->{intent}' for intent, expected in answered if intent != expected)
+        report['thresholds'].append({
+            'threshold': threshold,
+            'local': len(answered),
+            'saved_rate': round(len(answered) / len(predictions), 4) if predictions else 0.0,
+            'agreement': round(agreed / len(answered), 4) if answered else None,
+            'disagreements': dict(disagreements.most_common(10)),
+        })
+    return report
+
+
+async def _rasa_intents(texts: List[str], port: str) -> List[str]:
+    rasa = AsyncRasaIntent(port=port)
+    try:
+        return [intent for intent, _ in await asyncio.gather(*(rasa.predict(text) for text in texts))]
+    finally:
+        await AsyncRasaIntent._get_session().close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='the local intent classifier')
+    commands = parser.add_subparsers(dest='command', required=True)
+    train = commands.add_parser('train', help='train from the nlu yml and export the model')
+    train.add_argument('--data', default=INTENTS_FILE)
+    train.add_argument('--output', default=MODEL_FILE)
+    report = commands.add_parser('report', help='the agreement with rasa on a message log, or with the labels of a held-out split')
+    report.add_argument('--model', default=MODEL_FILE)
+    report.add_argument('--texts', default='', help='the message log, one message per line')
+    report.add_argument('--port', default='5005')
+    report.add_argument('--data', default=INTENTS_FILE)
+    report.add_argument('--holdout', type=float, default=0.2, help='without --texts, the fraction of the nlu examples held out')
+    report.add_argument('--thresholds', default='0.5,0.6,0.7,0.8,0.9')
+    args = parser.parse_args(argv)
+
+    if args.command == 'train':
+        start = time.perf_counter()
+        classifier = IntentClassifier.train(args.data)
+        classifier.save(args.output)
+        print(f'{len(classifier.labels)} intents trained in {time.perf_counter() - start:.2f}s, exported to {args.output}')
+        return
+
+    thresholds = [float(threshold) for threshold in args.thresholds.split(',')]
+    if args.texts:
+        classifier = IntentClassifier.load_or_train(args.model)
+        with open(args.texts, 'r', encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+        expected = asyncio.run(_rasa_intents(texts, args.port))
+    else:
+        # the training examples all match exactly (confidence 1.0), only unseen ones tell the threshold
+        train, test = holdout_split(load_nlu(args.data), args.holdout)
+        classifier = IntentClassifier().fit([text for text, _ in train], [intent for _, intent in train])
+        texts, expected = [text for text, _ in test], [intent for _, intent in test]
+    print(json.dumps(agreement_report(classifier, texts, expected, thresholds), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,31 @@
 import urllib3
 import json
 import os
+import re
+import time
+import asyncio
 import logging
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+import aiohttp
+
+from antigen_bot.resilience import resilience
+
+
+def _get_logger(cache_dir: str) -> logging.Logger:
+    """the intent logger writing into <cache_dir>/intent_LTE.log"""
+    log_formatter = logging.Formatter(fmt='%(levelname)s - %(message)s')
+    logger = logging.getLogger('rasaintent')
+    logger.handlers = []
+    logger.setLevel('INFO')
+    logger.propagate = False
+    log_file = os.path.join(cache_dir, 'intent_LTE.log')
+
+    file_handler = logging.FileHandler(log_file, 'a', encoding='utf-8')
+    file_handler.setLevel('INFO')
+    file_handler.setFormatter(log_formatter)
+    logger.addHandler(file_handler)
+    return logger
 
 
 class RasaIntent:
@@ -25,17 +49,7 @@ class RasaIntent:
         os.makedirs(self.cache_dir, exist_ok=True)
 
         # 2. save the log info into <plugin_name>.log file
-        log_formatter = logging.Formatter(fmt='%(levelname)s - %(message)s')
-        self.logger = logging.getLogger('rasaintent')
-        self.logger.handlers = []
-        self.logger.setLevel('INFO')
-        self.logger.propagate = False
-        log_file = os.path.join(self.cache_dir, 'intent_LTE.log')
-
-        file_handler = logging.FileHandler(log_file, 'a', encoding='utf-8')
-        file_handler.setLevel('INFO')
-        file_handler.setFormatter(log_formatter)
-        self.logger.addHandler(file_handler)
+        self.logger = _get_logger(self.cache_dir)
 
         # 3. create the http client
         self.http = urllib3.PoolManager()
@@ -69,6 +83,183 @@ class RasaIntent:
         return _intent, _conf
 
 
+def normalize_intent_text(text: str) -> str:
+    """normalize the text for the intent cache, only drop what never changes the intent"""
+    text = re.sub(r'\s+', ' ', text.strip().lower())
+    return text.rstrip('。！!~～.,，、 ')
+
+
+class AsyncRasaIntent:
+    """
+    基于rasa的通用intent识别（异步版本）
+    1. 所有实例共用一个连接池
+    2. 按归一化文本做LRU缓存，寒暄、“好的”、“谢谢”之类的高频短句直接命中；发给rasa和写入日志的仍是原文
+    3. 几毫秒内到达的请求合并为一批，相同文本只请求一次，并发数受限
+    """
+    _session: Optional[aiohttp.ClientSession] = None
+    _shared: Dict[str, 'AsyncRasaIntent'] = {}
+
+    def __init__(
+            self,
+            logs: str = '.utils',
+            port: str = '5005',
+            cache_size: int = 4096,
+            batch_window: float = 0.005,
+            max_concurrency: int = 8,
+            timeout: float = 5,
+            fallback: Optional[Tuple[str, float]] = ('nlu_fallback', 0.0),
+    ) -> None:
+        self.cache_dir = logs
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.logger = _get_logger(self.cache_dir)
+
+        self.rasa_url = 'http://localhost:' + port + '/model/parse'
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.batch_window = batch_window
+        self.max_concurrency = max_concurrency
+        # returned (not cached) when rasa fails or its circuit is open, None to raise
+        self.fallback = fallback
+        self.guard = resilience.service('rasa')
+
+        self._cache: OrderedDict[str, Tuple[str, float]] = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        # (key, the original text sent to rasa)
+        self._batch: List[Tuple[str, str]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self.requests = 0
+        self.hits = 0
+        self.coalesced = 0
+        self.rasa_calls = 0
+        self.errors = 0
+        self.fallbacks = 0
+        self.batches = 0
+        self._latencies = deque(maxlen=1000)
+
+    @classmethod
+    def shared(cls, port: str = '5005', **kwargs) -> 'AsyncRasaIntent':
+        """the process-wide client of the rasa server on the port"""
+        if port not in cls._shared:
+            cls._shared[port] = cls(port=port, **kwargs)
+        return cls._shared[port]
+
+    @classmethod
+    def _get_session(cls) -> aiohttp.ClientSession:
+        if cls._session is None or cls._session.closed:
+            cls._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=60),
+            )
+        return cls._session
+
+    async def check(self) -> bool:
+        """check if the rasa server is running"""
+        try:
+            await self._parse('苍老师德艺双馨')
+            return True
+        except Exception as e:
+            self.logger.error(f'Rasa server not running: {e}')
+            return False
+
+    async def _parse(self, text: str) -> Tuple[str, float]:
+        session = self._get_session()
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with session.post(self.rasa_url, data=json.dumps({'text': text}), timeout=timeout) as response:
+            _result = json.loads(await response.read())
+        return _result['intent']['name'], _result['intent']['confidence']
+
+    async def predict(self, text: str) -> Tuple[str, float]:
+        self.requests += 1
+        key = normalize_intent_text(text)
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        future = self._pending.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[key] = future
+            self._batch.append((key, text))
+            if self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        # shield the shared future, a cancelled caller must not cancel the others
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self.fallback is None:
+                raise
+            self.fallbacks += 1
+            self.logger.warning(f'text: {text}---rasa unavailable, fallback: {e!r}')
+            return self.fallback
+
+    def _flush(self) -> None:
+        """send the requests gathered in the batch window concurrently"""
+        self._flush_handle = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        self.batches += 1
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        for key, text in batch:
+            asyncio.ensure_future(self._resolve(key, text))
+
+    async def _resolve(self, key: str, text: str) -> None:
+        future = self._pending[key]
+        try:
+            async with self._semaphore:
+                start = time.perf_counter()
+                self.rasa_calls += 1
+                _intent, _conf = await self.guard.call(self._parse, text)
+                self._latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            self.errors += 1
+            if not future.done():
+                future.set_exception(e)
+            return
+        finally:
+            del self._pending[key]
+
+        if _conf >= 0.5 and _intent != 'nlu_fallback':
+            self.logger.info(f'text: {text}---Intent: {_intent} confidence: {_conf}')
+        else:
+            self.logger.warning(f'text: {text}---Intent: {_intent} confidence: {_conf}')
+
+        self._cache[key] = (_intent, _conf)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        if not future.done():
+            future.set_result((_intent, _conf))
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def _percentile(q: float) -> float:
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 4)
+        return {
+            'requests': self.requests,
+            'hits': self.hits,
+            'hit_rate': round(self.hits / self.requests, 4) if self.requests else 0.0,
+            'coalesced': self.coalesced,
+            'rasa_calls': self.rasa_calls,
+            'errors': self.errors,
+            'fallbacks': self.fallbacks,
+            'batches': self.batches,
+            'cache_size': len(self._cache),
+            'latency_p50': _percentile(0.5),
+            'latency_p99': _percentile(0.99),
+        }
+
+
 if __name__ == "__main__":
     nlu_intent = RasaIntent()
     print("====意图侦测测试====")
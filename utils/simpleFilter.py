@@ -1,12 +1,17 @@
 """
-简单校验文本是否直接含有keywords里面的关键词
+简单校验文本是否直接含有keywords里面的关键词（Aho–Corasick 一次扫描）
 关键词数据来自：https://github.com/fwwdn/sensitive-stop-words
 """
 import os
 import logging
 
+try:
+    from utils.ACFilter import ACFilter, KEYWORDS_FILE
+except ImportError:
+    from ACFilter import ACFilter, KEYWORDS_FILE
 
-class SimpleFilter:
+
+class SimpleFilter(ACFilter):
 
     def __init__(self, logs: str = '.utils'):
         # 1. create the cache_dir
@@ -24,18 +29,16 @@ class SimpleFilter:
         file_handler.setLevel('INFO')
         self.logger.addHandler(file_handler)
 
-        file = os.path.split(os.path.realpath(__file__))[0]
-        path = os.path.join(file, 'keywords')
-        with open(path, encoding='utf-8') as f:
-            self.keywords = [keyword.lower().strip() for keyword in f]
+        # 3. one Aho–Corasick scan instead of checking the keywords one by one,
+        # the compiled automaton is cached in cache_dir and mapped
+        super().__init__()
+        self.load(KEYWORDS_FILE, os.path.join(self.cache_dir, 'keywords.acf'))
 
     def filter(self, message):
-        message = message.lower()
-        for keyword in self.keywords:
-            if keyword in message:
-                self.logger.info(f"文本：{message}'，检测到敏感词：{keyword}")
-                return keyword
-        return None
+        keyword = super().filter(message)
+        if keyword:
+            self.logger.info(f"文本：{message.lower()}'，检测到敏感词：{keyword}")
+        return keyword
 
 
 if __name__ == "__main__":